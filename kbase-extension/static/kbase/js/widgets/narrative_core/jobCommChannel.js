@@ -55,6 +55,7 @@ define([
 
     const COMM_NAME = 'KBaseJobs',
         ALL_STATUS = 'all_status',
+        RESYNC_JOB_STATUS = 'resync_job_status',
         JOB_STATUS = 'job_status',
         STOP_UPDATE_LOOP = 'stop_update_loop',
         START_UPDATE_LOOP = 'start_update_loop',
@@ -63,9 +64,12 @@ define([
         CANCEL_JOB = 'cancel_job',
         JOB_LOGS = 'job_logs',
         JOB_LOGS_LATEST = 'job_logs_latest',
+        START_LOG_STREAM = 'start_log_stream',
+        STOP_LOG_STREAM = 'stop_log_stream',
         JOB_INFO = 'job_info',
         JOB = 'jobId',
-        CELL = 'cell';
+        CELL = 'cell',
+        JOB_STATUS_PROTOCOL_VERSION = 1;
 
     class JobCommChannel {
         /**
@@ -75,6 +79,8 @@ define([
         constructor() {
             this.runtime = Runtime.make();
             this.jobStates = {};
+            // sequence number of the last job_status_delta message
+            this.lastStatusSeq = null;
             this.handleBusMessages();
         }
 
@@ -151,6 +157,16 @@ define([
                 this.sendCommMessage(JOB_LOGS_LATEST, message.jobId, message.options);
             });
 
+            // Starts streaming new job log lines from the kernel, as they show up.
+            bus.on('request-job-log-stream', (message) => {
+                this.sendCommMessage(START_LOG_STREAM, message.jobId, message.options);
+            });
+
+            // Stops streaming job log lines.
+            bus.on('request-job-log-stream-stop', (message) => {
+                this.sendCommMessage(STOP_LOG_STREAM, message.jobId);
+            });
+
             // Fetches info (not state) about a job. Like the app id, name, and inputs.
             bus.on('request-job-info', (message) => {
                 this.sendCommMessage(JOB_INFO, message.jobId, {
@@ -211,7 +227,8 @@ define([
          *   }
          * }
          * Where msg_type is one of:
-         * start, new_job, job_status, job_status_all, job_info, run_status, job_err, job_canceled,
+         * start, new_job, job_status, job_status_all, job_status_delta, job_info, run_status,
+         * job_err, job_canceled,
          * job_does_not_exist, job_logs, job_comm_err, job_init_err, job_init_partial_err,
          * job_init_lookup_err, result.
          * @param {object} msg
@@ -304,6 +321,16 @@ define([
                         }
                     });
                     break;
+                /*
+                 * Only the job states that changed since the last message, along with
+                 * the ids of jobs that were removed. These are numbered in sequence -
+                 * if one goes missing, ask the kernel to resend everything.
+                 * A "full" message carries every job the kernel has looked up, and every
+                 * job that's been removed.
+                 */
+                case 'job_status_delta':
+                    this.handleJobStatusDelta(msgData);
+                    break;
                 case 'job_info':
                     jobId = msgData.job_id;
                     this.sendBusMessage(JOB, jobId, 'job-info', {
@@ -347,6 +374,15 @@ define([
                     });
                     break;
 
+                case 'job_log_stream':
+                    jobId = msgData.job_id;
+                    this.sendBusMessage(JOB, jobId, 'job-log-stream', {
+                        jobId: jobId,
+                        logs: msgData,
+                        finished: msgData.finished,
+                    });
+                    break;
+
                 case 'job_comm_error':
                     if (msgData) {
                         jobId = msgData.job_id;
@@ -450,6 +486,57 @@ define([
             }
         }
 
+        /**
+         * Applies a job_status_delta message to the cached job states, and sends
+         * job-status or job-deleted messages to the bus for each job affected.
+         * If this message isn't the next in the sequence, or has an unknown protocol
+         * version, this requests a full resync from the kernel.
+         * @param {object} msgData - the message content, with keys protocol, seq, full,
+         *   states, and removed
+         */
+        handleJobStatusDelta(msgData) {
+            if (msgData.protocol !== JOB_STATUS_PROTOCOL_VERSION) {
+                console.warn('Unknown job status protocol version', msgData.protocol);
+                this.sendCommMessage(RESYNC_JOB_STATUS);
+                return;
+            }
+            const inSequence =
+                this.lastStatusSeq !== null && msgData.seq === this.lastStatusSeq + 1;
+            this.lastStatusSeq = msgData.seq;
+
+            Object.keys(msgData.states).forEach((jobId) => {
+                const jobStateMessage = msgData.states[jobId];
+                this.jobStates[jobId] = {
+                    state: jobStateMessage.state,
+                    spec: jobStateMessage.spec,
+                    widgetParameters: jobStateMessage.widget_info,
+                    owner: jobStateMessage.owner,
+                };
+                this.sendBusMessage(JOB, jobId, 'job-status', {
+                    jobId: jobId,
+                    jobState: jobStateMessage.state,
+                    outputWidgetInfo: jobStateMessage.widget_info,
+                });
+            });
+
+            // A full message lists every job that's gone, but jobs the kernel hasn't
+            // looked up yet are missing from its states, so only drop the removed ones.
+            msgData.removed.forEach((jobId) => {
+                if (!this.jobStates[jobId]) {
+                    return;
+                }
+                this.sendBusMessage(JOB, jobId, 'job-deleted', {
+                    jobId: jobId,
+                    via: 'no_longer_exists',
+                });
+                delete this.jobStates[jobId];
+            });
+
+            if (!msgData.full && !inSequence) {
+                this.sendCommMessage(RESYNC_JOB_STATUS);
+            }
+        }
+
         /**
          * Initializes the comm channel to the back end. Stores the generated
          * channel in this.comm.
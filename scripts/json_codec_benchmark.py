@@ -0,0 +1,71 @@
+"""
+Compares the JSON codecs available to the service clients, by encoding and decoding
+some real Narrative payloads from the test data.
+
+Usage (from the repo root):
+    PYTHONPATH=src python scripts/json_codec_benchmark.py [--repeat N] [--scale N]
+
+--scale makes each payload a list of that many copies, to see how the codecs do on
+the tens-of-MB responses a large Narrative or job list can produce.
+"""
+import argparse
+import json
+import os
+import timeit
+from biokbase.narrative.common.rpc import get_json_codec
+
+DATA_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "src",
+    "biokbase",
+    "narrative",
+    "tests",
+    "data",
+)
+PAYLOADS = [
+    "large_narrative_4.0.json",
+    "updater_test_big_nar.json",
+    "app_specs.json",
+    "job_test_data.json",
+]
+
+
+def available_codecs():
+    codecs = list()
+    for name in ["json", "orjson"]:
+        try:
+            codecs.append(get_json_codec(name))
+        except ValueError:
+            print(f"Skipping {name} - not installed")
+    return codecs
+
+
+def run(repeat, scale):
+    codecs = available_codecs()
+    print(
+        f"{'payload':<30}{'size (KB)':>12}"
+        + "".join(
+            f"{c.name + ' enc (ms)':>18}{c.name + ' dec (ms)':>18}" for c in codecs
+        )
+    )
+    for file_name in PAYLOADS:
+        with open(os.path.join(DATA_DIR, file_name)) as f:
+            payload = json.load(f)
+        if scale > 1:
+            payload = [payload] * scale
+        raw = codecs[0].dumps(payload)
+        row = f"{file_name:<30}{len(raw) / 1024:>12.1f}"
+        for codec in codecs:
+            enc = timeit.timeit(lambda: codec.dumps(payload), number=repeat)
+            dec = timeit.timeit(lambda: codec.loads(raw), number=repeat)
+            row += f"{enc * 1000 / repeat:>18.2f}{dec * 1000 / repeat:>18.2f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--scale", type=int, default=1)
+    args = parser.parse_args()
+    run(args.repeat, args.scale)
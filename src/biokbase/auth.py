@@ -5,6 +5,7 @@ This uses the KBase auth2 API to get and manage auth tokens.
 
 import requests
 import json
+from biokbase.narrative.common import sessions
 from biokbase.narrative.common.url_config import URLS
 from biokbase.narrative.common.util import kbase_env
 
@@ -15,12 +16,19 @@ endpt_token_revoke = "/tokens/revoke"
 endpt_user_display = "/users/?list="
 
 
+def _session():
+    """
+    Returns the shared, pooled HTTP session for the auth service.
+    """
+    return sessions.get_session(URLS.auth)
+
+
 def validate_token():
     """
     Validates the currently set auth token. Returns True if valid, False otherwise.
     """
     headers = {"Authorization": get_auth_token()}
-    r = requests.get(token_api_url + endpt_token, headers=headers)
+    r = _session().get(token_api_url + endpt_token, headers=headers)
     if r.status_code == 200:
         return True
     else:
@@ -47,7 +55,7 @@ def get_user_info(token):
     about the user who created the token.
     """
     headers = {"Authorization": token}
-    r = requests.get(token_api_url + endpt_token, headers=headers)
+    r = _session().get(token_api_url + endpt_token, headers=headers)
     if r.status_code != requests.codes.ok:
         r.raise_for_status()
     auth_info = json.loads(r.content)
@@ -92,7 +100,7 @@ def get_agent_token(login_token, token_name="NarrativeAgent"):
     """
     headers = {"Authorization": login_token, "Content-Type": "Application/json"}
     data = json.dumps({"name": token_name})
-    r = requests.post(token_api_url + endpt_token, headers=headers, data=data)
+    r = _session().post(token_api_url + endpt_token, headers=headers, data=data)
     if r.status_code != requests.codes.ok:
         r.raise_for_status()
     agent_token_info = json.loads(r.content)
@@ -108,7 +116,7 @@ def revoke_token(auth_token, revoke_id):
     revoke_id - the id of the token to invalidate
     """
     headers = {"Authorization": auth_token}
-    r = requests.delete(
+    r = _session().delete(
         URLS.auth + endpt_token_revoke + "/" + revoke_id, headers=headers
     )
     if r.status_code != requests.codes.ok:
@@ -117,7 +125,7 @@ def revoke_token(auth_token, revoke_id):
 
 def get_display_names(auth_token: str, user_ids: list) -> dict:
     headers = {"Authorization": auth_token}
-    r = requests.get(
+    r = _session().get(
         token_api_url + endpt_user_display + ",".join(user_ids), headers=headers
     )
     if r.status_code != requests.codes.ok:
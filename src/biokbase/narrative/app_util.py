@@ -1,7 +1,11 @@
 import os
 import re
 import json
+import threading
+from functools import partial
+from types import MappingProxyType
 import biokbase.narrative.clients as clients
+import biokbase.narrative.objectcache as objectcache
 import biokbase.auth
 import time
 
@@ -12,6 +16,13 @@ __author__ = "Bill Riehl <wjriehl@lbl.gov>, Roman Sutormin <rsutormin@lbl.gov>"
 
 app_version_tags = ["release", "beta", "dev"]
 
+# Memoized system variables that need a service call to look up.
+# keys = variable name, values = ((token, workspace), value)
+# A value only gets reused while the token and workspace it was looked up with are the
+# same, so logging in again or switching workspaces means a new lookup.
+_system_variable_cache = dict()
+_system_variable_lock = threading.Lock()
+
 
 def check_tag(tag, raise_exception=False):
     """
@@ -61,23 +72,12 @@ def system_variable(var):
         ws_name = os.environ.get("KB_WORKSPACE_ID", None)
         if ws_name is None:
             return None
-        try:
-            ws_info = clients.get("workspace").get_workspace_info(
-                {"workspace": ws_name}
-            )
-            return ws_info[0]
-        except BaseException:
-            return None
+        return _memoized_system_variable(var, _workspace_id)
     elif var == "user_id":
         token = biokbase.auth.get_auth_token()
         if token is None:
             return None
-        try:
-            user_info = biokbase.auth.get_user_info(token)
-            return user_info.get("user", None)
-        except BaseException:
-            return None
-        # TODO: make this better with more exception handling.
+        return _memoized_system_variable(var, _user_id)
     elif var == "timestamp_epoch_ms":
         # get epoch time in milliseconds
         return int(time.time() * 1000)
@@ -88,6 +88,54 @@ def system_variable(var):
         return None
 
 
+def _workspace_id():
+    try:
+        ws_info = clients.get("workspace").get_workspace_info(
+            {"workspace": os.environ.get("KB_WORKSPACE_ID", None)}
+        )
+        return ws_info[0]
+    except BaseException:
+        return None
+
+
+def _user_id():
+    # TODO: make this better with more exception handling.
+    try:
+        user_info = biokbase.auth.get_user_info(biokbase.auth.get_auth_token())
+        return user_info.get("user", None)
+    except BaseException:
+        return None
+
+
+def _memoized_system_variable(var, lookup):
+    """
+    Returns the value of a system variable looked up with the current token and
+    workspace, only calling lookup() if it hasn't been done yet. Failed lookups (that
+    return None) aren't remembered.
+    """
+    env_key = (
+        biokbase.auth.get_auth_token(),
+        os.environ.get("KB_WORKSPACE_ID", None),
+    )
+    with _system_variable_lock:
+        cached = _system_variable_cache.get(var)
+    if cached is not None and cached[0] == env_key:
+        return cached[1]
+    value = lookup()
+    if value is not None:
+        with _system_variable_lock:
+            _system_variable_cache[var] = (env_key, value)
+    return value
+
+
+def clear_system_variable_cache():
+    """
+    Forgets all the memoized system variables, so they get looked up again next time.
+    """
+    with _system_variable_lock:
+        _system_variable_cache.clear()
+
+
 def map_inputs_from_job(job_inputs, app_spec):
     """
     Unmaps the actual list of job inputs back to the
@@ -119,33 +167,7 @@ def map_inputs_from_job(job_inputs, app_spec):
     field. system variables, constants, etc., are ignored - this function just goes back to the
     original inputs set by the user.
     """
-    input_dict = dict()
-    spec_inputs = app_spec["behavior"]["kb_service_input_mapping"]
-
-    # expect the inputs to be valid. so things in the expected position should be the
-    # right things (either dict, list, singleton)
-    for param in spec_inputs:
-        if "input_parameter" not in param:
-            continue
-        input_param = param.get("input_parameter", None)
-        position = param.get("target_position", 0)
-        prop = param.get("target_property", None)
-        value = job_inputs[position]
-        if prop is not None:
-            value = value.get(prop, None)
-
-        # that's the value. Now, if it was transformed, try to transform it back.
-        if "target_type_transform" in param:
-            transform_type = param["target_type_transform"]
-            if transform_type.startswith("list") and isinstance(value, list):
-                inner_transform = transform_type[5:-1]
-                for i in range(len(value)):
-                    value[i] = _untransform(inner_transform, value[i])
-            else:
-                value = _untransform(transform_type, value)
-
-        input_dict[input_param] = value
-    return input_dict
+    return MappingPlan(app_spec).unmap_inputs(job_inputs)
 
 
 def _untransform(transform_type, value):
@@ -223,60 +245,321 @@ def app_param(p):
     return p_info
 
 
+class ParamIndex(object):
+    """
+    The params of an app spec, as made by SpecManager.app_params, along with the
+    lookups that validating, scaffolding, and mapping them need. SpecManager keeps one
+    for each app version, and it's shared, so none of it should be modified.
+
+    Iterating over this (or params) gives the params in app_params order, so it can be
+    used anywhere a list of spec params is expected.
+
+    params - tuple of all the params
+    by_id - read-only dict of param id -> param
+    grouped - read-only dict of param id -> id of the group param it's in, for the
+        params that are in a group
+    output_params - tuple of the params that name output objects
+    object_params - tuple of the params that take input objects
+    """
+
+    def __init__(self, spec_params):
+        """
+        spec_params - the list of params from SpecManager.app_params
+        """
+        self.params = tuple(spec_params)
+        self.by_id = MappingProxyType(dict((p["id"], p) for p in self.params))
+        grouped = dict()
+        for p in self.params:
+            for child in p.get("parameter_ids") or []:
+                grouped[child] = p["id"]
+        self.grouped = MappingProxyType(grouped)
+        self.output_params = tuple(p for p in self.params if p.get("is_output"))
+        self.object_params = tuple(
+            p for p in self.params if p.get("allowed_types") and not p.get("is_output")
+        )
+
+    def __iter__(self):
+        return iter(self.params)
+
+    def __len__(self):
+        return len(self.params)
+
+    def __contains__(self, param_id):
+        return param_id in self.by_id
+
+
+def param_index(spec_params):
+    """
+    Returns spec_params as a ParamIndex, only making a new one if it isn't one already.
+    """
+    if isinstance(spec_params, ParamIndex):
+        return spec_params
+    return ParamIndex(spec_params)
+
+
 def map_outputs_from_state(state, params, app_spec):
     """
     Returns the dict of output values from a completed app.
     Also returns the output widget.
     """
-    if "behavior" not in app_spec:
-        raise ValueError("Invalid app spec - unable to map outputs")
-    widget_params = dict()
-    out_mapping_key = "kb_service_output_mapping"
-    if out_mapping_key not in app_spec["behavior"]:
-        # for viewers or short-running things, but the inner keys are the same.
-        out_mapping_key = "output_mapping"
-
-    spec_params = dict(
-        (app_spec_param["id"], app_param(app_spec_param))
-        for app_spec_param in app_spec["parameters"]
-    )
+    return MappingPlan(app_spec).map_outputs(state, params)
+
+
+class MappingPlan(object):
+    """
+    The input and output mappings of an app spec, worked out once so they can be
+    applied to any number of runs or finished jobs.
+
+    Each mapping rule becomes a step with its value source, transform, spec param, and
+    target already looked up. The target property paths of the input mapping are split
+    up, and the service_method_output_path of each output rule becomes an accessor.
 
-    for out_param in app_spec["behavior"].get(out_mapping_key, []):
-        value = None
+    The input mapping steps are only made the first time map_input_steps is used, so a
+    plan for a viewer (with no service input mapping) is still cheap to make.
+    SpecManager.get_mapping_plan keeps one for each app spec it has.
+    """
+
+    def __init__(self, app_spec, spec_params=None):
+        """
+        app_spec - the full app spec
+        spec_params - the params from SpecManager.app_params (or a ParamIndex of them),
+            if available
+        """
+        behavior = app_spec.get("behavior")
+        self._has_behavior = behavior is not None
+        if behavior is None:
+            behavior = dict()
+        self._input_mapping = behavior.get("kb_service_input_mapping")
+        self._input_steps = None
+        if spec_params is None:
+            spec_params = [app_param(p) for p in app_spec.get("parameters", [])]
+        self.spec_params = param_index(spec_params)
+        self.spec_params_map = self.spec_params.by_id
+
+        out_mapping_key = "kb_service_output_mapping"
+        if out_mapping_key not in behavior:
+            # for viewers or short-running things, but the inner keys are the same.
+            out_mapping_key = "output_mapping"
+        output_spec_params = dict(
+            (app_spec_param["id"], app_param(app_spec_param))
+            for app_spec_param in app_spec.get("parameters", [])
+        )
+        self._output_steps = [
+            self._output_step(out_param, output_spec_params)
+            for out_param in behavior.get(out_mapping_key, [])
+        ]
+
+        self.output_widget = app_spec.get("widgets", {}).get(
+            "output", "kbaseDefaultNarrativeOutput"
+        )
+        # Yes, sometimes silly people put the string 'null' in their spec.
+        if self.output_widget == "null":
+            self.output_widget = "kbaseDefaultNarrativeOutput"
+
+    @staticmethod
+    def _output_step(out_param, spec_params):
         input_param_id = None
         if "narrative_system_variable" in out_param:
-            value = system_variable(out_param["narrative_system_variable"])
+            get_value = partial(
+                _system_variable_output, out_param["narrative_system_variable"]
+            )
         elif "constant_value" in out_param:
-            value = out_param["constant_value"]
+            get_value = partial(_constant_output, out_param["constant_value"])
         elif "input_parameter" in out_param:
             input_param_id = out_param["input_parameter"]
-            value = params.get(input_param_id, None)
+            get_value = partial(_input_param_output, input_param_id)
         elif "service_method_output_path" in out_param:
-            value = get_result_sub_path(
-                state["job_output"]["result"], out_param["service_method_output_path"]
+            get_value = partial(
+                _job_result_output,
+                _result_path_accessor(out_param["service_method_output_path"]),
             )
+        else:
+            get_value = _no_output
+        return (
+            get_value,
+            out_param.get("target_type_transform"),
+            spec_params.get(input_param_id) if input_param_id else None,
+            out_param.get("target_property", None),
+        )
 
-        spec_param = None
-        if input_param_id:
-            spec_param = spec_params.get(input_param_id)
-        value = transform_param_value(
-            out_param.get("target_type_transform"), value, spec_param
+    def map_outputs(self, state, params):
+        """
+        Returns the output widget and the dict of output values from a completed app,
+        like map_outputs_from_state.
+        """
+        if not self._has_behavior:
+            raise ValueError("Invalid app spec - unable to map outputs")
+        widget_params = dict()
+        for (get_value, transform, spec_param, p_id) in self._output_steps:
+            value = transform_param_value(
+                transform, get_value(state, params), spec_param
+            )
+            if p_id is not None:
+                widget_params[p_id] = value
+            else:
+                widget_params = value
+        return (self.output_widget, widget_params)
+
+    def unmap_inputs(self, job_inputs):
+        """
+        Maps the inputs of a job back to the app parameters, like map_inputs_from_job.
+        Raises a KeyError if the spec has no service input mapping.
+        """
+        if self._input_mapping is None:
+            raise KeyError("kb_service_input_mapping")
+        input_dict = dict()
+        # expect the inputs to be valid. so things in the expected position should be the
+        # right things (either dict, list, singleton)
+        for param in self._input_mapping:
+            if "input_parameter" not in param:
+                continue
+            input_param = param.get("input_parameter", None)
+            position = param.get("target_position", 0)
+            prop = param.get("target_property", None)
+            value = job_inputs[position]
+            if prop is not None:
+                value = value.get(prop, None)
+
+            # that's the value. Now, if it was transformed, try to transform it back.
+            if "target_type_transform" in param:
+                transform_type = param["target_type_transform"]
+                if transform_type.startswith("list") and isinstance(value, list):
+                    inner_transform = transform_type[5:-1]
+                    for i in range(len(value)):
+                        value[i] = _untransform(inner_transform, value[i])
+                else:
+                    value = _untransform(transform_type, value)
+
+            input_dict[input_param] = value
+        return input_dict
+
+    def map_input_steps(self):
+        """
+        Returns the steps for mapping app params to the inputs of run_job, as a list
+        of dicts with keys:
+            input_parameter - the id of the param the value comes from, or None
+            spec_param - the spec param for it, or None
+            is_group - True if that's a group param
+            system_variable - the system variable the value comes from, or None
+            constant_value - the value to use if there's no other value, or None
+            generated_value - the rules for making a value if there's no other value,
+                or None
+            transform - the target_type_transform, or None
+            position - the target argument position
+            target_path - the list of nested keys the value goes into in that
+                argument, or None if it's the whole argument
+        Raises a KeyError if a rule's input parameter isn't in the spec params.
+        """
+        if self._input_steps is None:
+            self._input_steps = compile_input_mapping(
+                self._input_mapping or [], self.spec_params_map
+            )
+        return self._input_steps
+
+
+def compile_input_mapping(input_mapping, spec_params):
+    """
+    Makes the steps for mapping app params to the inputs of run_job from the
+    kb_service_input_mapping of a spec. See MappingPlan.map_input_steps.
+    spec_params - dict of spec param id to spec param
+    """
+    steps = list()
+    for p in input_mapping:
+        input_param_id = p.get("input_parameter")
+        spec_param = spec_params[input_param_id] if input_param_id else None
+        target_prop = p.get("target_property", None)
+        steps.append(
+            {
+                "input_parameter": input_param_id,
+                "spec_param": spec_param,
+                "is_group": spec_param is not None
+                and spec_param.get("type", "") == "group",
+                "system_variable": None
+                if input_param_id
+                else p.get("narrative_system_variable"),
+                "constant_value": p.get("constant_value"),
+                "generated_value": p.get("generated_value"),
+                "transform": p.get("target_type_transform"),
+                "position": p.get("target_argument_position", 0),
+                "target_path": None
+                if target_prop is None
+                else _target_property_path(target_prop),
+            }
         )
+    return steps
 
-        p_id = out_param.get("target_property", None)
-        if p_id is not None:
-            widget_params[p_id] = value
-        else:
-            widget_params = value
 
-    output_widget = app_spec.get("widgets", {}).get(
-        "output", "kbaseDefaultNarrativeOutput"
-    )
-    # Yes, sometimes silly people put the string 'null' in their spec.
-    if output_widget == "null":
-        output_widget = "kbaseDefaultNarrativeOutput"
+def _target_property_path(target_prop):
+    """
+    Splits a target property into the list of nested keys it refers to. Empty keys
+    along the way (from leading or doubled slashes) are dropped, as they always were,
+    but the last key is kept even if it's empty.
+    """
+    if "/" not in target_prop:
+        return [target_prop]
+    # This is case when slashes in target_prop separate
+    # elements in nested maps. We ignore escaped slashes
+    # (separate backslashes should be escaped as well).
+    bck_slash = "\u244A"
+    fwd_slash = "\u20EB"
+    temp_string = target_prop.replace("\\\\", bck_slash)
+    temp_string = temp_string.replace("\\/", fwd_slash)
+    temp_path = []
+    for part in temp_string.split("/"):
+        part = part.replace(bck_slash, "\\")
+        part = part.replace(fwd_slash, "/")
+        temp_path.append(part.encode("ascii", "ignore").decode("ascii"))
+    return [part for part in temp_path[:-1] if part] + temp_path[-1:]
+
+
+# The ways of getting an output value from a job state and the job's input params,
+# used by MappingPlan._output_step.
+def _system_variable_output(var, state, params):
+    return system_variable(var)
+
+
+def _constant_output(constant, state, params):
+    return constant
+
+
+def _input_param_output(input_param_id, state, params):
+    return params.get(input_param_id, None)
+
+
+def _job_result_output(get_result, state, params):
+    return get_result(state["job_output"]["result"])
+
 
-    return (output_widget, widget_params)
+def _no_output(state, params):
+    return None
+
+
+def _result_path_accessor(path):
+    """
+    Returns a function that does get_result_sub_path(result, path), with the path
+    elements that might be list indices already turned into ints.
+    """
+    steps = list()
+    for path_item in path:
+        try:
+            steps.append((path_item, int(path_item)))
+        except (TypeError, ValueError):
+            steps.append((path_item, None))
+
+    def get_sub_path(result):
+        for (key, idx) in steps:
+            if isinstance(result, list):
+                if idx is None:
+                    # same error get_result_sub_path would raise
+                    int(key)
+                if idx >= len(result):
+                    return None
+                result = result[idx]
+            else:
+                result = result.get(key)
+        return result
+
+    return get_sub_path
 
 
 def get_result_sub_path(result, path):
@@ -339,12 +622,12 @@ def extract_ws_refs(app_id, tag, spec_params, params):
     """
     Returns a list of workspace refs (xxx/yyy/zzz) from the given parameters,
     if they are actual workspace objects.
+    spec_params can be a ParamIndex, which saves indexing them on every call.
     """
-    # Cheater way for making a dict of params with param[id] => param
-    params_dict = dict(
-        (spec_params[i]["id"], spec_params[i]) for i in range(len(spec_params))
-    )
+    spec_params = param_index(spec_params)
+    params_dict = spec_params.by_id
     workspace = system_variable("workspace")
+    resolve_param_refs(spec_params, [params], workspace)
     ws_input_refs = list()
     for p in spec_params:
         if p["id"] in params:
@@ -374,13 +657,11 @@ def validate_parameters(app_id, tag, spec_params, params):
     If it fails, this will raise a ValueError with a description of the
     problem and a (hopefully useful!) hint for the user as to what went
     wrong.
-    """
-    spec_param_ids = [p["id"] for p in spec_params]
 
-    # Cheater way for making a dict of params with param[id] => param
-    params_dict = dict(
-        (spec_params[i]["id"], spec_params[i]) for i in range(len(spec_params))
-    )
+    spec_params can be a ParamIndex, which saves indexing them on every call.
+    """
+    spec_params = param_index(spec_params)
+    params_dict = spec_params.by_id
 
     # First, test for presence.
     missing_params = list()
@@ -398,7 +679,7 @@ def validate_parameters(app_id, tag, spec_params, params):
     # Next, test for extra params that don't make sense
     extra_params = list()
     for p in params.keys():
-        if p not in spec_param_ids:
+        if p not in params_dict:
             extra_params.append(p)
     if len(extra_params):
         msg = (
@@ -421,6 +702,7 @@ def validate_parameters(app_id, tag, spec_params, params):
         msg = msg.format(workspace, ws_id)
         raise ValueError(msg)
 
+    resolve_param_refs(spec_params, [params], workspace)
     param_errors = list()
     # If they're workspace objects, track their refs in a list we'll pass
     # to run_job as a separate param to track provenance.
@@ -637,18 +919,14 @@ def validate_param_value(param, value, workspace):
                                 + "workspace/object/version(optional)"
                             ).format(value),
                         )
-                info = clients.get("workspace").get_object_info_new(
-                    {"objects": [{"ref": value}]}
-                )[0]
+                info = objectcache.resolve_object_info(workspace, value)
                 path_items[len(path_items) - 1] = "{}/{}/{}".format(
                     info[6], info[0], info[4]
                 )
                 ws_ref = ";".join(path_items)
             # Otherwise, assume it's a name, not a reference.
             else:
-                info = clients.get("workspace").get_object_info_new(
-                    {"objects": [{"workspace": workspace, "name": value}]}
-                )[0]
+                info = objectcache.resolve_object_info(workspace, value)
                 ws_ref = "{}/{}/{}".format(info[6], info[0], info[4])
             type_ok = False
             for t in param["allowed_types"]:
@@ -715,40 +993,66 @@ def validate_param_value(param, value, workspace):
     return (ws_ref, None)
 
 
-def resolve_single_ref(workspace, value):
-    ret = None
-    if "/" in value:
-        path_items = [item.strip() for item in value.split(";")]
-        for path_item in path_items:
-            if len(path_item.split("/")) > 3:
-                raise ValueError(
-                    "Object reference {} has too many slashes  - should be workspace/object/version(optional)".format(
-                        value
-                    )
+def _ref_path_items(value):
+    """
+    Returns the list of path items in a reference, or None if the value is a plain name.
+    Raises a ValueError if any of them are malformed.
+    """
+    if "/" not in value:
+        return None
+    path_items = [item.strip() for item in value.split(";")]
+    for path_item in path_items:
+        if len(path_item.split("/")) > 3:
+            raise ValueError(
+                "Object reference {} has too many slashes  - should be workspace/object/version(optional)".format(
+                    value
                 )
-            # return (ws_ref, 'Data reference named {} does not have the right format
-            # - should be workspace/object/version(optional)')
-        info = clients.get("workspace").get_object_info_new(
-            {"objects": [{"ref": value}]}
-        )[0]
-        path_items[len(path_items) - 1] = "{}/{}/{}".format(info[6], info[0], info[4])
-        ret = ";".join(path_items)
-    # Otherwise, assume it's a name, not a reference.
-    else:
-        info = clients.get("workspace").get_object_info_new(
-            {"objects": [{"workspace": workspace, "name": value}]}
-        )[0]
-        ret = "{}/{}/{}".format(info[6], info[0], info[4])
-    return ret
+            )
+        # return (ws_ref, 'Data reference named {} does not have the right format
+        # - should be workspace/object/version(optional)')
+    return path_items
+
+
+def resolve_single_ref(workspace, value):
+    path_items = _ref_path_items(value)
+    info = objectcache.resolve_object_info(workspace, value)
+    upa = "{}/{}/{}".format(info[6], info[0], info[4])
+    if path_items is None:
+        return upa
+    path_items[len(path_items) - 1] = upa
+    return ";".join(path_items)
 
 
 def resolve_ref(workspace, value):
     if isinstance(value, list):
+        objectcache.resolve_all_object_info(workspace, value)
         return [resolve_single_ref(workspace, v) for v in value]
     else:
         return resolve_single_ref(workspace, value)
 
 
+def resolve_param_refs(spec_params, param_sets, workspace):
+    """
+    Looks up all the workspace objects given as inputs in any of the param sets, in a
+    single Workspace call, so that validating and mapping them afterward doesn't have
+    to look them up one at a time.
+
+    spec_params - the list of parameters from the app spec, or a ParamIndex of them
+    param_sets - a list of dicts of parameters, keys = param id, values = value
+    workspace - the name of the workspace to look up object names in
+    """
+    values = list()
+    for p in param_index(spec_params).object_params:
+        for params in param_sets:
+            value = params.get(p["id"])
+            if isinstance(value, list):
+                values += value
+            elif value is not None:
+                values.append(value)
+    if values:
+        objectcache.resolve_all_object_info(workspace, values)
+
+
 def resolve_ref_if_typed(value, spec_param):
     """
     For a given value and associated spec, if this is not an output param,
@@ -5,15 +5,112 @@ from biokbase.catalog.Client import Catalog
 from biokbase.service.Client import Client as ServiceClient
 from biokbase.execution_engine2.execution_engine2Client import execution_engine2
 
+import os
+import threading
+from collections import OrderedDict
+from biokbase.narrative.common import sessions
+from biokbase.narrative.common.rpc import DEFAULT_BATCH_WORKERS, RPCBatch, use_transport
 from biokbase.narrative.common.url_config import URLS
 
+# The most clients to keep around. Each different token gets its own set of clients,
+# so this is bounded to keep a long-lived kernel from collecting them forever.
+MAX_CACHED_CLIENTS = 100
+
+# If set, request bodies at least this many bytes long get compressed.
+COMPRESS_MIN_BYTES_ENV_VAR = "KB_COMPRESS_REQUESTS_MIN_BYTES"
+
+_client_lock = threading.Lock()
+# keys = (client_name, token), values = client. Most recently used last.
+_clients = OrderedDict()
+# Request body compression settings for the clients that support it.
+_compression = {
+    "min_bytes": (
+        int(os.environ[COMPRESS_MIN_BYTES_ENV_VAR])
+        if os.environ.get(COMPRESS_MIN_BYTES_ENV_VAR)
+        else None
+    ),
+    "encoding": "gzip",
+}
+
 
 def get(client_name, token=None):
-    return __init_client(client_name, token=token)
+    """
+    Returns a client for the named service, using the given token. If no token is given,
+    the client uses the one in the KB_AUTH_TOKEN environment variable.
+
+    Clients are made once for each service and token, then reused. They all make their
+    calls through the shared, pooled HTTP sessions in biokbase.narrative.common.sessions,
+    so connections get reused too. Clients built on the generated BaseClient send their
+    calls through an RPCTransport (see biokbase.narrative.common.rpc). The clients don't
+    change after they're made, so they're safe to share between threads.
+    """
+    if token is None:
+        key = (client_name, None, os.environ.get("KB_AUTH_TOKEN"))
+    else:
+        key = (client_name, token, None)
+    with _client_lock:
+        c = _clients.get(key)
+        if c is not None:
+            _clients.move_to_end(key)
+            return c
+    # don't hold the lock while making the client, as that might make another one
+    c = __init_client(client_name, token=token)
+    with _client_lock:
+        c = _clients.setdefault(key, c)
+        _clients.move_to_end(key)
+        while len(_clients) > MAX_CACHED_CLIENTS:
+            _clients.popitem(last=False)
+    return c
 
 
 def reset():
-    pass
+    """
+    Drops all the cached clients and closes the shared HTTP sessions. This should be
+    used after the service URLs change.
+    """
+    with _client_lock:
+        _clients.clear()
+    sessions.reset()
+
+
+def configure_compression(min_bytes=None, encoding="gzip"):
+    """
+    Makes the clients compress request bodies that are at least min_bytes long, using
+    either "gzip" or "deflate". If min_bytes is None, nothing gets compressed.
+    Responses are always asked for compressed.
+
+    If a service can't read compressed requests, its client falls back to sending them
+    uncompressed. This applies to the existing clients, as well as new ones.
+    """
+    if min_bytes is not None and min_bytes < 0:
+        raise ValueError("Compression min bytes must not be negative")
+    if encoding not in ["gzip", "deflate"]:
+        raise ValueError('Compression encoding must be "gzip" or "deflate"')
+    with _client_lock:
+        _compression["min_bytes"] = min_bytes
+        _compression["encoding"] = encoding
+        for c in _clients.values():
+            __use_compression(c)
+
+
+def batch(c, max_workers=DEFAULT_BATCH_WORKERS):
+    """
+    Returns a context that runs calls to the client's methods concurrently, each on its
+    own pooled connection. Each queued call returns a concurrent.futures.Future. See
+    RPCBatch.
+    """
+    return RPCBatch(c, max_workers)
+
+
+def get_call_stats(c):
+    """
+    Returns the byte counts for the last call the client made from this thread, or
+    None if it doesn't keep them. See RPCTransport.get_call_stats.
+    """
+    transport = __get_transport(c)
+    if transport is None:
+        return None
+    return transport.get_call_stats()
 
 
 def __init_client(client_name, token=None):
@@ -38,9 +135,31 @@ def __init_client(client_name, token=None):
     else:
         raise ValueError('Unknown client name "%s"' % client_name)
 
+    __use_transport(c)
+    __use_compression(c)
     return c
 
 
+def __use_transport(c):
+    # the generated clients wrap a BaseClient, the older ones make their own calls
+    base_client = getattr(c, "_client", None)
+    if base_client is not None and hasattr(base_client, "_call"):
+        use_transport(base_client, sessions.get_session(base_client.url))
+    elif hasattr(c, "session"):
+        c.session = sessions.get_session(c.url)
+
+
+def __get_transport(c):
+    return getattr(getattr(c, "_client", None), "rpc_transport", None)
+
+
+def __use_compression(c):
+    transport = __get_transport(c)
+    if transport is not None:
+        transport.compress_min_bytes = _compression["min_bytes"]
+        transport.compress_encoding = _compression["encoding"]
+
+
 class JobServiceMock:
     def __init__(self):
         self.client = get("service")
@@ -0,0 +1,214 @@
+"""
+A bounded LRU cache for JSON-serializable values.
+
+The cache is limited by both the number of entries and their size in bytes. Values
+that get pushed out can optionally be spilled to a local directory and read back from
+there when they're needed again.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+from biokbase.narrative.common import kblogging
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+
+class LRUCache:
+    """
+    An LRU cache with string keys and JSON-serializable values.
+
+    Entries are evicted, least recently used first, when there are more than max_entries
+    of them, or when their total size goes over max_bytes. That's the size given to
+    put(), or if there isn't one, the size of the value as JSON. If
+    spill_dir is set, evicted values get written there as JSON files, and a lookup that
+    misses in memory checks there before giving up.
+
+    Hit, miss, and eviction counts are available from stats().
+    """
+
+    _log = kblogging.get_logger(__name__)
+    # used in error messages, and (in snake case) as the prefix for logged events
+    name = "LRU cache"
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        spill_dir: str = None,
+    ):
+        self._lock = threading.RLock()
+        # values = (value, estimated size in bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._spill_hits = 0
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.spill_dir = None
+        self.configure(spill_dir=spill_dir)
+
+    def configure(
+        self, max_entries: int = None, max_bytes: int = None, spill_dir: str = None
+    ) -> None:
+        """
+        Changes the cache limits, or the spill directory. Anything left as None is
+        unchanged. To stop spilling to disk, set spill_dir to an empty string.
+        If the new limits are smaller, entries get evicted right away to fit.
+        Raises a ValueError for bad limits.
+        """
+        if max_entries is not None and max_entries < 1:
+            raise ValueError(f"{self.name} max entries must be at least 1")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError(f"{self.name} max bytes must be at least 1")
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if spill_dir is not None:
+                if spill_dir:
+                    os.makedirs(spill_dir, exist_ok=True)
+                self.spill_dir = spill_dir or None
+            self._evict()
+
+    def get(self, key: str):
+        """
+        Returns the cached value for the key, or None if it's not there.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key][0]
+            spilled = self._read_spilled(key)
+            if spilled is None:
+                self._misses += 1
+                return None
+            (value, size) = spilled
+            self._hits += 1
+            self._spill_hits += 1
+            self._store(key, value, size)
+            self._evict()
+            return value
+
+    def put(self, key: str, value, size: int = None) -> None:
+        """
+        Adds or replaces the cached value for the key, then evicts whatever's needed to
+        get back under the limits. If the caller already knows about how big the value
+        is (e.g. from the response it came in), passing that as size saves serializing
+        it again just to measure it.
+        """
+        with self._lock:
+            self._store(key, value, size)
+            self._evict()
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self._discard(key)
+            self._remove_spilled(key)
+
+    def clear(self) -> None:
+        """
+        Empties the cache in memory and on disk. The counters are left alone.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self.spill_dir and os.path.isdir(self.spill_dir):
+                for name in os.listdir(self.spill_dir):
+                    if name.endswith(".json"):
+                        os.remove(os.path.join(self.spill_dir, name))
+
+    def stats(self) -> dict:
+        """
+        Returns the cache counters and current size, as a dict with keys:
+        hits, misses, evictions, spill_hits, entries, bytes, max_entries, max_bytes
+        """
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "spill_hits": self._spill_hits,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _event(self, event: str) -> str:
+        return self.name.lower().replace(" ", "_") + "." + event
+
+    def _store(self, key: str, value, size: int = None) -> None:
+        self._discard(key)
+        if size is None:
+            size = len(json.dumps(value, default=str))
+        self._entries[key] = (value, size)
+        self._bytes += size
+
+    def _discard(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+        return entry
+
+    def _evict(self) -> None:
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            key, (value, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self._evictions += 1
+            self._spill(key, value)
+
+    def _spill_path(self, key: str) -> str:
+        return os.path.join(self.spill_dir, quote(key, safe="") + ".json")
+
+    def _spill(self, key: str, value) -> None:
+        if not self.spill_dir:
+            return
+        try:
+            with open(self._spill_path(key), "w") as f:
+                json.dump(value, f, default=str)
+        except OSError as e:
+            kblogging.log_event(self._log, self._event("spill_error"), {"err": str(e)})
+
+    def _read_spilled(self, key: str):
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                # the file is the value as JSON already, so it's the same size
+                spilled = (json.load(f), os.fstat(f.fileno()).st_size)
+        except (OSError, ValueError) as e:
+            kblogging.log_event(self._log, self._event("read_error"), {"err": str(e)})
+            spilled = None
+        # it's either back in memory now, or unreadable
+        self._remove_spilled(key)
+        return spilled
+
+    def _remove_spilled(self, key: str) -> None:
+        if not self.spill_dir:
+            return
+        try:
+            os.remove(self._spill_path(key))
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._entries:
+                return True
+            return bool(self.spill_dir) and os.path.exists(self._spill_path(key))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,334 @@
+"""
+The JSON-RPC transport shared by the KBase service clients.
+
+The baseclient.py modules under biokbase.workspace, biokbase.catalog,
+biokbase.execution_engine2, and biokbase.userandjobstate are generated from the same
+template, and stay as generated. biokbase.narrative.clients hands each BaseClient it
+makes an RPCTransport with use_transport, so their calls get a JSON codec, request
+compression, byte counts, and a pooled session from here. Any client's calls can be
+run concurrently with RPCBatch.
+"""
+import gzip
+import json
+import random
+import sys
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+try:
+    import orjson  # faster, if it's installed
+except ImportError:
+    orjson = None
+
+# The most calls a batch runs at once.
+DEFAULT_BATCH_WORKERS = 10
+# Request bodies can be compressed with one of these.
+COMPRESS_ENCODINGS = frozenset(["gzip", "deflate"])
+# The JSON-RPC error code for a request body that couldn't be parsed.
+PARSE_ERROR_CODE = -32700
+
+_CT = "content-type"
+_AJ = "application/json"
+
+
+def _json_default(obj):
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError
+
+
+class StdlibJSONCodec:
+    """
+    Encodes and decodes JSON with the standard library. Decoding bytes makes a str
+    copy of them first.
+    """
+
+    name = "json"
+
+    def dumps(self, obj):
+        return json.dumps(obj, default=_json_default).encode("utf-8")
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    """
+    Encodes and decodes JSON with orjson. Anything orjson can't handle (like integers
+    over 64 bits) goes through the standard library instead.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        self._fallback = StdlibJSONCodec()
+
+    def dumps(self, obj):
+        try:
+            return orjson.dumps(
+                obj, default=_json_default, option=orjson.OPT_NON_STR_KEYS
+            )
+        except TypeError:
+            return self._fallback.dumps(obj)
+
+    def loads(self, data):
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            return self._fallback.loads(data)
+
+
+def get_json_codec(name=None):
+    """
+    Returns a JSON codec by name, either "orjson" or "json". By default, this is orjson
+    if it's installed, or the standard library if not.
+    """
+    if name is None:
+        name = "json" if orjson is None else "orjson"
+    if name == "json":
+        return StdlibJSONCodec()
+    if name == "orjson":
+        if orjson is None:
+            raise ValueError("The orjson JSON codec isn't installed")
+        return OrjsonCodec()
+    raise ValueError("Unknown JSON codec " + str(name))
+
+
+def compress(body, encoding):
+    if encoding == "gzip":
+        return gzip.compress(body)
+    return zlib.compress(body)
+
+
+def _wire_bytes(response, default):
+    # the number of (possibly compressed) bytes read off the connection
+    try:
+        return response.raw.tell()
+    except Exception:
+        return default
+
+
+def _empty_byte_stats():
+    return {
+        "calls": 0,
+        "request_bytes": 0,
+        "request_bytes_sent": 0,
+        "response_bytes": 0,
+        "response_bytes_received": 0,
+    }
+
+
+def _is_compression_error(err):
+    # a server that doesn't take compressed bodies either turns away the encoding,
+    # or fails to parse the compressed bytes as JSON
+    response = getattr(err, "response", None)
+    if response is not None:
+        return response.status_code in (400, 415)
+    return getattr(err, "code", None) == PARSE_ERROR_CODE
+
+
+class RPCBatch:
+    """
+    Queues calls to a client's methods and runs them concurrently, each on its own
+    (pooled) connection. Use it as a context manager:
+
+    with client.batch() as b:
+        f1 = b.some_method(params1)
+        f2 = b.some_method(params2)
+    result1 = f1.result()
+
+    Every queued call returns a concurrent.futures.Future right away. Leaving the with
+    block waits for all the calls to finish. If the block raises, calls that haven't
+    started yet are cancelled.
+    """
+
+    def __init__(self, client, max_workers=DEFAULT_BATCH_WORKERS):
+        if max_workers < 1:
+            raise ValueError("Batch max workers must be at least 1")
+        self._client = client
+        self._max_workers = max_workers
+        self._executor = None
+        self._futures = list()
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            for future in self._futures:
+                future.cancel()
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        return False
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+        if not callable(method) or name.startswith("_"):
+            raise AttributeError(name + " can't be called in a batch")
+
+        def queue_call(*args, **kwargs):
+            if self._executor is None:
+                raise ValueError("Batch calls must be made inside a with block")
+            future = self._executor.submit(method, *args, **kwargs)
+            self._futures.append(future)
+            return future
+
+        return queue_call
+
+
+class RPCTransport:
+    """
+    Sends JSON-RPC requests for a generated BaseClient, in place of its own _call. It
+    reads the url, timeout, _headers, and trust_all_ssl_certificates attributes the
+    template gives the client, and raises server_error (the ServerError class from the
+    client's module) for JSON-RPC error responses.
+    """
+
+    # the codec used to encode requests and decode responses, see get_json_codec
+    json_codec = get_json_codec()
+
+    def __init__(self, base_client, server_error, session=None):
+        self._client = base_client
+        self.server_error = server_error
+        # an optional requests.Session to make calls with, so connections can be reused
+        self.session = session
+        # request bodies at least this many bytes long get compressed, if it's not None
+        self.compress_min_bytes = None
+        # either "gzip" or "deflate"
+        self.compress_encoding = "gzip"
+        self._stats_lock = threading.Lock()
+        self._last_call = threading.local()
+        self._byte_totals = _empty_byte_stats()
+        self._compress_unsupported = False
+
+    def call(self, url, method, params, context=None):
+        """
+        Calls the method at the url, and returns its result the same way the template's
+        BaseClient._call does.
+        """
+        arg_hash = {
+            "method": method,
+            "params": params,
+            "version": "1.1",
+            "id": str(random.random())[2:],
+        }
+        if context:
+            if not isinstance(context, dict):
+                raise ValueError("context is not type dict as required.")
+            arg_hash["context"] = context
+
+        resp = self._send(url, arg_hash)
+        if "result" not in resp:
+            raise self.server_error("Unknown", 0, "An unknown server error occurred")
+        if not resp["result"]:
+            return
+        if len(resp["result"]) == 1:
+            return resp["result"][0]
+        return resp["result"]
+
+    def _send(self, url, arg_hash):
+        """
+        Posts the JSON-RPC request to the url, and returns the decoded response.
+        """
+        body = self.json_codec.dumps(arg_hash)
+        compress_body = self._should_compress(body)
+        try:
+            return self._post(url, body, compress_body)
+        except (self.server_error, requests.HTTPError) as e:
+            if not compress_body or not _is_compression_error(e):
+                raise
+            # the server can't read compressed bodies, so stop sending them
+            self._compress_unsupported = True
+            return self._post(url, body, False)
+
+    def _should_compress(self, body):
+        return (
+            self.compress_min_bytes is not None
+            and not self._compress_unsupported
+            and len(body) >= self.compress_min_bytes
+        )
+
+    def _post(self, url, body, compress_body):
+        stats = _empty_byte_stats()
+        stats["calls"] = 1
+        stats["request_bytes"] = len(body)
+        headers = dict(self._client._headers)
+        headers["Accept-Encoding"] = "gzip, deflate"
+        if compress_body:
+            body = compress(body, self.compress_encoding)
+            headers["Content-Encoding"] = self.compress_encoding
+        stats["request_bytes_sent"] = len(body)
+        ret = (self.session or requests).post(
+            url,
+            data=body,
+            headers=headers,
+            timeout=self._client.timeout,
+            verify=not self._client.trust_all_ssl_certificates,
+        )
+        with ret:
+            ret.encoding = "utf-8"
+            try:
+                if ret.status_code == 500:
+                    if ret.headers.get(_CT) == _AJ:
+                        err = self.json_codec.loads(ret.content)
+                        if "error" in err:
+                            raise self.server_error(**err["error"])
+                        else:
+                            raise self.server_error("Unknown", 0, ret.text)
+                    else:
+                        raise self.server_error("Unknown", 0, ret.text)
+                if not ret.ok:
+                    ret.raise_for_status()
+                # the codec gets the raw bytes, not response.text, so orjson never
+                # makes a str copy of the body
+                resp_body = ret.content
+                stats["response_bytes"] = len(resp_body)
+                return self.json_codec.loads(resp_body)
+            finally:
+                stats["response_bytes_received"] = _wire_bytes(
+                    ret, stats["response_bytes"]
+                )
+                self._record_call(stats)
+
+    def _record_call(self, stats):
+        self._last_call.stats = stats
+        with self._stats_lock:
+            for key, value in stats.items():
+                self._byte_totals[key] += value
+
+    def get_call_stats(self):
+        """
+        Returns the byte counts for the last call made from this thread, as a dict with
+        keys:
+        request_bytes - the size of the JSON request body
+        request_bytes_sent - the size of the request body that was sent, after any
+            compression
+        response_bytes - the size of the JSON response body
+        response_bytes_received - the size of the response body that was received,
+            before it was decompressed
+        calls - the number of HTTP requests made
+        Returns None if no calls were made yet.
+        """
+        return getattr(self._last_call, "stats", None)
+
+    def get_byte_stats(self):
+        """
+        Returns the totals of all the get_call_stats counts for this client.
+        """
+        with self._stats_lock:
+            return dict(self._byte_totals)
+
+
+def use_transport(base_client, session=None):
+    """
+    Makes a generated BaseClient send its calls through a new RPCTransport, and returns
+    the transport. The transport raises the ServerError class from the client's module.
+    """
+    server_error = sys.modules[type(base_client).__module__].ServerError
+    transport = RPCTransport(base_client, server_error, session=session)
+    base_client._call = transport.call
+    base_client.rpc_transport = transport
+    return transport
@@ -0,0 +1,137 @@
+"""
+Shared, pooled HTTP sessions for talking to KBase services.
+
+Using the module-level requests functions means a new TCP connection (and TLS
+handshake) for every call. Instead, this keeps one requests.Session per host, with a
+keep-alive connection pool, so that all the service clients and auth calls to the same
+host can reuse their connections.
+
+Sessions can be shared between threads. They don't keep cookies, so nothing from one
+user's calls can leak into another's - everything KBase needs goes in the headers.
+"""
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+# Only failures to connect are retried. A request that got through might have done
+# something on the server, so it's never sent again.
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.5
+DEFAULT_KEEP_ALIVE = True
+
+_config = {
+    "pool_connections": DEFAULT_POOL_CONNECTIONS,
+    "pool_maxsize": DEFAULT_POOL_MAXSIZE,
+    "max_retries": DEFAULT_MAX_RETRIES,
+    "retry_backoff": DEFAULT_RETRY_BACKOFF,
+    "keep_alive": DEFAULT_KEEP_ALIVE,
+}
+
+_lock = threading.Lock()
+# keys = (scheme, host), values = requests.Session
+_sessions = dict()
+
+
+def configure(
+    pool_connections: int = None,
+    pool_maxsize: int = None,
+    max_retries: int = None,
+    retry_backoff: float = None,
+    keep_alive: bool = None,
+) -> None:
+    """
+    Changes the settings used for the HTTP sessions. Anything left as None is unchanged.
+    pool_connections - the number of connection pools to keep in each session
+    pool_maxsize - the most connections to keep open in each pool
+    max_retries - how many times to retry a connection that couldn't be made
+    retry_backoff - the backoff factor (in seconds) between those retries
+    keep_alive - if False, connections get closed after every request
+
+    Existing sessions are closed, and the cached service clients that use them are
+    dropped (see biokbase.narrative.clients.reset), so the new settings are used from
+    the next request on. Raises a ValueError for bad settings.
+    """
+    if pool_connections is not None and pool_connections < 1:
+        raise ValueError("HTTP session pool connections must be at least 1")
+    if pool_maxsize is not None and pool_maxsize < 1:
+        raise ValueError("HTTP session pool max size must be at least 1")
+    if max_retries is not None and max_retries < 0:
+        raise ValueError("HTTP session max retries must not be negative")
+    if retry_backoff is not None and retry_backoff < 0:
+        raise ValueError("HTTP session retry backoff must not be negative")
+    new_config = {
+        "pool_connections": pool_connections,
+        "pool_maxsize": pool_maxsize,
+        "max_retries": max_retries,
+        "retry_backoff": retry_backoff,
+        "keep_alive": keep_alive,
+    }
+    with _lock:
+        for key, value in new_config.items():
+            if value is not None:
+                _config[key] = value
+    # imported here, since the clients module uses this one
+    from biokbase.narrative import clients
+
+    clients.reset()
+
+
+def get_config() -> dict:
+    with _lock:
+        return dict(_config)
+
+
+def get_session(url: str) -> requests.Session:
+    """
+    Returns the shared session for the host in the given url, making it if needed.
+    """
+    parsed = urlparse(url)
+    key = (parsed.scheme.lower(), parsed.netloc.lower())
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _make_session()
+            _sessions[key] = session
+        return session
+
+
+def reset() -> None:
+    """
+    Closes all the shared sessions, along with their open connections.
+    """
+    with _lock:
+        _close_sessions()
+
+
+def _close_sessions() -> None:
+    for session in _sessions.values():
+        session.close()
+    _sessions.clear()
+
+
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    retries = Retry(
+        total=_config["max_retries"],
+        connect=_config["max_retries"],
+        read=0,
+        status=0,
+        backoff_factor=_config["retry_backoff"],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=_config["pool_connections"],
+        pool_maxsize=_config["pool_maxsize"],
+        max_retries=retries,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if not _config["keep_alive"]:
+        session.headers["Connection"] = "close"
+    return session
@@ -5,6 +5,7 @@ Implements the KBaseWSManagerMixin class.
 
 import biokbase.auth
 import biokbase.narrative.clients
+import biokbase.narrative.objectcache
 from biokbase.narrative.common.url_config import URLS
 from biokbase.narrative.common import util
 import biokbase.workspace
@@ -303,9 +304,13 @@ class KBaseWSManagerMixin(object):
             ws_save_obj["meta"] = self._process_cell_usage(nb, ws_save_obj["meta"])
 
             # Actually do the save now!
-            obj_info = self.ws_client().save_objects(
-                {"id": ws_id, "objects": [ws_save_obj]}
-            )[0]
+            ws = self.ws_client()
+            obj_info = ws.save_objects({"id": ws_id, "objects": [ws_save_obj]})[0]
+            # the Narrative's name now points at a new version
+            biokbase.narrative.objectcache.invalidate_resolved_refs()
+            save_stats = biokbase.narrative.clients.get_call_stats(ws)
+            if save_stats is not None:
+                log_event(g_log, "write_narrative bytes", save_stats)
 
             return (nb, obj_info[6], obj_info[0], obj_info[4])
 
@@ -465,8 +465,9 @@ def update_metadata(metadata):
 def find_app_info(app_id):
     sm = SpecManager()
     for tag in ["release", "beta", "dev"]:
-        if app_id in sm.app_specs[tag]:
-            return {"tag": tag, "spec": sm.app_specs[tag][app_id]}
+        app_specs = sm.get_app_specs(tag)
+        if app_id in app_specs:
+            return {"tag": tag, "spec": app_specs[app_id]}
     return None
 
 
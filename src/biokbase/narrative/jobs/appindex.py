@@ -0,0 +1,164 @@
+"""
+An in-memory search index over the app specs of a release tag.
+
+The SpecManager builds one of these for a tag the first time it's searched, and keeps
+it until that tag's specs get reloaded. Searches are then lookups in an inverted index
+of words, instead of a scan over every spec.
+"""
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+# How much a word found in each field counts toward an app's score.
+FIELD_WEIGHTS = {"name": 4, "id": 3, "module": 2, "categories": 2, "subtitle": 1}
+
+_word_regex = re.compile(r"[a-z0-9]+")
+
+
+def _words(text) -> list:
+    """
+    Returns the lowercase words in the text. CamelCase and snake_case get split too,
+    so "kb_uploadmethods" and "KBaseGenomes" can be found by their parts, along with
+    the whole thing.
+    """
+    if not text:
+        return []
+    text = str(text)
+    split = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text)
+    words = _word_regex.findall(split.lower())
+    whole = _word_regex.findall(text.lower())
+    return words + [w for w in whole if w not in words]
+
+
+def bare_type(ws_type: str) -> str:
+    """
+    Returns the workspace type without its version, e.g. KBaseGenomes.Genome for
+    KBaseGenomes.Genome-14.2.
+    """
+    return ws_type.split("-")[0]
+
+
+class AppSearchIndex:
+    """
+    Indexes app specs (as returned by the NMS list_methods_spec) by the words in their
+    name, id, module, categories, and subtitle, and by the workspace types their params
+    take as input objects or make as outputs.
+    """
+
+    def __init__(self, specs):
+        """
+        specs - an iterable of app specs
+        """
+        # keys = app id, values = spec info
+        self.infos = dict()
+        # keys = word, values = dict of app id -> score for that word
+        self._words = defaultdict(dict)
+        # keys = bare workspace type, values = set of app ids
+        self._input_types = defaultdict(set)
+        self._output_types = defaultdict(set)
+        for spec in specs:
+            self._add(spec)
+        # sorted, so searches can match words by prefix
+        self._sorted_words = sorted(self._words.keys())
+
+    def _add(self, spec) -> None:
+        info = spec.get("info", {})
+        app_id = info.get("id")
+        if app_id is None:
+            return
+        self.infos[app_id] = info
+        module = info.get("module_name") or app_id.split("/")[0]
+        fields = {
+            "name": info.get("name"),
+            "id": app_id,
+            "module": module,
+            "categories": " ".join(info.get("categories") or []),
+            "subtitle": info.get("subtitle"),
+        }
+        for field, text in fields.items():
+            for word in set(_words(text)):
+                scores = self._words[word]
+                scores[app_id] = scores.get(app_id, 0) + FIELD_WEIGHTS[field]
+
+        for param in spec.get("parameters", []):
+            opts = param.get("text_options") or {}
+            types = (
+                self._output_types if opts.get("is_output_name") else self._input_types
+            )
+            for ws_type in opts.get("valid_ws_types") or []:
+                types[bare_type(ws_type)].add(app_id)
+
+    def _word_scores(self, word: str) -> dict:
+        """
+        Returns the dict of app id -> score for the word. Words that the query word is
+        the beginning of count too, at half the score.
+        """
+        scores = dict(self._words.get(word, {}))
+        idx = bisect_left(self._sorted_words, word)
+        while idx < len(self._sorted_words) and self._sorted_words[idx].startswith(
+            word
+        ):
+            other = self._sorted_words[idx]
+            idx += 1
+            if other == word:
+                continue
+            for app_id, score in self._words[other].items():
+                scores[app_id] = max(scores.get(app_id, 0), score / 2)
+        return scores
+
+    def apps_for_type(self, ws_type: str, output: bool = False) -> set:
+        """
+        Returns the set of ids of apps that take objects of the workspace type as
+        input, or make them as output if output is True. The type version is ignored.
+        """
+        types = self._output_types if output else self._input_types
+        return set(types.get(bare_type(ws_type), set()))
+
+    def search(
+        self, query: str = "", input_type: str = None, output_type: str = None
+    ) -> list:
+        """
+        Returns the ids of apps that match every word in the query (or the beginning of
+        a word), best matches first, and then by name. If input_type or output_type are
+        given, only apps that take or make that workspace type are included. An empty
+        query with no types matches nothing.
+        """
+        candidates = None
+        if input_type:
+            candidates = self.apps_for_type(input_type)
+        if output_type:
+            outputs = self.apps_for_type(output_type, output=True)
+            candidates = outputs if candidates is None else candidates & outputs
+
+        scores = None
+        # query words aren't split up, since they only need to match the start of a word
+        for word in dict.fromkeys(_word_regex.findall((query or "").lower())):
+            word_scores = self._word_scores(word)
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = dict(
+                    (app_id, score + word_scores[app_id])
+                    for app_id, score in scores.items()
+                    if app_id in word_scores
+                )
+            if not scores:
+                return []
+        if scores is None:
+            if candidates is None:
+                return []
+            scores = dict((app_id, 0) for app_id in candidates)
+        elif candidates is not None:
+            scores = dict(
+                (app_id, score)
+                for app_id, score in scores.items()
+                if app_id in candidates
+            )
+        return sorted(
+            scores.keys(),
+            key=lambda app_id: (
+                -scores[app_id],
+                (self.infos[app_id].get("name") or "").lower(),
+                app_id,
+            ),
+        )
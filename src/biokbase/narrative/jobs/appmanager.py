@@ -5,17 +5,19 @@ import biokbase.auth as auth
 from .job import Job
 from .jobmanager import JobManager
 from .jobcomm import JobComm
+from .tokenpool import get_agent_token_pool
 from . import specmanager
 import biokbase.narrative.clients as clients
 from biokbase.narrative.widgetmanager import WidgetManager
 from biokbase.narrative.app_util import (
     system_variable,
     strict_system_variable,
-    map_outputs_from_state,
     validate_parameters,
     resolve_ref_if_typed,
     transform_param_value,
     extract_ws_refs,
+    resolve_param_refs,
+    compile_input_mapping,
 )
 from biokbase.narrative.exception_util import transform_job_exception
 from biokbase.narrative.common import kblogging
@@ -23,12 +25,18 @@ import re
 import datetime
 import traceback
 import random
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 
 """
 A module for managing apps, specs, requirements, and for starting jobs.
 """
 __author__ = "Bill Riehl <wjriehl@lbl.gov>"
 
+# The most run_job calls run_app_bulk makes at once, by default.
+DEFAULT_BULK_MAX_CONCURRENT = 8
+
 
 class AppManager(object):
     """
@@ -50,6 +58,8 @@ class AppManager(object):
 
     __MAX_TOKEN_NAME_LEN = 30
 
+    _bulk_max_concurrent = DEFAULT_BULK_MAX_CONCURRENT
+
     spec_manager = specmanager.SpecManager()
     _log = kblogging.get_logger(__name__)
     _comm = None
@@ -63,11 +73,13 @@ class AppManager(object):
 
     def reload(self):
         """
-        Reloads all app specs into memory from the App Catalog.
-        Any outputs of app_usage, app_description, or available_apps
-        should be run again after the update.
+        Reloads all app specs into memory from the App Catalog, in the background.
+        Apps keep running with the current specs until that's done, and any outputs
+        of app_usage, app_description, or available_apps should be run again after
+        the update. SpecManager.refresh returns the thread doing the reload, if it
+        needs to be waited on.
         """
-        self.spec_manager.reload()
+        self.spec_manager.refresh()
 
     def app_usage(self, app_id, tag="release"):
         """
@@ -118,6 +130,28 @@ class AppManager(object):
         """
         return self.spec_manager.available_apps(tag)
 
+    def search_apps(self, query="", input_type=None, output_type=None, tag="release"):
+        """
+        Searches the apps for a given tag by name, id, module, category, and
+        subtitle, and shows the best matches first, a page at a time.
+        If the tag is not found, a ValueError will be raised.
+
+        Parameters:
+        -----------
+        query : string
+            The words to search for, e.g. "assemble reads"
+        input_type : string
+            If given, only apps that take objects of this workspace type as
+            input are found, e.g. "KBaseFile.PairedEndLibrary"
+        output_type : string
+            If given, only apps that make objects of this workspace type are found
+        tag : Which version of the apps to search - either release, beta, or dev
+            (default=release)
+        """
+        return self.spec_manager.search_apps(
+            query, input_type=input_type, output_type=output_type, tag=tag
+        )
+
     def run_app_batch(
         self,
         app_id,
@@ -177,23 +211,25 @@ class AppManager(object):
 
         # Preflight check the params - all required ones are present, all
         # values are the right type, all numerical values are in given ranges
-        spec_params = self.spec_manager.app_params(spec)
+        plan = self.spec_manager.get_mapping_plan(app_id, tag)
+        spec_params = plan.spec_params
 
         # A list of lists of UPAs, used for each subjob.
         batch_ws_upas = list()
         # The list of actual input values, post-mapping.
         batch_run_inputs = list()
 
+        # Look up the input objects from every param set at once, instead of one set
+        # (and one object) at a time.
+        resolve_param_refs(spec_params, params, system_variable("workspace"))
         for param_set in params:
-            spec_params_map = dict(
-                (spec_params[i]["id"], spec_params[i]) for i in range(len(spec_params))
-            )
             batch_ws_upas.append(extract_ws_refs(app_id, tag, spec_params, param_set))
             batch_run_inputs.append(
                 self._map_inputs(
                     spec["behavior"]["kb_service_input_mapping"],
                     param_set,
-                    spec_params_map,
+                    plan.spec_params_map,
+                    steps=plan.map_input_steps(),
                 )
             )
 
@@ -240,9 +276,7 @@ class AppManager(object):
         try:
             token_name = "KBApp_{}".format(app_id)
             token_name = token_name[: self.__MAX_TOKEN_NAME_LEN]
-            agent_token = auth.get_agent_token(
-                auth.get_auth_token(), token_name=token_name
-            )
+            agent_token = get_agent_token_pool().get(auth.get_auth_token(), token_name)
         except Exception:
             raise
 
@@ -312,6 +346,316 @@ class AppManager(object):
         else:
             return new_job
 
+    def configure_bulk_run(self, max_concurrent: int = None) -> None:
+        """
+        Changes how many jobs run_app_bulk starts at once. None leaves it unchanged.
+        Raises a ValueError for bad values.
+        """
+        if max_concurrent is not None and max_concurrent < 1:
+            raise ValueError("Bulk run max concurrent must be at least 1")
+        if max_concurrent is not None:
+            self._bulk_max_concurrent = max_concurrent
+
+    def run_app_bulk(
+        self,
+        app_id,
+        params,
+        tag="release",
+        version=None,
+        cell_id=None,
+        run_id=None,
+        dry_run=False,
+        max_concurrent=None,
+        chunk_size=None,
+    ):
+        """
+        Runs the app once for each set of parameters, each as its own job. Unlike
+        run_app_batch, there's no parent kb_BatchApp job - all the jobs get started
+        directly, a few at a time, and can run at the same time.
+
+        All the parameter sets are validated before any job is started, unless
+        chunk_size is given. Then they're validated and started chunk_size at a time,
+        so params can be a generator (like the one from batch.iter_input_batch) and a
+        large sweep starts its first jobs right away.
+
+        The jobs are registered with the JobManager under a new group id, which is put
+        in each job's meta as "bulk_group_id". See JobManager.lookup_job_group_state.
+
+        If this is given a cell_id, then returns None. If not, it returns the list of
+        generated Job objects, in the same order as params.
+
+        Parameters:
+        -----------
+        app_id - should be from the app spec, e.g. 'MegaHit/run_megahit'.
+        params - a list (or, with chunk_size, any iterable) of parameter dictionaries,
+                 one for each job.
+        tag - optional, one of [release|beta|dev] (default=release)
+        version - optional, a semantic version string.
+        max_concurrent - optional, the most jobs to start at once. If not given, uses
+                         the value set with configure_bulk_run (default=8)
+        chunk_size - optional, how many parameter sets to validate and start at a time
+        """
+        try:
+            if params is None:
+                params = list()
+            return self._run_app_bulk_internal(
+                app_id,
+                params,
+                tag,
+                version,
+                cell_id,
+                run_id,
+                dry_run,
+                max_concurrent,
+                chunk_size,
+            )
+        except Exception as e:
+            e_type = type(e).__name__
+            e_message = str(e).replace("<", "&lt;").replace(">", "&gt;")
+            e_trace = traceback.format_exc()
+            e_trace = e_trace.replace("<", "&lt;").replace(">", "&gt;")
+            e_code = getattr(e, "code", -1)
+            e_source = getattr(e, "source", "appmanager")
+            self._send_comm_message(
+                "run_status",
+                {
+                    "event": "error",
+                    "event_at": datetime.datetime.utcnow().isoformat() + "Z",
+                    "cell_id": cell_id,
+                    "run_id": run_id,
+                    "error_message": e_message,
+                    "error_type": e_type,
+                    "error_stacktrace": e_trace,
+                    "error_code": e_code,
+                    "error_source": e_source,
+                },
+            )
+            print(
+                "Error while trying to start your app (run_app_bulk)!\n"
+                + "----------------------------------------------------\n"
+                + str(e)
+                + "\n"
+                + "----------------------------------------------------\n"
+                + e_trace
+            )
+            return
+
+    def _run_app_bulk_internal(
+        self,
+        app_id,
+        params,
+        tag,
+        version,
+        cell_id,
+        run_id,
+        dry_run,
+        max_concurrent,
+        chunk_size,
+    ):
+        if max_concurrent is None:
+            max_concurrent = self._bulk_max_concurrent
+        if max_concurrent < 1:
+            raise ValueError("Bulk run max concurrent must be at least 1")
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError("Bulk run chunk size must be at least 1")
+        ws_id = strict_system_variable("workspace_id")
+        spec = self._get_validated_app_spec(app_id, tag, True, version=version)
+        plan = self.spec_manager.get_mapping_plan(app_id, tag)
+
+        service_ver = spec["behavior"].get("kb_service_version", None)
+        if version is not None:
+            service_ver = version
+        group_id = str(uuid.uuid4())
+        job_info = {
+            "method": spec["behavior"]["kb_service_name"]
+            + "."
+            + spec["behavior"]["kb_service_method"],
+            "service_ver": service_ver,
+            "app_id": app_id,
+            "wsid": ws_id,
+        }
+        job_meta = {
+            "tag": tag,
+            "bulk_group_id": group_id,
+            "bulk_size": len(params) if hasattr(params, "__len__") else None,
+        }
+        if cell_id is not None:
+            job_meta["cell_id"] = cell_id
+        if run_id is not None:
+            job_meta["run_id"] = run_id
+
+        if chunk_size is None:
+            chunks = [list(params)]
+        else:
+            chunks = self._bulk_chunks(params, chunk_size)
+
+        all_job_inputs = list()
+        new_jobs = list()
+        num_jobs = 0
+        agent_token = None
+        log_info = None
+        for chunk in chunks:
+            # Preflight check every param set in the chunk before starting any of them.
+            chunk_job_inputs = self._bulk_job_inputs(
+                app_id, tag, spec, plan, chunk, num_jobs, job_info, job_meta
+            )
+            num_jobs += len(chunk_job_inputs)
+            if dry_run:
+                all_job_inputs.extend(chunk_job_inputs)
+                continue
+
+            if agent_token is None:
+                token_name = "KBApp_{}".format(app_id)
+                token_name = token_name[: self.__MAX_TOKEN_NAME_LEN]
+                agent_token = get_agent_token_pool().get(
+                    auth.get_auth_token(), token_name
+                )
+                log_info = {
+                    "app_id": app_id,
+                    "tag": tag,
+                    "version": service_ver,
+                    "username": system_variable("user_id"),
+                    "wsid": ws_id,
+                    "group_id": group_id,
+                    "num_jobs": job_meta["bulk_size"],
+                }
+                kblogging.log_event(self._log, "run_app_bulk", log_info)
+
+            (chunk_jobs, errors) = self._submit_bulk_jobs(
+                chunk_job_inputs, agent_token, max_concurrent, cell_id, run_id
+            )
+            new_jobs.extend(chunk_jobs)
+            if errors:
+                log_info.update({"err": str(errors[0]), "num_started": len(new_jobs)})
+                kblogging.log_event(self._log, "run_app_bulk_error", log_info)
+                e = transform_job_exception(errors[0])
+                e.message = "Only {} of {} jobs were started (group {}): {}".format(
+                    len(new_jobs),
+                    job_meta["bulk_size"] or num_jobs,
+                    group_id,
+                    e.message,
+                )
+                raise e
+
+        if dry_run:
+            return all_job_inputs
+        if cell_id is not None:
+            return
+        else:
+            return new_jobs
+
+    @staticmethod
+    def _bulk_chunks(params, chunk_size):
+        """
+        Yields lists of up to chunk_size param sets from params, which can be any
+        iterable, so that only one chunk needs to be in memory at a time.
+        """
+        params_iter = iter(params)
+        chunk = list(islice(params_iter, chunk_size))
+        while chunk:
+            yield chunk
+            chunk = list(islice(params_iter, chunk_size))
+
+    def _bulk_job_inputs(
+        self, app_id, tag, spec, plan, param_sets, first_idx, job_info, job_meta
+    ):
+        """
+        Validates and maps each param set for run_app_bulk, and returns the list of
+        inputs for EE2.run_job. Each job's index in the whole bulk run starts from
+        first_idx.
+        Raises a ValueError for the first param set that doesn't validate, so that none
+        of them get started.
+        """
+        # look up all the input objects at once, so validating each set is local
+        resolve_param_refs(plan.spec_params, param_sets, system_variable("workspace"))
+        all_job_inputs = list()
+        for idx, param_set in enumerate(param_sets, first_idx):
+            try:
+                (param_set, ws_input_refs) = validate_parameters(
+                    app_id, tag, plan.spec_params, param_set
+                )
+            except ValueError as e:
+                raise ValueError("Parameter set {}: {}".format(idx, e))
+            job_runner_inputs = dict(job_info)
+            job_runner_inputs["params"] = self._map_inputs(
+                spec["behavior"]["kb_service_input_mapping"],
+                param_set,
+                plan.spec_params_map,
+                steps=plan.map_input_steps(),
+            )
+            job_runner_inputs["meta"] = dict(job_meta, bulk_index=idx)
+            if len(ws_input_refs) > 0:
+                job_runner_inputs["source_ws_objects"] = ws_input_refs
+            all_job_inputs.append(job_runner_inputs)
+        return all_job_inputs
+
+    def _submit_bulk_jobs(
+        self, all_job_inputs, agent_token, max_concurrent, cell_id, run_id
+    ):
+        """
+        Starts a job for each set of run_job inputs, with at most max_concurrent
+        run_job calls at once, and registers the ones that started. After the first
+        error, no more get started.
+        Returns a tuple (list of new Jobs, list of errors).
+        """
+        ee2 = clients.get("execution_engine2", token=agent_token["token"])
+        job_ids = [None] * len(all_job_inputs)
+        errors = list()
+        # keys = running run_job Futures, values = index of their job
+        pending = dict()
+        next_idx = 0
+        with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+            while pending or (next_idx < len(all_job_inputs) and not errors):
+                # after an error, something's wrong - don't try to start the rest
+                while (
+                    not errors
+                    and next_idx < len(all_job_inputs)
+                    and len(pending) < max_concurrent
+                ):
+                    job_runner_inputs = all_job_inputs[next_idx]
+                    job_runner_inputs["meta"]["token_id"] = agent_token["id"]
+                    future = executor.submit(ee2.run_job, job_runner_inputs)
+                    pending[future] = next_idx
+                    next_idx += 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx = pending.pop(future)
+                    try:
+                        job_ids[idx] = future.result()
+                    except Exception as e:
+                        errors.append(e)
+
+        owner = system_variable("user_id")
+        new_jobs = list()
+        for job_id, job_runner_inputs in zip(job_ids, all_job_inputs):
+            if job_id is None:
+                continue
+            new_job = Job(
+                job_id,
+                job_runner_inputs["app_id"],
+                job_runner_inputs["params"],
+                owner,
+                tag=job_runner_inputs["meta"]["tag"],
+                app_version=job_runner_inputs["service_ver"],
+                cell_id=cell_id,
+                run_id=run_id,
+                token_id=agent_token["id"],
+                meta=job_runner_inputs["meta"],
+            )
+            self._send_comm_message(
+                "run_status",
+                {
+                    "event": "launched_job",
+                    "event_at": datetime.datetime.utcnow().isoformat() + "Z",
+                    "cell_id": cell_id,
+                    "run_id": run_id,
+                    "job_id": job_id,
+                },
+            )
+            new_jobs.append(new_job)
+        self.register_new_jobs(new_jobs)
+        return (new_jobs, errors)
+
     def run_app(
         self,
         app_id,
@@ -411,14 +755,14 @@ class AppManager(object):
 
         # Preflight check the params - all required ones are present, all
         # values are the right type, all numerical values are in given ranges
-        spec_params = self.spec_manager.app_params(spec)
+        plan = self.spec_manager.get_mapping_plan(app_id, tag)
 
-        spec_params_map = dict(
-            (spec_params[i]["id"], spec_params[i]) for i in range(len(spec_params))
-        )
-        ws_input_refs = extract_ws_refs(app_id, tag, spec_params, params)
+        ws_input_refs = extract_ws_refs(app_id, tag, plan.spec_params, params)
         input_vals = self._map_inputs(
-            spec["behavior"]["kb_service_input_mapping"], params, spec_params_map
+            spec["behavior"]["kb_service_input_mapping"],
+            params,
+            plan.spec_params_map,
+            steps=plan.map_input_steps(),
         )
 
         service_method = spec["behavior"]["kb_service_method"]
@@ -457,9 +801,7 @@ class AppManager(object):
         try:
             token_name = "KBApp_{}".format(app_id)
             token_name = token_name[: self.__MAX_TOKEN_NAME_LEN]
-            agent_token = auth.get_agent_token(
-                auth.get_auth_token(), token_name=token_name
-            )
+            agent_token = get_agent_token_pool().get(auth.get_auth_token(), token_name)
         except Exception:
             raise
         job_runner_inputs["meta"]["token_id"] = agent_token["id"]
@@ -593,7 +935,7 @@ class AppManager(object):
             },
         )
 
-        spec = self._get_validated_app_spec(app_id, tag, False, version=version)
+        self._get_validated_app_spec(app_id, tag, False, version=version)
 
         # Here, we just deal with two behaviors:
         # 1. None of the above - it's a viewer.
@@ -604,8 +946,8 @@ class AppManager(object):
         # First, validate.
         # Preflight check the params - all required ones are present, all
         # values are the right type, all numerical values are in given ranges
-        spec_params = self.spec_manager.app_params(spec)
-        (params, ws_refs) = validate_parameters(app_id, tag, spec_params, params)
+        plan = self.spec_manager.get_mapping_plan(app_id, tag)
+        (params, ws_refs) = validate_parameters(app_id, tag, plan.spec_params, params)
 
         # Log that we're trying to run a job...
         log_info = {
@@ -626,7 +968,7 @@ class AppManager(object):
             },
         )
 
-        (output_widget, widget_params) = map_outputs_from_state([], params, spec)
+        (output_widget, widget_params) = plan.map_outputs([], params)
 
         # All a local app does is route the inputs to outputs through the
         # spec's mapping, and then feed that into the specified output widget.
@@ -830,7 +1172,7 @@ class AppManager(object):
                 mapped_value[target_key] = target_val
             return mapped_value
 
-    def _map_inputs(self, input_mapping, params, spec_params):
+    def _map_inputs(self, input_mapping, params, spec_params, steps=None):
         """
         Maps the dictionary of parameters and inputs based on rules provided in
         the input_mapping. This iterates over the list of input_mappings, and
@@ -842,70 +1184,51 @@ class AppManager(object):
         NarrativeMethodStore.ServiceMethodInputMapping.
         params is a dict of key-value-pairs, each key is the input_parameter
         field of some parameter.
+        steps is the input_mapping already compiled, e.g. from
+        MappingPlan.map_input_steps. If not given, it gets compiled here.
         """
+        if steps is None:
+            steps = compile_input_mapping(input_mapping, spec_params)
         inputs_dict = dict()
-        for p in input_mapping:
+        for step in steps:
             # 2 steps - figure out the proper value, then figure out the
             # proper position. value first!
             p_value = None
-            input_param_id = None
-            if "input_parameter" in p:
-                input_param_id = p["input_parameter"]
+            input_param_id = step["input_parameter"]
+            if input_param_id:
                 p_value = params.get(input_param_id, None)
-                if spec_params[input_param_id].get("type", "") == "group":
+                if step["is_group"]:
                     p_value = self._map_group_inputs(
-                        p_value, spec_params[input_param_id], spec_params
+                        p_value, step["spec_param"], spec_params
                     )
                 # turn empty strings into None
                 if isinstance(p_value, str) and len(p_value) == 0:
                     p_value = None
-            elif "narrative_system_variable" in p:
-                p_value = system_variable(p["narrative_system_variable"])
-            if "constant_value" in p and p_value is None:
-                p_value = p["constant_value"]
-            if "generated_value" in p and p_value is None:
-                p_value = self._generate_input(p["generated_value"])
-
-            spec_param = None
-            if input_param_id:
-                spec_param = spec_params[input_param_id]
+            elif step["system_variable"]:
+                p_value = system_variable(step["system_variable"])
+            if step["constant_value"] is not None and p_value is None:
+                p_value = step["constant_value"]
+            if step["generated_value"] is not None and p_value is None:
+                p_value = self._generate_input(step["generated_value"])
+
             p_value = transform_param_value(
-                p.get("target_type_transform"), p_value, spec_param
+                step["transform"], p_value, step["spec_param"]
             )
 
             # get position!
-            arg_position = p.get("target_argument_position", 0)
-            target_prop = p.get("target_property", None)
-            if target_prop is not None:
+            arg_position = step["position"]
+            target_path = step["target_path"]
+            if target_path is not None:
                 final_input = inputs_dict.get(arg_position, dict())
-                if "/" in target_prop:
-                    # This is case when slashes in target_prop separate
-                    # elements in nested maps. We ignore escaped slashes
-                    # (separate backslashes should be escaped as well).
-                    bck_slash = "\u244A"
-                    fwd_slash = "\u20EB"
-                    temp_string = target_prop.replace("\\\\", bck_slash)
-                    temp_string = temp_string.replace("\\/", fwd_slash)
-                    temp_path = []
-                    for part in temp_string.split("/"):
-                        part = part.replace(bck_slash, "\\")
-                        part = part.replace(fwd_slash, "/")
-                        temp_path.append(part.encode("ascii", "ignore").decode("ascii"))
-                    temp_map = final_input
-                    temp_key = None
-                    # We're going along the path and creating intermediate
-                    # dictionaries.
-                    for temp_path_item in temp_path:
-                        if temp_key:
-                            if temp_key not in temp_map:
-                                temp_map[temp_key] = {}
-                            temp_map = temp_map[temp_key]
-                        temp_key = temp_path_item
-                    # temp_map points to deepest nested map now, temp_key is
-                    # the last item in the path
-                    temp_map[temp_key] = p_value
-                else:
-                    final_input[target_prop] = p_value
+                temp_map = final_input
+                # We're going along the path and creating intermediate
+                # dictionaries.
+                for temp_key in target_path[:-1]:
+                    if temp_key not in temp_map:
+                        temp_map[temp_key] = {}
+                    temp_map = temp_map[temp_key]
+                # temp_map points to deepest nested map now
+                temp_map[target_path[-1]] = p_value
                 inputs_dict[arg_position] = final_input
             else:
                 inputs_dict[arg_position] = p_value
@@ -954,3 +1277,16 @@ class AppManager(object):
         self._send_comm_message("new_job", {"job_id": job.job_id})
         JobComm().lookup_job_state(job.job_id)
         JobComm().start_job_status_loop()
+
+    def register_new_jobs(self, jobs: list) -> None:
+        """
+        Like register_new_job, for a group of jobs that were started together. Their
+        states get looked up together too, in a single check_jobs call.
+        """
+        if not jobs:
+            return
+        JobManager().register_new_jobs(jobs)
+        for job in jobs:
+            self._send_comm_message("new_job", {"job_id": job.job_id})
+        JobComm().lookup_job_states([job.job_id for job in jobs])
+        JobComm().start_job_status_loop()
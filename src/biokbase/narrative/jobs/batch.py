@@ -29,39 +29,19 @@ def get_input_scaffold(app, tag="release", use_defaults=False):
     use_defaults - if True, include the default value for parameters that have one. (default False)
     """
     sm = specmanager.SpecManager()
-    spec = sm.get_spec(app, tag=tag)  # will raise an exception if it's not found.
-    spec_params = sm.app_params(spec)
-    (spec_params_dict, grouped_params) = _index_spec_params(spec_params)
+    # will raise an exception if it's not found.
+    spec_params = sm.get_param_index(app, tag=tag)
 
     input_scaffold = dict()
     for p in spec_params:
-        if p["id"] not in grouped_params:
+        # params that are part of groups are filled in with their group.
+        if p["id"] not in spec_params.grouped:
             input_scaffold[p["id"]] = _make_scaffold_input(
-                p, spec_params_dict, use_defaults
+                p, spec_params.by_id, use_defaults
             )
     return input_scaffold
 
 
-def _index_spec_params(spec_params):
-    """
-    Makes an index of the spec parameters. It dict-ifies the list of spec params
-    provided by the SpecManager, and also returns the set of param ids that are
-    used in groups.
-    This gets returned as a tuple (indexed params, group param ids)
-    """
-    spec_params_dict = dict()
-    grouped_parents = dict()
-    for p in spec_params:
-        spec_params_dict[p["id"]] = p
-        # groupify the parameters - identify params that are part of groups, and don't include
-        # them in the list separately.
-        children = p.get("parameter_ids")
-        if children:
-            for child in children:
-                grouped_parents[child] = p["id"]
-    return (spec_params_dict, grouped_parents)
-
-
 def _make_scaffold_input(param, params_dict, use_defaults):
     """
     param = dict of info about one param - id, is it a group, what types are allowed, etc.
@@ -256,14 +236,29 @@ def generate_input_batch(app, tag="release", **kwargs):
     output object name strings will have their formatting validated (e.g. no spaces are allowed in workspace
     object names)
     """
-    sm = specmanager.SpecManager()
-    spec = sm.get_spec(app, tag=tag)
+    return list(iter_input_batch(app, tag=tag, **kwargs))
+
+
+def iter_input_batch(app, tag="release", **kwargs):
+    """
+    Like generate_input_batch, but rather than a list, this returns an InputBatch that
+    makes each set of inputs as it's iterated over. So even a sweep over tens of
+    thousands of combinations never has them all in memory at once, and the first ones
+    can be validated and run right away, e.g.:
+
+    batch = iter_input_batch(app, min_length=(0, 1, 10000), ...)
+    len(batch)  # the number of runs, without making any of them
+    AppManager().run_app_bulk(app, batch, chunk_size=500)
+
+    All the inputs are checked here, so this raises the same ValueErrors as
+    generate_input_batch, before any input sets are made.
+    """
+    spec_params = specmanager.SpecManager().get_param_index(app, tag=tag)
     if not kwargs:
         raise ValueError(
             "No inputs were given! If you just want to build an empty input set, try get_input_scaffold."
         )
-    spec_params = sm.app_params(spec)
-    (spec_params_dict, grouped_params) = _index_spec_params(spec_params)
+    spec_params_dict = spec_params.by_id
 
     # Initial checking, make sure all kwargs exist as params.
     input_vals = dict()
@@ -285,41 +280,78 @@ def generate_input_batch(app, tag="release", **kwargs):
 
     # makes the scaffold that we're going to adjust for each iteration
     input_scaffold = get_input_scaffold(app, tag=tag, use_defaults=True)
-    batch_inputs = list()
-    param_ids = input_vals.keys()
-    product_inputs = [input_vals[k] for k in param_ids]
     batch_size = 1
-    for p in product_inputs:
-        batch_size *= len(
-            p
-        )  # reduce(lambda x, y: x*y, [len(p) for p in product_inputs])
+    for vals in input_vals.values():
+        batch_size *= len(vals)
     # prepare output values
     output_vals = _prepare_output_vals(output_vals, spec_params_dict, batch_size)
+    return InputBatch(input_scaffold, spec_params.grouped, input_vals, output_vals)
+
 
-    batch_count = 0
-    for p in product(*product_inputs):
-        next_input = deepcopy(input_scaffold)
-        for idx, name in enumerate(param_ids):
-            if name in grouped_params:
-                # if it's a list, use the 0th element.
-                if isinstance(next_input[grouped_params[name]], list):
-                    next_input[grouped_params[name]][0][name] = p[idx]
+class InputBatch(object):
+    """
+    The set of app inputs for a batch run, made one at a time when iterated over,
+    from every combination of the input values. See iter_input_batch.
+    """
+
+    def __init__(self, input_scaffold, grouped_params, input_vals, output_vals):
+        """
+        input_scaffold - the scaffold (from get_input_scaffold) each input set starts from
+        grouped_params - dict of param id to the id of the group param it's part of
+        input_vals - dict of param id to the list of values to combine
+        output_vals - dict of output param id to a list of names or a name template
+        """
+        self.input_scaffold = input_scaffold
+        self.grouped_params = grouped_params
+        self.input_vals = input_vals
+        self.output_vals = output_vals
+
+    def __len__(self):
+        batch_size = 1
+        for vals in self.input_vals.values():
+            batch_size *= len(vals)
+        return batch_size
+
+    def __iter__(self):
+        param_ids = list(self.input_vals.keys())
+        product_inputs = [self.input_vals[k] for k in param_ids]
+        for batch_count, p in enumerate(product(*product_inputs)):
+            next_input = deepcopy(self.input_scaffold)
+            for idx, name in enumerate(param_ids):
+                if name in self.grouped_params:
+                    group = next_input[self.grouped_params[name]]
+                    # if it's a list, use the 0th element.
+                    if isinstance(group, list):
+                        group[0][name] = p[idx]
+                    else:
+                        group[name] = p[idx]
+                else:
+                    next_input[name] = p[idx]
+            # handle output params
+            for out_key, out_val in self.output_vals.items():
+                if isinstance(out_val, list):
+                    next_input[out_key] = out_val[batch_count]
                 else:
-                    next_input[grouped_params[name]][name] = p[idx]
-            else:
-                next_input[name] = p[idx]
-        # handle output params
-        for out_key, out_val in output_vals.items():
-            if isinstance(out_val, list):
-                next_input[out_key] = out_val[batch_count]
-            else:
-                t = Template(out_val)
-                sub_dict = {"run_number": batch_count}
-                sub_dict.update(_flatten_params(next_input))
-                next_input[out_key] = t.substitute(sub_dict)
-        batch_inputs.append(next_input)
-        batch_count = batch_count + 1
-    return batch_inputs
+                    t = Template(out_val)
+                    sub_dict = {"run_number": batch_count}
+                    sub_dict.update(_flatten_params(next_input))
+                    next_input[out_key] = t.substitute(sub_dict)
+            yield next_input
+
+    def chunks(self, chunk_size):
+        """
+        Yields the input sets in lists of up to chunk_size.
+        """
+        if chunk_size < 1:
+            raise ValueError("Chunk size must be at least 1")
+        chunk = list()
+        for next_input in self:
+            chunk.append(next_input)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = list()
+        if chunk:
+            yield chunk
 
 
 def _flatten_params(d):
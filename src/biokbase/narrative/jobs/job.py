@@ -1,6 +1,6 @@
 import biokbase.narrative.clients as clients
 from .specmanager import SpecManager
-from biokbase.narrative.app_util import map_inputs_from_job, map_outputs_from_state
+from .logstore import JobLogStore
 import json
 import uuid
 from jinja2 import Template
@@ -12,6 +12,8 @@ KBase job class
 __author__ = "Bill Riehl <wjriehl@lbl.gov>"
 
 EXCLUDED_JOB_STATE_FIELDS = ["authstrat", "job_input", "condor_job_ads"]
+# The most log lines fetched at once when looking for the end of a log.
+LOG_FETCH_SIZE = 1000
 
 
 class Job(object):
@@ -22,7 +24,6 @@ class Job(object):
     run_id = None
     inputs = None
     token_id = None
-    _job_logs = list()
     _last_state = None
 
     def __init__(
@@ -53,6 +54,7 @@ class Job(object):
         self.owner = owner
         self.token_id = token_id
         self.meta = meta
+        self._log_store = JobLogStore()
 
     @classmethod
     def from_state(
@@ -75,7 +77,8 @@ class Job(object):
         job_info - dict
             The job information returned from njs.get_job_params, just the first
             element of that list (not the extra list with URLs). Should have the following keys:
-            'params': The set of parameters sent to that job.
+            'params': The set of parameters sent to that job. If this is missing, they get
+                fetched by parameters() when they're needed.
             'service_ver': The version of the service that was run.
         owner - string
             The owner of the job (username of person who started it)
@@ -91,7 +94,7 @@ class Job(object):
         return cls(
             job_id,
             app_id,
-            job_info.get("params", {}),
+            job_info.get("params"),
             owner,
             tag=tag,
             app_version=job_info.get("service_ver", None),
@@ -107,9 +110,9 @@ class Job(object):
         if job_state is None or job_state.get("status", "") != "completed":
             return None
 
-        spec = SpecManager().get_spec(app_id, app_tag)
-        (output_widget, widget_params) = map_outputs_from_state(
-            job_state, map_inputs_from_job(job_inputs, spec), spec
+        plan = SpecManager().get_mapping_plan(app_id, app_tag)
+        (output_widget, widget_params) = plan.map_outputs(
+            job_state, plan.unmap_inputs(job_inputs)
         )
         return {"name": output_widget, "tag": app_tag, "params": widget_params}
 
@@ -123,7 +126,7 @@ class Job(object):
             print(f"Status: {state['status']}")
             # inputs = map_inputs_from_state(state, spec)
             print("Inputs:\n------")
-            pprint(self.inputs)
+            pprint(self.parameters())
         except BaseException:
             print("Unable to retrieve current running state!")
 
@@ -136,7 +139,8 @@ class Job(object):
     def parameters(self):
         """
         Returns the parameters used to start the job. Job tries to use its inputs field, but
-        if that's None, then it makes a call to njs.
+        if that's None, then it makes a call to EE2. Jobs that were already finished when
+        the JobManager loaded them start out without their inputs, so they get fetched here.
 
         If no exception is raised, this only returns the list of parameters, NOT the whole
         object fetched from NJS.get_job_params
@@ -146,7 +150,7 @@ class Job(object):
         else:
             try:
                 self.inputs = clients.get("execution_engine2").get_job_params(
-                    self.job_id
+                    {"job_id": self.job_id}
                 )["params"]
                 return self.inputs
             except Exception as e:
@@ -205,10 +209,8 @@ class Job(object):
         return {"name": output_widget, "tag": self.tag, "params": widget_params}
 
     def _get_output_info(self, state):
-        spec = self.app_spec()
-        return map_outputs_from_state(
-            state, map_inputs_from_job(self.parameters(), spec), spec
-        )
+        plan = SpecManager().get_mapping_plan(self.app_id, self.tag)
+        return plan.map_outputs(state, plan.unmap_inputs(self.parameters()))
 
     def log(self, first_line=0, num_lines=None):
         """
@@ -234,29 +236,92 @@ class Job(object):
         log(first_line=5) - returns every line available starting with line 5
         log(num_lines=100) - returns the first 100 lines (or all lines available if < 100)
         """
-        self._update_log()
-        num_available_lines = len(self._job_logs)
-
         if first_line < 0:
             first_line = 0
+        if num_lines is not None and num_lines < 0:
+            num_lines = 0
+        self._update_log(first_line, num_lines)
+        num_available_lines = self._log_store.total_lines
+
         if num_lines is None:
             num_lines = num_available_lines - first_line
-        if num_lines < 0:
-            num_lines = 0
 
         if first_line >= num_available_lines or num_lines <= 0:
             return (num_available_lines, list())
+        last_line = min(first_line + num_lines, num_available_lines)
+        return (num_available_lines, self._log_store.get_lines(first_line, last_line))
+
+    def log_tail(self, num_lines):
+        """
+        Fetch the last num_lines lines of the Job logs.
+        This returns a 3-tuple (first line number returned, number of available log lines,
+        list of log lines). The lines are the same as the ones returned by log().
+
+        Unlike log(), this doesn't fetch the whole log to get to the end of it. Only the
+        missing lines in the tail get fetched, once the end is found.
+        """
+        num_lines = max(num_lines, 0)
+        store = self._log_store
+        self._update_log_end(max(num_lines, 1))
+        num_available_lines = store.total_lines
+        first_line = max(num_available_lines - num_lines, 0)
+        self._fetch_lines(first_line, num_available_lines)
         return (
+            first_line,
             num_available_lines,
-            self._job_logs[first_line : first_line + num_lines],
+            store.get_lines(first_line, num_available_lines),
         )
 
-    def _update_log(self):
-        log_update = clients.get("execution_engine2").get_job_logs(
-            {"job_id": self.job_id, "skip_lines": len(self._job_logs)}
-        )
-        if log_update["lines"]:
-            self._job_logs = self._job_logs + log_update["lines"]
+    def _update_log(self, first_line=0, num_lines=None):
+        """
+        Fetches the log lines needed to return the given range, and finds the current
+        end of the log. If num_lines is None, this fetches everything from first_line to
+        the end of the log. Lines that were already fetched aren't fetched again.
+        """
+        store = self._log_store
+        if num_lines is None:
+            start = store.first_missing(first_line, store.total_lines)
+            self._fetch_log(store.total_lines if start is None else start)
+            self._fetch_lines(first_line, store.total_lines)
+            return
+        last_line = first_line + num_lines
+        start = store.first_missing(first_line, min(last_line, store.total_lines))
+        if start is not None:
+            self._fetch_log(start, last_line - start)
+        self._update_log_end()
+        self._fetch_lines(first_line, min(last_line, store.total_lines))
+
+    def _update_log_end(self, limit=LOG_FETCH_SIZE):
+        """
+        Finds the current number of lines in the log. Every get_job_logs call reports
+        that as its last_line_number, so this is a single call for up to limit new lines
+        past the known end.
+        """
+        self._fetch_log(self._log_store.total_lines, limit)
+
+    def _fetch_lines(self, first_line, last_line):
+        """
+        Fetches whatever's missing of the lines from first_line up to last_line. EE2 can
+        return fewer lines than were asked for, so this keeps going until they're all
+        there, or a call returns nothing.
+        """
+        start = self._log_store.first_missing(first_line, last_line)
+        while start is not None:
+            if not self._fetch_log(start, last_line - start):
+                break
+            start = self._log_store.first_missing(start, last_line)
+
+    def _fetch_log(self, offset, limit=None):
+        params = {"job_id": self.job_id, "offset": offset}
+        if limit is not None:
+            params["limit"] = limit
+        log_update = clients.get("execution_engine2").get_job_logs(params)
+        lines = log_update.get("lines", [])
+        self._log_store.add_lines(offset, lines)
+        # count is just the number of lines in this response
+        if log_update.get("last_line_number") is not None:
+            self._log_store.set_total_lines(log_update["last_line_number"])
+        return lines
 
     def is_finished(self):
         """
@@ -1,9 +1,19 @@
 import threading
+import time
 from ipykernel.comm import Comm
 import biokbase.narrative.jobs.jobmanager as jobmanager
+from biokbase.narrative.jobs.scheduler import JobPollScheduler
+from biokbase.narrative.jobs.logstream import JobLogStreamer
 from biokbase.narrative.exception_util import NarrativeException
 from biokbase.narrative.common import kblogging
 
+# The shortest time (in seconds) the lookup loop will wait between runs.
+MIN_LOOKUP_INTERVAL = 1
+# How often (in seconds) the lookup loop also sweeps up jobs that nothing is listening to.
+DEFAULT_SWEEP_INTERVAL = 300
+# Version of the job_status_delta message format.
+JOB_STATUS_PROTOCOL_VERSION = 1
+
 
 class JobRequest:
     """
@@ -57,12 +67,24 @@ class JobComm:
     The JobComm officially exposes the channel for other things to use. Anything that
     needs to send messages about Jobs to the front end should use JobComm.send_comm_message.
 
-    It also maintains the lookup loop thread. This is a threading.Timer that, after
-    some interval, will lookup the status of all running jobs. If there are no jobs to
-    look up, this cancels itself.
+    It also maintains the lookup loop thread. This is a threading.Timer that looks up the
+    status of whichever jobs are due, as decided by a JobPollScheduler, then re-arms itself
+    for when the next job falls due. If there are no jobs to look up, this cancels itself.
+
+    By default, the loop runs in "subscribed-only" mode. Only jobs that something is
+    listening to (via start_job_update) get looked up on their usual schedule, and all
+    other unfinished jobs get swept up every so often. In this mode, the loop also cancels
+    itself when nothing is listening to any job.
+
+    The loop only sends the states of jobs that changed since the last message, as
+    job_status_delta messages. Each of these has a sequence number, one more than the
+    last. If the front end sees a gap in the sequence, it should send a resync_job_status
+    request to get all job states again.
 
     Allowed messages:
     * all_status - return job state for all jobs in this Narrative.
+    * resync_job_status - return the most recent job state of all jobs in this Narrative as
+        a full job_status_delta message, without looking anything up
     * job_status - return the job state for a single job (requires a job_id)
     * job_info - return basic job info for a single job (requires a job_id)
     * start_update_loop - starts a looping thread that runs returns all job info
@@ -73,6 +95,9 @@ class JobComm:
     * cancel_job - cancels a running job, if it hasn't otherwise terminated (requires a job_id)
     * job_logs - sends job logs back over the comm channel (requires a job id and first line)
     * job_logs_latest - sends the most recent job logs over the comm channel (requires a job_id)
+    * start_log_stream - starts sending new log lines for a job as job_log_stream messages,
+        as they show up (requires a job_id, optional first_line)
+    * stop_log_stream - stops sending new log lines for a job (requires a job_id)
     """
 
     # An instance of this class. It's meant to be a singleton, so this just gets created and
@@ -88,6 +113,23 @@ class JobComm:
     _msg_map = None
     _running_lookup_loop = False
     _lookup_timer = None
+    # True until the first run of the loop after it starts, which sweeps up every job.
+    _initial_sweep = False
+    _loop_lock = threading.RLock()
+    # Decides when each job gets looked up in the loop.
+    _poll_scheduler = None
+    # If True, the loop only looks up jobs with listeners, outside of the occasional sweep.
+    _subscribed_only = True
+    _sweep_interval = DEFAULT_SWEEP_INTERVAL
+    _last_sweep = None
+    # keys = job_id, values = most recent job state sent to the front end
+    _last_job_states = dict()
+    # ids of jobs whose states were sent before, but that no longer exist
+    _removed_job_ids = set()
+    # sequence number of the last job_status_delta message
+    _status_seq = 0
+    # Pushes new log lines for jobs whose logs are being streamed.
+    _log_streamer = None
     _log = kblogging.get_logger(__name__)
 
     def __new__(cls):
@@ -101,9 +143,18 @@ class JobComm:
             self._comm.on_msg(self._handle_comm_message)
         if self._jm is None:
             self._jm = jobmanager.JobManager()
+        if self._poll_scheduler is None:
+            self._poll_scheduler = JobPollScheduler()
+        if self._log_streamer is None:
+            self._log_streamer = JobLogStreamer(
+                self._fetch_streamed_logs,
+                self._send_streamed_logs,
+                self._job_is_finished,
+            )
         if self._msg_map is None:
             self._msg_map = {
                 "all_status": self._lookup_all_job_states,
+                "resync_job_status": self._resync_job_states,
                 "job_status": self._lookup_job_state,
                 "job_info": self._lookup_job_info,
                 "start_update_loop": self.start_job_status_loop,
@@ -113,6 +164,8 @@ class JobComm:
                 "cancel_job": self._cancel_job,
                 "job_logs": self._get_job_logs,
                 "job_logs_latest": self._get_job_logs,
+                "start_log_stream": self._modify_log_stream,
+                "stop_log_stream": self._modify_log_stream,
             }
 
     def _verify_job_id(self, req: JobRequest) -> None:
@@ -122,7 +175,8 @@ class JobComm:
 
     def start_job_status_loop(self, *args, **kwargs) -> None:
         """
-        Starts the job status lookup loop. This runs every 10 seconds.
+        Starts the job status lookup loop. How often this runs depends on the states of the
+        jobs being looked up - see JobPollScheduler.
         This has the bare *args and **kwargs to handle the case where this comes in as a job
         channel request (gets a JobRequest arg), or has the "init_jobs" kwarg.
 
@@ -143,37 +197,219 @@ class JobComm:
                     "service": "execution_engine2",
                 }
                 self.send_comm_message("job_init_err", error)
-        if self._lookup_timer is None:
-            self._lookup_job_status_loop()
+        with self._loop_lock:
+            if self._lookup_timer is None:
+                self._initial_sweep = True
+                self._lookup_job_status_loop()
 
     def stop_job_status_loop(self, *args, **kwargs) -> None:
         """
         Stops the job status lookup loop if it's running. Otherwise, this effectively
         does nothing.
         """
-        if self._lookup_timer:
-            self._lookup_timer.cancel()
-            self._lookup_timer = None
-        self._running_lookup_loop = False
+        with self._loop_lock:
+            if self._lookup_timer:
+                self._lookup_timer.cancel()
+                self._lookup_timer = None
+            self._running_lookup_loop = False
+
+    def configure_job_polling(
+        self, subscribed_only: bool = None, sweep_interval: float = None, **kwargs
+    ) -> None:
+        """
+        Changes how often jobs get looked up by the status loop. Along with the arguments
+        here, this takes the same keyword arguments as JobPollScheduler.configure -
+        base_interval, changed_interval, backoff_factor, max_interval, and coalesce_window.
+        :param subscribed_only: bool - if True, the loop only looks up jobs that have
+            listeners, and sweeps up the rest every sweep_interval seconds. If False, all
+            jobs get looked up on their usual schedule.
+        :param sweep_interval: float - seconds between sweeps of jobs without listeners
+        """
+        if sweep_interval is not None and sweep_interval <= 0:
+            raise ValueError("Sweep interval must be greater than 0")
+        with self._loop_lock:
+            self._poll_scheduler.configure(**kwargs)
+            if subscribed_only is not None:
+                self._subscribed_only = subscribed_only
+            if sweep_interval is not None:
+                self._sweep_interval = sweep_interval
 
     def _lookup_job_status_loop(self) -> None:
         """
-        Run a loop that will look up job info. After running, this spawns a Timer thread on a 10
-        second loop to run itself again.
+        Run a loop that will look up job info for all jobs that are due to be polled. These
+        get looked up together, and any job states that changed get sent to the front end.
+        After running, this spawns a Timer thread to run itself again when the next job falls
+        due.
+
+        The first run after the loop starts always sweeps up all unfinished jobs and sends
+        the full set of job states. In subscribed-only mode, if no jobs have listeners after
+        that, the loop stops.
         """
-        job_statuses = self._lookup_all_job_states(None)
-        if len(job_statuses) == 0 or not self._running_lookup_loop:
-            self.stop_job_status_loop()
-        else:
-            self._lookup_timer = threading.Timer(10, self._lookup_job_status_loop)
+        with self._loop_lock:
+            # A Timer that was replaced or canceled while waiting for the lock is stale.
+            if (
+                self._lookup_timer is not None
+                and self._lookup_timer is not threading.current_thread()
+            ):
+                return
+            job_ids = self._jm.get_job_ids()
+            if len(job_ids) == 0 or not self._running_lookup_loop:
+                self.stop_job_status_loop()
+                return
+            self._poll_scheduler.sync_jobs(job_ids)
+            first_run = self._initial_sweep
+            self._initial_sweep = False
+            due_job_ids = self._due_job_ids(first_run)
+            if len(due_job_ids) or first_run:
+                job_states = self._jm.lookup_job_states(due_job_ids)
+                changed_states = self._record_job_states(due_job_ids, job_states)
+                removed_job_ids = self._prune_job_states()
+                if first_run:
+                    self._send_job_status_delta(
+                        dict(self._last_job_states),
+                        sorted(self._removed_job_ids),
+                        full=True,
+                    )
+                elif len(changed_states) or len(removed_job_ids):
+                    self._send_job_status_delta(changed_states, removed_job_ids)
+            self._schedule_next_lookup()
+
+    def _schedule_next_lookup(self) -> None:
+        """
+        Spawns the Timer thread that runs the lookup loop again when the next job falls
+        due. In subscribed-only mode, if no jobs have listeners, this stops the loop instead.
+        """
+        with self._loop_lock:
+            if self._subscribed_only:
+                refreshing_job_ids = self._jm.get_job_ids(refreshing_only=True)
+                if len(refreshing_job_ids) == 0:
+                    self.stop_job_status_loop()
+                    return
+                delay = self._poll_scheduler.seconds_until_next_poll(refreshing_job_ids)
+                until_sweep = self._last_sweep + self._sweep_interval - time.monotonic()
+                delay = until_sweep if delay is None else min(delay, until_sweep)
+            else:
+                delay = self._poll_scheduler.seconds_until_next_poll()
+            if delay is None:
+                delay = self._poll_scheduler.max_interval
+            self._lookup_timer = threading.Timer(
+                max(delay, MIN_LOOKUP_INTERVAL), self._lookup_job_status_loop
+            )
             self._lookup_timer.start()
 
+    def _due_job_ids(self, sweep: bool = False) -> list:
+        """
+        Returns the ids of the jobs that should be looked up on this run of the loop.
+        In subscribed-only mode, that's the jobs with listeners that are due, along with
+        every other unfinished job if a sweep is due (or sweep is True).
+        If sweep is True, this also has every job with listeners, even finished ones,
+        so they get their output viewer info.
+        """
+        refreshing_job_ids = self._jm.get_job_ids(refreshing_only=True)
+        if not self._subscribed_only:
+            due_job_ids = set(self._poll_scheduler.due_jobs())
+        else:
+            due_job_ids = set(self._poll_scheduler.due_jobs(refreshing_job_ids))
+            now = time.monotonic()
+            if (
+                sweep
+                or self._last_sweep is None
+                or now - self._last_sweep >= self._sweep_interval
+            ):
+                self._last_sweep = now
+                due_job_ids.update(self._poll_scheduler.scheduled_jobs())
+        if sweep:
+            due_job_ids.update(refreshing_job_ids)
+        return sorted(due_job_ids)
+
+    def _record_job_states(self, job_ids: list, job_states: dict) -> dict:
+        """
+        Remembers the states that were just looked up, and reschedules the next lookup of
+        each job in job_ids. Any job in job_ids that's missing from job_states is treated
+        as a failed lookup.
+
+        Returns a dict of just the job states that are different from the ones last
+        remembered, keyed on job id.
+        """
+        changed_states = {
+            job_id: state
+            for job_id, state in job_states.items()
+            if self._last_job_states.get(job_id) != state
+        }
+        self._last_job_states.update(job_states)
+        for job_id in job_ids:
+            state = job_states.get(job_id)
+            status = state["state"].get("status") if state is not None else None
+            self._poll_scheduler.update(job_id, status)
+        return changed_states
+
+    def _prune_job_states(self) -> list:
+        """
+        Forgets the remembered states of any jobs that the JobManager no longer knows about,
+        and returns their ids. These are kept, so full job_status_delta messages can tell
+        the front end they're gone.
+        """
+        job_ids = set(self._jm.get_job_ids())
+        removed_job_ids = sorted(
+            job_id for job_id in self._last_job_states.keys() if job_id not in job_ids
+        )
+        for job_id in removed_job_ids:
+            del self._last_job_states[job_id]
+        self._removed_job_ids.difference_update(job_ids)
+        self._removed_job_ids.update(removed_job_ids)
+        return removed_job_ids
+
+    def _send_job_status_delta(
+        self, job_states: dict, removed_job_ids: list = None, full: bool = False
+    ) -> None:
+        """
+        Sends a job_status_delta message with the next sequence number. This looks like:
+        {
+            protocol: int - the message format version,
+            seq: int - the sequence number, one more than the last one sent,
+            full: bool - if True, states has every job that's been looked up, and removed
+                has every job that's gone since, not just the changes since the last message,
+            states: dict - keys = job id, values = job state (same as job_status_all),
+            removed: list - ids of jobs that no longer exist
+        }
+        """
+        with self._loop_lock:
+            self._status_seq += 1
+            self.send_comm_message(
+                "job_status_delta",
+                {
+                    "protocol": JOB_STATUS_PROTOCOL_VERSION,
+                    "seq": self._status_seq,
+                    "full": full,
+                    "states": job_states,
+                    "removed": removed_job_ids or [],
+                },
+            )
+
+    def _resync_job_states(self, req: JobRequest) -> dict:
+        """
+        Sends the most recently looked up state of every job as a full job_status_delta
+        message, along with the ids of every job that no longer exists. This is meant for
+        when the front end misses a message in the sequence.
+        Nothing gets looked up from EE2 - jobs that haven't been looked up yet will show
+        up in a later message.
+        req can be None, as it's not used.
+        """
+        with self._loop_lock:
+            self._prune_job_states()
+            job_states = dict(self._last_job_states)
+            self._send_job_status_delta(
+                job_states, sorted(self._removed_job_ids), full=True
+            )
+        return job_states
+
     def _lookup_all_job_states(self, req: JobRequest) -> dict:
         """
         Fetches status of all jobs in the current workspace and sends them to the front end.
         req can be None, as it's not used.
         """
         job_statuses = self._jm.lookup_all_job_states(ignore_refresh_flag=True)
+        self._record_job_states(list(job_statuses.keys()), job_statuses)
         self.send_comm_message("job_status_all", job_statuses)
         return job_statuses
 
@@ -211,6 +447,19 @@ class JobComm:
         )
         return self._lookup_job_state(req)
 
+    def lookup_job_states(self, job_ids: list) -> dict:
+        """
+        Like lookup_job_state, for several jobs at once. Their states get looked up
+        together, then each one gets sent to the browser in its own job_status message.
+        Returns the dict of job states, keyed by job id. Raises a ValueError if any of
+        the jobs isn't known to the JobManager.
+        """
+        job_states = self._jm.lookup_job_states(job_ids)
+        for job_id in job_ids:
+            if job_id in job_states:
+                self.send_comm_message("job_status", job_states[job_id])
+        return job_states
+
     def _lookup_job_state(self, req: JobRequest) -> dict:
         """
         Look up job state.
@@ -229,7 +478,8 @@ class JobComm:
         """
         Modifies how many things want to listen to a job update.
         If this is a request to start a job update, then this starts the update loop that
-        returns update messages across the job channel.
+        returns update messages across the job channel. If the loop is already running, just
+        that job gets looked up right away, and any change is sent as a job_status_delta.
         If this is a request to stop a job update, then this sends that request to the
         JobManager, which might have the side effect of shutting down the update loop if there's
         no longer anything requesting job status.
@@ -241,7 +491,20 @@ class JobComm:
         update_adjust = 1 if req.request == "start_job_update" else -1
         self._jm.modify_job_refresh(req.job_id, update_adjust)
         if update_adjust == 1:
-            self.start_job_status_loop()
+            with self._loop_lock:
+                if self._lookup_timer is None:
+                    # Starting the loop looks up every job with listeners, this one included.
+                    self.start_job_status_loop()
+                    return
+                # Look just this job up right away, rather than whenever it's next due.
+                self._lookup_timer.cancel()
+                self._lookup_timer = None
+                job_states = self._jm.lookup_job_states([req.job_id])
+                changed_states = self._record_job_states([req.job_id], job_states)
+                removed_job_ids = self._prune_job_states()
+                if len(changed_states) or len(removed_job_ids):
+                    self._send_job_status_delta(changed_states, removed_job_ids)
+                self._schedule_next_lookup()
 
     def _cancel_job(self, req: JobRequest) -> None:
         """
@@ -313,6 +576,89 @@ class JobComm:
             )
             raise
 
+    def _modify_log_stream(self, req: JobRequest) -> None:
+        """
+        Starts or stops streaming a job's logs. While a job's log is being streamed, new
+        lines get sent as job_log_stream messages as they show up. Streams are shared, so
+        if there's already a stream going for the job, this just adds (or removes) a
+        listener, and a new listener only gets lines from then on.
+
+        If the given job_id in the request doesn't exist in the current Narrative, or is None,
+        this raises a ValueError.
+        """
+        self._verify_job_id(req)
+        try:
+            self._jm.get_job(req.job_id)
+        except ValueError:
+            self.send_error_message("job_does_not_exist", req)
+            raise
+        if req.request == "start_log_stream":
+            self._log_streamer.start_stream(
+                req.job_id, first_line=req.rq_data.get("first_line", 0)
+            )
+        else:
+            self._log_streamer.stop_stream(req.job_id)
+
+    def _fetch_streamed_logs(self, job_id: str, first_line: int) -> tuple:
+        (_, max_lines, logs) = self._jm.get_job_logs(job_id, first_line=first_line)
+        return (max_lines, logs)
+
+    def _send_streamed_logs(
+        self, job_id: str, first_line: int, max_lines: int, lines: list, finished: bool
+    ) -> None:
+        """
+        Sends a job_log_stream message. This looks like:
+        {
+            job_id: string,
+            first: int - the line number of the first line in lines,
+            max_lines: int - the number of lines available in the log,
+            lines: list - the new log lines, the same as in a job_logs message,
+            finished: bool - if True, the job is done and this stream has stopped
+        }
+        """
+        self.send_comm_message(
+            "job_log_stream",
+            {
+                "job_id": job_id,
+                "first": first_line,
+                "max_lines": max_lines,
+                "lines": lines,
+                "finished": finished,
+            },
+        )
+
+    def _job_is_finished(self, job_id: str) -> bool:
+        """
+        Returns True if the job is in a terminal state. If the lookup loop is keeping the
+        job's state up to date, this goes by the most recently looked up one. Otherwise,
+        this looks the job up itself, so a log stream still finishes when nothing is
+        listening to the job's status, or the loop has stopped.
+        A job the JobManager no longer knows about counts as finished.
+        """
+        if self._poll_scheduler.is_finished(job_id):
+            return True
+        if job_id not in self._jm.get_job_ids():
+            return True
+        if self._loop_polls_job(job_id):
+            state = self._last_job_states.get(job_id)
+        else:
+            state = self._jm.lookup_job_states([job_id]).get(job_id)
+        if state is None:
+            return False
+        return state.get("state", {}).get("status") in jobmanager.TERMINAL_STATES
+
+    def _loop_polls_job(self, job_id: str) -> bool:
+        """
+        Returns True if the lookup loop is running, and looks the job up on its usual
+        schedule.
+        """
+        with self._loop_lock:
+            if self._lookup_timer is None:
+                return False
+            if not self._subscribed_only:
+                return True
+            return job_id in self._jm.get_job_ids(refreshing_only=True)
+
     def _handle_comm_message(self, msg: dict) -> None:
         """
         Handles comm messages that come in from the other end of the KBaseJobs channel.
@@ -1,5 +1,11 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import biokbase.narrative.clients as clients
 from .job import Job
+from .statecache import JobStateCache
+from .snapshot import JobSnapshot, JOB_SNAPSHOT_ENV_VAR
 
 # from ipykernel.comm import Comm
 from biokbase.narrative.common import kblogging
@@ -7,6 +13,7 @@ from IPython.display import HTML
 from jinja2 import Template
 from datetime import datetime, timezone, timedelta
 from biokbase.narrative.app_util import system_variable
+from biokbase.narrative.objectcache import invalidate_resolved_refs
 from biokbase.narrative.exception_util import transform_job_exception
 
 """
@@ -24,6 +31,20 @@ __version__ = "0.0.1"
 
 TERMINAL_STATES = ["completed", "terminated", "error"]
 EXCLUDED_JOB_STATE_FIELDS = ["authstrat", "job_input", "condor_job_ads"]
+# Fields left out when building Job objects. job_input has the app and cell info, but
+# its params (usually the bulk of it) only get fetched when they're needed. EE2 takes
+# dotted paths for fields of job_input.
+JOB_INIT_EXCLUDED_JOB_STATE_FIELDS = ["authstrat", "condor_job_ads", "job_input.params"]
+# Fields left out when fetching job parameters.
+JOB_PARAMS_EXCLUDED_JOB_STATE_FIELDS = ["authstrat", "condor_job_ads", "job_output"]
+
+# Large lists of job ids get split into chunks for separate check_jobs calls, which
+# are run concurrently. Chunks that fail are retried this many more times, after
+# waiting this many seconds, doubled for each retry after the first.
+DEFAULT_CHECK_JOBS_CHUNK_SIZE = 100
+DEFAULT_CHECK_JOBS_MAX_WORKERS = 4
+DEFAULT_CHECK_JOBS_RETRIES = 2
+DEFAULT_CHECK_JOBS_RETRY_BACKOFF = 0.5
 
 
 class JobManager(object):
@@ -38,7 +59,18 @@ class JobManager(object):
     # keys = job_id, values = { refresh = T/F, job = Job object }
     _running_jobs = dict()
     # keys = job_id, values = state from either Job object or NJS (these are identical)
-    _completed_job_states = dict()
+    # bounded, see configure_job_state_cache
+    _completed_job_states = JobStateCache()
+    # keys = job_id, values = final state of a finished job, from the local job snapshot
+    _snapshot_job_states = dict()
+
+    _job_snapshot = None
+    _job_snapshot_configured = False
+
+    _check_jobs_chunk_size = DEFAULT_CHECK_JOBS_CHUNK_SIZE
+    _check_jobs_max_workers = DEFAULT_CHECK_JOBS_MAX_WORKERS
+    _check_jobs_retries = DEFAULT_CHECK_JOBS_RETRIES
+    _check_jobs_retry_backoff = DEFAULT_CHECK_JOBS_RETRY_BACKOFF
 
     _log = kblogging.get_logger(__name__)
 
@@ -56,41 +88,161 @@ class JobManager(object):
         2. get list of jobs with that ws id from UJS (also gets tag, cell_id, run_id)
         3. initialize the Job objects by running NJS.get_job_params (also gets app_id)
         4. start the status lookup loop.
+
+        If there's a local job snapshot (see configure_job_snapshot), jobs already in it
+        are rebuilt from there, and only the others have their job info fetched from
+        EE2. Finished jobs' states also come from the snapshot.
+
+        Job parameters aren't part of the listing. They get fetched when an output
+        viewer or lookup_job_info needs them (see _load_job_parameters), and then kept
+        in the snapshot.
         """
         ws_id = system_variable("workspace_id")
         job_states = dict()
         kblogging.log_event(self._log, "JobManager.initialize_jobs", {"ws_id": ws_id})
+        snapshot_jobs = self._load_job_snapshot(ws_id)
         try:
-            job_states = clients.get("execution_engine2").check_workspace_jobs(
-                {"workspace_id": ws_id, "return_list": 0}
-            )
+            ee2 = clients.get("execution_engine2")
+            if snapshot_jobs:
+                # only need the full job info for jobs that aren't in the snapshot
+                job_states = ee2.check_workspace_jobs(
+                    {
+                        "workspace_id": ws_id,
+                        "exclude_fields": EXCLUDED_JOB_STATE_FIELDS,
+                        "return_list": 0,
+                    }
+                )
+                new_job_ids = [
+                    job_id for job_id in job_states if job_id not in snapshot_jobs
+                ]
+                if new_job_ids:
+                    (new_job_states, _) = self._check_jobs(
+                        new_job_ids, exclude_fields=JOB_INIT_EXCLUDED_JOB_STATE_FIELDS
+                    )
+                    job_states.update(new_job_states)
+            else:
+                job_states = ee2.check_workspace_jobs(
+                    {
+                        "workspace_id": ws_id,
+                        "exclude_fields": JOB_INIT_EXCLUDED_JOB_STATE_FIELDS,
+                        "return_list": 0,
+                    }
+                )
             self._running_jobs = dict()
+            self._snapshot_job_states = dict()
         except Exception as e:
             kblogging.log_event(self._log, "init_error", {"err": str(e)})
             new_e = transform_job_exception(e)
             raise new_e
 
+        to_snapshot = list()
         for job_id, job_state in job_states.items():
-            job_input = job_state.get("job_input", {})
-            job_meta = job_input.get("narrative_cell_info", {})
             status = job_state.get("status")
-            job = Job.from_state(
-                job_id,
-                job_input,
-                job_state.get("user"),
-                app_id=job_input.get("app_id"),
-                tag=job_meta.get("tag", "release"),
-                cell_id=job_meta.get("cell_id", None),
-                run_id=job_meta.get("run_id", None),
-                token_id=job_meta.get("token_id", None),
-                meta=job_meta,
-            )
+            if job_id in snapshot_jobs:
+                job, final_state = snapshot_jobs[job_id]
+                if final_state is not None:
+                    # finished jobs don't change, so no need to ask EE2 again
+                    status = final_state.get("status")
+                    self._snapshot_job_states[job_id] = final_state
+                elif status in TERMINAL_STATES:
+                    to_snapshot.append((job, self._slim_job_state(job_state)))
+            else:
+                job_input = job_state.get("job_input", {})
+                job_meta = job_input.get("narrative_cell_info", {})
+                job = Job.from_state(
+                    job_id,
+                    job_input,
+                    job_state.get("user"),
+                    app_id=job_input.get("app_id"),
+                    tag=job_meta.get("tag", "release"),
+                    cell_id=job_meta.get("cell_id", None),
+                    run_id=job_meta.get("run_id", None),
+                    token_id=job_meta.get("token_id", None),
+                    meta=job_meta,
+                )
+                final_state = None
+                if status in TERMINAL_STATES:
+                    final_state = self._slim_job_state(job_state)
+                to_snapshot.append((job, final_state))
             self._running_jobs[job_id] = {
                 "refresh": 1
                 if status not in ["completed", "errored", "terminated"]
                 else 0,
                 "job": job,
             }
+        self._save_job_snapshot(ws_id, to_snapshot)
+
+    def configure_job_snapshot(self, path: str = None) -> None:
+        """
+        Sets the path to the SQLite file used as a local snapshot of workspace jobs,
+        which is used to speed up initialize_jobs. If path is None or empty, the snapshot
+        is turned off.
+        By default, this uses the path in the KB_JOB_SNAPSHOT_PATH environment variable,
+        if it's set.
+        """
+        self._job_snapshot_configured = True
+        self._job_snapshot = JobSnapshot(path) if path else None
+
+    def _get_job_snapshot(self):
+        if not self._job_snapshot_configured:
+            path = os.environ.get(JOB_SNAPSHOT_ENV_VAR)
+            try:
+                self.configure_job_snapshot(path)
+            except (OSError, sqlite3.Error) as e:
+                kblogging.log_event(self._log, "job_snapshot.error", {"err": str(e)})
+                self.configure_job_snapshot(None)
+        return self._job_snapshot
+
+    def _load_job_snapshot(self, ws_id) -> dict:
+        snapshot = self._get_job_snapshot()
+        if snapshot is None:
+            return dict()
+        try:
+            return snapshot.load(ws_id)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            kblogging.log_event(self._log, "job_snapshot.error", {"err": str(e)})
+            return dict()
+
+    def _save_job_snapshot(self, ws_id, jobs: list) -> None:
+        """
+        Stores jobs in the snapshot, if there is one.
+        jobs - a list of (Job object, final state dict or None) tuples
+        """
+        snapshot = self._get_job_snapshot()
+        if snapshot is None or not jobs:
+            return
+        try:
+            snapshot.save(ws_id, jobs)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            kblogging.log_event(self._log, "job_snapshot.error", {"err": str(e)})
+
+    def _update_job_snapshot(self, jobs: list) -> None:
+        snapshot = self._get_job_snapshot()
+        if snapshot is None or not jobs:
+            return
+        try:
+            snapshot.update_jobs(system_variable("workspace_id"), jobs)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            kblogging.log_event(self._log, "job_snapshot.error", {"err": str(e)})
+
+    def _save_job_snapshot_state(self, job_id: str, state: dict) -> None:
+        snapshot = self._get_job_snapshot()
+        if snapshot is None:
+            return
+        try:
+            snapshot.save_state(
+                system_variable("workspace_id"), job_id, self._slim_job_state(state)
+            )
+        except (OSError, ValueError, sqlite3.Error) as e:
+            kblogging.log_event(self._log, "job_snapshot.error", {"err": str(e)})
+
+    @staticmethod
+    def _slim_job_state(state: dict) -> dict:
+        return {
+            key: value
+            for key, value in state.items()
+            if key not in EXCLUDED_JOB_STATE_FIELDS
+        }
 
     def _create_jobs(self, job_ids):
         """
@@ -99,8 +251,8 @@ class JobManager(object):
         Initially used to make Child jobs from some parent, but will eventually be adapted to all jobs on startup.
         Just slaps them all into _running_jobs
         """
-        job_states = clients.get("execution_engine2").check_jobs(
-            {"job_ids": job_ids, "return_list": 0}
+        (job_states, _) = self._check_jobs(
+            job_ids, exclude_fields=JOB_INIT_EXCLUDED_JOB_STATE_FIELDS
         )
         for job_id in job_ids:
             if job_id in job_ids and job_id not in self._running_jobs:
@@ -232,7 +384,9 @@ class JobManager(object):
             "updated": 0,
         }
 
-    def _construct_job_status(self, job: Job, state: dict) -> dict:
+    def _construct_job_status(
+        self, job: Job, state: dict, viewer_info: bool = True
+    ) -> dict:
         """
         Creates a Job status dictionary with structure:
         {
@@ -264,6 +418,8 @@ class JobManager(object):
         :param job: a Job object
         :param state: dict, expected to be in the format that comes straight from the
             Execution Engine 2 service
+        :param viewer_info: bool - if False, widget_info is left as None, even if the job
+            is finished. Making it needs the job's parameters.
         """
         widget_info = None
         app_spec = {}
@@ -304,7 +460,7 @@ class JobManager(object):
                 job_id=job.job_id,
             )
 
-        if state.get("finished"):
+        if state.get("finished") and viewer_info:
             try:
                 widget_info = job.get_viewer_params(state)
             except Exception as e:
@@ -365,13 +521,7 @@ class JobManager(object):
 
         sub_job_list = sorted(sub_job_list)
 
-        job_states = clients.get("execution_engine2").check_jobs(
-            {
-                "job_ids": sub_job_list,
-                "exclude_fields": EXCLUDED_JOB_STATE_FIELDS,
-                "return_list": 0,
-            }
-        )
+        (job_states, _) = self._check_jobs(sub_job_list)
         child_job_states = list()
 
         for job_id in sub_job_list:
@@ -414,33 +564,247 @@ class JobManager(object):
         # Fetch from cache of terminated jobs, where available.
         # These are already post-processed and ready to return.
         for job_id in job_ids:
-            if job_id in self._completed_job_states:
-                job_states[job_id] = self._completed_job_states[job_id]
+            cached_state = self._completed_job_states.get(job_id)
+            if cached_state is not None:
+                job_states[job_id] = cached_state
             else:
                 jobs_to_lookup.append(job_id)
 
-        fetched_states = dict()
+        # Finished jobs loaded from the local snapshot don't need an EE2 lookup.
+        fetched_states = {
+            job_id: self._snapshot_job_states[job_id]
+            for job_id in jobs_to_lookup
+            if job_id in self._snapshot_job_states
+        }
+        jobs_to_lookup = [
+            job_id for job_id in jobs_to_lookup if job_id not in fetched_states
+        ]
         # Get the rest of states direct from EE2.
         if len(jobs_to_lookup):
             try:
-                fetched_states = clients.get("execution_engine2").check_jobs(
-                    {
-                        "job_ids": jobs_to_lookup,
-                        "exclude_fields": EXCLUDED_JOB_STATE_FIELDS,
-                        "return_list": 0,
-                    }
-                )
+                (ee2_states, failed_ids) = self._check_jobs(jobs_to_lookup)
+                finished = [
+                    job_id
+                    for job_id, state in ee2_states.items()
+                    if state.get("status") in TERMINAL_STATES
+                ]
+                for job_id in finished:
+                    self._save_job_snapshot_state(job_id, ee2_states[job_id])
+                if finished:
+                    # finished jobs may have saved objects under names we've resolved
+                    invalidate_resolved_refs()
+                fetched_states.update(ee2_states)
+                # These get an error state, which isn't cached, so they're looked up
+                # again next time.
+                for job_id in failed_ids:
+                    job_states[job_id] = self._construct_job_status(
+                        self.get_job(job_id), None
+                    )
             except Exception as e:
                 kblogging.log_event(
                     self._log, "construct_job_status_set", {"err": str(e)}
                 )
+        # Output viewer info needs the job's parameters, so it's only made for finished
+        # jobs that something is listening to. The others get it once they're opened.
+        viewed_ids = [
+            job_id
+            for job_id, state in fetched_states.items()
+            if state.get("finished") and self._has_listeners(job_id)
+        ]
+        self._load_job_parameters(viewed_ids)
         for job_id, state in fetched_states.items():
+            if state.get("finished") and job_id not in viewed_ids:
+                # not cached as complete, but kept so opening it doesn't ask EE2 again
+                self._snapshot_job_states[job_id] = self._slim_job_state(state)
+                job_states[job_id] = self._construct_job_status(
+                    self.get_job(job_id), state, viewer_info=False
+                )
+                continue
             revised_state = self._construct_job_status(self.get_job(job_id), state)
             if revised_state["state"]["status"] in TERMINAL_STATES:
-                self._completed_job_states[job_id] = revised_state
+                self._completed_job_states.put(job_id, revised_state)
             job_states[job_id] = revised_state
         return job_states
 
+    def _has_listeners(self, job_id: str) -> bool:
+        return (
+            job_id in self._running_jobs and self._running_jobs[job_id]["refresh"] > 0
+        )
+
+    def configure_job_fetching(
+        self,
+        chunk_size: int = None,
+        max_workers: int = None,
+        retries: int = None,
+        retry_backoff: float = None,
+    ) -> None:
+        """
+        Changes how job states are fetched from EE2. Anything left as None is unchanged.
+        chunk_size - the maximum number of job ids sent in a single check_jobs call
+        max_workers - the maximum number of check_jobs calls made at once
+        retries - how many more times a failed chunk gets tried
+        retry_backoff - seconds to wait before the first retry, doubled for each one after
+        Raises a ValueError for bad values.
+        """
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError("check_jobs chunk size must be at least 1")
+        if max_workers is not None and max_workers < 1:
+            raise ValueError("check_jobs max workers must be at least 1")
+        if retries is not None and retries < 0:
+            raise ValueError("check_jobs retries must not be negative")
+        if retry_backoff is not None and retry_backoff < 0:
+            raise ValueError("check_jobs retry backoff must not be negative")
+        if chunk_size is not None:
+            self._check_jobs_chunk_size = chunk_size
+        if max_workers is not None:
+            self._check_jobs_max_workers = max_workers
+        if retries is not None:
+            self._check_jobs_retries = retries
+        if retry_backoff is not None:
+            self._check_jobs_retry_backoff = retry_backoff
+
+    def configure_job_state_cache(
+        self, max_entries: int = None, max_bytes: int = None, spill_dir: str = None
+    ) -> None:
+        """
+        Changes the limits on the cache of finished job states. Anything left as None is
+        unchanged. If spill_dir is set, states evicted from memory are written there,
+        and read back instead of going to EE2 again. See JobStateCache.configure.
+        """
+        self._completed_job_states.configure(
+            max_entries=max_entries, max_bytes=max_bytes, spill_dir=spill_dir
+        )
+
+    def get_job_state_cache_stats(self) -> dict:
+        """
+        Returns the hit, miss, and eviction counts and the current size of the cache of
+        finished job states.
+        """
+        return self._completed_job_states.stats()
+
+    def _check_jobs(
+        self, job_ids: list, exclude_fields: list = EXCLUDED_JOB_STATE_FIELDS
+    ) -> tuple:
+        """
+        Fetches job states from EE2 with check_jobs. Returns a tuple of (job states,
+        failed job ids), where job states is a dict with keys = job_id, values = state,
+        and failed job ids is a list of the jobs that couldn't be looked up.
+
+        The job ids are split into chunks of at most _check_jobs_chunk_size, which are
+        looked up concurrently on up to _check_jobs_max_workers threads. Chunks that fail
+        are retried up to _check_jobs_retries times, with an exponential backoff starting
+        at _check_jobs_retry_backoff seconds, while keeping the results of the chunks that
+        worked. If nothing could be looked up at all, the last error is raised.
+        """
+        job_ids = list(job_ids)
+        if not job_ids:
+            return (dict(), list())
+        params = {"return_list": 0}
+        if exclude_fields:
+            params["exclude_fields"] = exclude_fields
+
+        size = self._check_jobs_chunk_size
+        chunks = list()
+        for start in range(0, len(job_ids), size):
+            end = start + size
+            chunks.append(job_ids[start:end])
+        job_states = dict()
+        error = None
+        for attempt in range(self._check_jobs_retries + 1):
+            if not chunks:
+                break
+            if attempt > 0:
+                time.sleep(self._check_jobs_retry_backoff * 2 ** (attempt - 1))
+            failed_chunks = list()
+            if len(chunks) == 1:
+                # no need for a thread just for the one call
+                try:
+                    job_states.update(self._check_jobs_chunk(chunks[0], params))
+                except Exception as e:
+                    error = e
+                    failed_chunks.append(chunks[0])
+            else:
+                workers = min(self._check_jobs_max_workers, len(chunks))
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    futures = {
+                        pool.submit(self._check_jobs_chunk, chunk, params): chunk
+                        for chunk in chunks
+                    }
+                    for future in as_completed(futures):
+                        try:
+                            job_states.update(future.result())
+                        except Exception as e:
+                            error = e
+                            failed_chunks.append(futures[future])
+            chunks = failed_chunks
+
+        failed_ids = [job_id for chunk in chunks for job_id in chunk]
+        if failed_ids:
+            kblogging.log_event(
+                self._log,
+                "check_jobs.error",
+                {"num_jobs": len(failed_ids), "err": str(error)},
+            )
+            if not job_states:
+                raise error
+        return (job_states, failed_ids)
+
+    def _check_jobs_chunk(self, job_ids: list, params: dict) -> dict:
+        """
+        Makes a single check_jobs call for a chunk of job ids, and logs how long it took.
+        """
+        start = time.time()
+        err = None
+        try:
+            return clients.get("execution_engine2").check_jobs(
+                dict(params, job_ids=job_ids)
+            )
+        except Exception as e:
+            err = str(e)
+            raise
+        finally:
+            kblogging.log_event(
+                self._log,
+                "check_jobs.chunk",
+                {
+                    "num_jobs": len(job_ids),
+                    "time": round(time.time() - start, 3),
+                    "err": err,
+                },
+            )
+
+    def _load_job_parameters(self, job_ids: list) -> None:
+        """
+        Fetches the parameters of any of these jobs that don't have them yet, all together.
+        Otherwise, Job.parameters() would look them up one job at a time when making the
+        output viewer info for finished jobs. They're kept in the job snapshot too, so
+        they don't need fetching again after a restart.
+        """
+        job_ids = [
+            job_id
+            for job_id in job_ids
+            if job_id in self._running_jobs
+            and self._running_jobs[job_id]["job"].inputs is None
+        ]
+        if not job_ids:
+            return
+        try:
+            (job_states, _) = self._check_jobs(
+                job_ids, exclude_fields=JOB_PARAMS_EXCLUDED_JOB_STATE_FIELDS
+            )
+        except Exception as e:
+            # Job.parameters() will try again for each job
+            kblogging.log_event(self._log, "load_job_parameters", {"err": str(e)})
+            return
+        loaded = list()
+        for job_id, state in job_states.items():
+            job_input = state.get("job_input")
+            if job_input is not None:
+                job = self._running_jobs[job_id]["job"]
+                job.inputs = job_input.get("params", {})
+                loaded.append(job)
+        self._update_job_snapshot(loaded)
+
     def _verify_job_parentage(self, parent_job_id, child_job_id):
         """
         Validate job relationships.
@@ -486,11 +850,12 @@ class JobManager(object):
         if parent_job_id is not None:
             self._verify_job_parentage(parent_job_id, job_id)
         job = self.get_job(job_id)
+        self._load_job_parameters([job_id])
         info = {
             "app_id": job.app_id,
             "app_name": job.app_spec()["info"]["name"],
             "job_id": job_id,
-            "job_params": job.inputs,
+            "job_params": job.parameters(),
         }
         return info
 
@@ -504,16 +869,81 @@ class JobManager(object):
         :param ignore_refresh_flag: boolean - if True, ignore the usual refresh state of the job.
             Even if the job is stopped, or completed, fetch and return its state from the service.
         """
-        jobs_to_lookup = list()
-        # grab the list of running job ids, so we don't run into update-while-iterating problems.
-        for job_id in self._running_jobs.keys():
-            if self._running_jobs[job_id]["refresh"] > 0 or ignore_refresh_flag:
-                jobs_to_lookup.append(job_id)
+        jobs_to_lookup = self.get_job_ids(refreshing_only=not ignore_refresh_flag)
         if len(jobs_to_lookup) > 0:
             return self._construct_job_status_set(jobs_to_lookup)
         else:
             return dict()
 
+    def lookup_job_states(self, job_ids: list) -> dict:
+        """
+        Fetches states for just the given jobs. Any that aren't already cached as
+        finished get looked up together in a single check_jobs call.
+
+        This returns them all as a dictionary, keyed on the job id. Jobs whose states
+        couldn't be fetched are left out.
+        """
+        if not len(job_ids):
+            return dict()
+        return self._construct_job_status_set(list(job_ids))
+
+    def get_job_group(self, group_id: str) -> list:
+        """
+        Returns the ids of the jobs that were started together by AppManager.run_app_bulk
+        with the given group id, in the order of their parameter sets.
+        """
+        group = [
+            job_info["job"]
+            for job_info in list(self._running_jobs.values())
+            if job_info["job"].meta.get("bulk_group_id") == group_id
+        ]
+        group.sort(key=lambda job: job.meta.get("bulk_index", 0))
+        return [job.job_id for job in group]
+
+    def lookup_job_group_state(self, group_id: str) -> dict:
+        """
+        Fetches the states of all the jobs in a group (see get_job_group), and sums
+        them up. Returns a dict with keys:
+            group_id - the group id
+            job_ids - the list of job ids in the group
+            size - the number of jobs the group was started with
+            status_counts - dict, keys = status, values = the number of jobs in it
+            finished - the number of jobs in a terminal state
+            job_states - dict of job states, as from lookup_job_states
+        Raises a ValueError if there are no jobs in the group.
+        """
+        job_ids = self.get_job_group(group_id)
+        if not job_ids:
+            raise ValueError(f"No jobs present in group {group_id}")
+        job_states = self.lookup_job_states(job_ids)
+        status_counts = dict()
+        for job_id in job_ids:
+            status = (
+                job_states.get(job_id, {}).get("state", {}).get("status", "unknown")
+            )
+            status_counts[status] = status_counts.get(status, 0) + 1
+        return {
+            "group_id": group_id,
+            "job_ids": job_ids,
+            "size": self.get_job(job_ids[0]).meta.get("bulk_size") or len(job_ids),
+            "status_counts": status_counts,
+            "finished": sum(status_counts.get(s, 0) for s in TERMINAL_STATES),
+            "job_states": job_states,
+        }
+
+    def get_job_ids(self, refreshing_only: bool = False) -> list:
+        """
+        Returns the ids of all jobs this JobManager knows about.
+        :param refreshing_only: boolean - if True, only return the ids of jobs that something
+            is listening for updates to (i.e. their refresh count is > 0).
+        """
+        # grab the list of running job ids, so we don't run into update-while-iterating problems.
+        return [
+            job_id
+            for job_id, job_info in list(self._running_jobs.items())
+            if not refreshing_only or job_info["refresh"] > 0
+        ]
+
     def register_new_job(self, job: Job) -> None:
         """
         Registers a new Job with the manager - should only be invoked when a new Job gets
@@ -525,8 +955,20 @@ class JobManager(object):
         job : biokbase.narrative.jobs.job.Job object
             The new Job that was started.
         """
-        kblogging.log_event(self._log, "register_new_job", {"job_id": job.job_id})
-        self._running_jobs[job.job_id] = {"job": job, "refresh": 0}
+        self.register_new_jobs([job])
+
+    def register_new_jobs(self, jobs: list) -> None:
+        """
+        Registers a group of new Jobs at once, like register_new_job, but stores them in
+        the job snapshot together.
+        """
+        for job in jobs:
+            kblogging.log_event(self._log, "register_new_job", {"job_id": job.job_id})
+            self._running_jobs[job.job_id] = {"job": job, "refresh": 0}
+        if self._get_job_snapshot() is not None:
+            self._save_job_snapshot(
+                system_variable("workspace_id"), [(job, None) for job in jobs]
+            )
 
     def get_job(self, job_id):
         """
@@ -574,11 +1016,11 @@ class JobManager(object):
             num_lines = 0
 
         try:
-            if latest_only:
+            if latest_only and num_lines is not None:
+                # only fetches the tail of the log, not the whole thing
+                (first_line, max_lines, logs) = job.log_tail(num_lines)
+            elif latest_only:
                 (max_lines, logs) = job.log()
-                if num_lines is not None and max_lines > num_lines:
-                    first_line = max_lines - num_lines
-                    logs = logs[first_line:]
             else:
                 (max_lines, logs) = job.log(first_line=first_line, num_lines=num_lines)
 
@@ -634,12 +1076,15 @@ class JobManager(object):
             self._verify_job_parentage(parent_job_id, job_id)
         if job_id is None or job_id not in self._running_jobs:
             raise ValueError(f"No job present with id {job_id}")
-        if job_id in self._completed_job_states:
-            return self._completed_job_states[job_id]
+        cached_state = self._completed_job_states.get(job_id)
+        if cached_state is not None:
+            return cached_state
         job = self.get_job(job_id)
         state = self._construct_job_status(job, job.state())
+        if state["state"].get("status") in TERMINAL_STATES:
+            invalidate_resolved_refs()
         if state.get("status") == "completed":
-            self._completed_job_states[job_id] = state
+            self._completed_job_states.put(job_id, state)
         return state
 
     def modify_job_refresh(
@@ -0,0 +1,214 @@
+"""
+Storage for job log lines.
+
+Logs are kept in fixed-size pages of lines, keyed by page number, so any line can be
+found directly from its line number, lines can be stored out of order (e.g. just the
+tail of a log), and appending never copies what's already there.
+
+Very long logs can have their full pages compressed and moved out to a segment file,
+which is read back through mmap when those lines are asked for again.
+"""
+import json
+import mmap
+import os
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+LOG_PAGE_SIZE = 1000
+
+# Default spill settings for new log stores. If segment_dir is None, nothing is spilled.
+_spill_defaults = {"segment_dir": None, "max_memory_lines": 100000}
+
+
+def configure_log_spill(segment_dir: str = None, max_memory_lines: int = None) -> None:
+    """
+    Sets the defaults used by new JobLogStores for moving full pages of log lines out of
+    memory. Once a store has more than max_memory_lines in memory, its least recently
+    used full pages get compressed into a segment file in segment_dir. If segment_dir is
+    None, logs are kept in memory.
+    """
+    if max_memory_lines is not None:
+        if max_memory_lines < LOG_PAGE_SIZE:
+            raise ValueError(f"Log max memory lines must be at least {LOG_PAGE_SIZE}")
+        _spill_defaults["max_memory_lines"] = max_memory_lines
+    if segment_dir is not None:
+        os.makedirs(segment_dir, exist_ok=True)
+    _spill_defaults["segment_dir"] = segment_dir
+
+
+class LogSegmentFile:
+    """
+    An append-only file of compressed log pages. Pages are read back through mmap.
+    The file is removed when this is closed.
+    """
+
+    def __init__(self, segment_dir: str):
+        fd, self.path = tempfile.mkstemp(
+            prefix="job_log_", suffix=".seg", dir=segment_dir
+        )
+        self._file = os.fdopen(fd, "w+b")
+        self._map = None
+        # keys = page number, values = (byte offset, length)
+        self._index = dict()
+        self._size = 0
+
+    def write_page(self, page_no: int, lines: list) -> None:
+        data = zlib.compress(json.dumps(lines).encode("utf-8"))
+        self._file.seek(self._size)
+        self._file.write(data)
+        self._file.flush()
+        self._index[page_no] = (self._size, len(data))
+        self._size += len(data)
+
+    def read_page(self, page_no: int):
+        """
+        Returns the list of lines stored for the page, or None if it's not here.
+        """
+        if page_no not in self._index:
+            return None
+        offset, length = self._index[page_no]
+        if self._map is None or len(self._map) < offset + length:
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        end = offset + length
+        return json.loads(zlib.decompress(self._map[offset:end]))
+
+    def __contains__(self, page_no: int) -> bool:
+        return page_no in self._index
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class JobLogStore:
+    """
+    Holds the log lines fetched so far for a single job, and how many lines the log is
+    known to have in total. Lines that haven't been fetched are None.
+    """
+
+    def __init__(
+        self,
+        page_size: int = LOG_PAGE_SIZE,
+        segment_dir: str = None,
+        max_memory_lines: int = None,
+    ):
+        self.page_size = page_size
+        self.segment_dir = segment_dir or _spill_defaults["segment_dir"]
+        self.max_memory_lines = max_memory_lines or _spill_defaults["max_memory_lines"]
+        self._lock = threading.RLock()
+        # keys = page number, values = list of page_size lines. Most recently used last.
+        self._pages = OrderedDict()
+        self._segment = None
+        # the number of lines the log is known to have
+        self.total_lines = 0
+
+    def add_lines(self, first_line: int, lines: list) -> None:
+        """
+        Stores lines starting at line number first_line.
+        """
+        with self._lock:
+            for i, line in enumerate(lines):
+                line_no = first_line + i
+                page = self._page(line_no // self.page_size, create=True)
+                page[line_no % self.page_size] = line
+            if lines:
+                self.total_lines = max(self.total_lines, first_line + len(lines))
+            self._spill()
+
+    def set_total_lines(self, total_lines: int) -> None:
+        """
+        Records that the log has (at least) this many lines, whether or not they've been
+        fetched yet.
+        """
+        with self._lock:
+            self.total_lines = max(self.total_lines, total_lines)
+
+    def get_lines(self, first_line: int, last_line: int) -> list:
+        """
+        Returns the lines from first_line up to but not including last_line. Lines that
+        haven't been fetched are None.
+        """
+        with self._lock:
+            lines = list()
+            line_no = first_line
+            while line_no < last_line:
+                page_no = line_no // self.page_size
+                start = line_no % self.page_size
+                end = min(self.page_size, start + last_line - line_no)
+                page = self._page(page_no)
+                if page is None:
+                    lines.extend([None] * (end - start))
+                else:
+                    lines.extend(page[start:end])
+                line_no += end - start
+            return lines
+
+    def first_missing(self, first_line: int, last_line: int):
+        """
+        Returns the number of the first line in the range that hasn't been fetched yet,
+        or None if they all have.
+        """
+        with self._lock:
+            for i, line in enumerate(self.get_lines(first_line, last_line)):
+                if line is None:
+                    return first_line + i
+            return None
+
+    def _page(self, page_no: int, create: bool = False):
+        page = self._pages.get(page_no)
+        if page is None and self._segment is not None and page_no in self._segment:
+            page = self._segment.read_page(page_no)
+            self._pages[page_no] = page
+        if page is None and create:
+            page = [None] * self.page_size
+            self._pages[page_no] = page
+        if page is not None:
+            self._pages.move_to_end(page_no)
+        return page
+
+    def _spill(self) -> None:
+        if not self.segment_dir:
+            return
+        if len(self._pages) * self.page_size <= self.max_memory_lines:
+            return
+        # only full pages get spilled, so they never have to be written again
+        for page_no in list(self._pages.keys()):
+            if len(self._pages) * self.page_size <= self.max_memory_lines:
+                break
+            page = self._pages[page_no]
+            if None in page:
+                continue
+            if self._segment is None:
+                self._segment = LogSegmentFile(self.segment_dir)
+            if page_no not in self._segment:
+                self._segment.write_page(page_no, page)
+            del self._pages[page_no]
+
+    def memory_lines(self) -> int:
+        """
+        Returns the number of line slots held in memory.
+        """
+        with self._lock:
+            return len(self._pages) * self.page_size
+
+    def close(self) -> None:
+        with self._lock:
+            self._pages.clear()
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+            self.total_lines = 0
+
+    def __del__(self):
+        if getattr(self, "_segment", None) is not None:
+            self._segment.close()
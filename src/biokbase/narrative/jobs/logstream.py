@@ -0,0 +1,225 @@
+"""
+Push-based log streaming for the KBaseJobs channel.
+
+Rather than the front end asking for job logs over and over, it can subscribe to a
+job's log. The kernel then looks for new lines on its own, and pushes just those.
+"""
+import threading
+import time
+from biokbase.narrative.common import kblogging
+
+# All intervals are in seconds.
+DEFAULT_MIN_INTERVAL = 1
+DEFAULT_MAX_INTERVAL = 30
+DEFAULT_BACKOFF_FACTOR = 2
+# The most lines sent in a single message. Anything past that goes in the next one.
+DEFAULT_MAX_BATCH_LINES = 500
+
+
+class JobLogStreamer:
+    """
+    Keeps track of which job logs are being streamed, and runs a Timer thread that
+    fetches and sends new lines for each of them.
+
+    Every stream is shared by all of its listeners, so each job's log only gets
+    fetched once per run, however many viewers it has. A stream stops once its last
+    listener stops it, or once the job is finished and all of its lines have been sent.
+
+    Each job gets its own polling interval. It drops to min_interval whenever new lines
+    show up, and otherwise backs off by backoff_factor up to max_interval. No more than
+    max_batch_lines are sent at once - if there are more, the rest go out min_interval
+    seconds later.
+
+    This takes three functions, so it doesn't depend on the rest of the job machinery:
+    fetch_logs(job_id, first_line) - returns a tuple (number of log lines available,
+        list of log lines from first_line on)
+    send_lines(job_id, first_line, num_available, lines, finished) - sends the lines
+    is_finished(job_id) - returns True if the job won't produce any more log lines
+    """
+
+    _log = kblogging.get_logger(__name__)
+
+    def __init__(
+        self,
+        fetch_logs,
+        send_lines,
+        is_finished,
+        min_interval: float = DEFAULT_MIN_INTERVAL,
+        max_interval: float = DEFAULT_MAX_INTERVAL,
+        backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        max_batch_lines: int = DEFAULT_MAX_BATCH_LINES,
+        clock=time.monotonic,
+    ):
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError(
+                "Log stream intervals must be greater than 0, with the maximum at least "
+                "the minimum"
+            )
+        if backoff_factor < 1:
+            raise ValueError("Log stream backoff factor must be at least 1")
+        if max_batch_lines < 1:
+            raise ValueError("Log stream batch size must be at least 1")
+        self._fetch_logs = fetch_logs
+        self._send_lines = send_lines
+        self._is_finished = is_finished
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.max_batch_lines = max_batch_lines
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._timer = None
+        # keys = job_id, values = {
+        #   listeners = int, next_line = int, interval = float, next_poll = float
+        # }
+        self._streams = dict()
+
+    def start_stream(self, job_id: str, first_line: int = 0) -> None:
+        """
+        Adds a listener to the job's log stream, starting the stream if there isn't one.
+        A new stream sends lines starting at first_line. An existing stream just carries
+        on from where it is, so a new listener should fetch any earlier lines it needs
+        with a job_logs request.
+        """
+        with self._lock:
+            stream = self._streams.get(job_id)
+            if stream is None:
+                stream = {
+                    "listeners": 0,
+                    "next_line": max(first_line or 0, 0),
+                    "interval": self.min_interval,
+                }
+                self._streams[job_id] = stream
+            stream["listeners"] += 1
+            stream["next_poll"] = self._clock()
+            self._restart_timer()
+
+    def stop_stream(self, job_id: str) -> None:
+        """
+        Removes a listener from the job's log stream. The stream stops once it has no
+        listeners left.
+        """
+        with self._lock:
+            stream = self._streams.get(job_id)
+            if stream is None:
+                return
+            stream["listeners"] -= 1
+            if stream["listeners"] <= 0:
+                del self._streams[job_id]
+            if not self._streams:
+                self._cancel_timer()
+
+    def stop_all(self) -> None:
+        with self._lock:
+            self._streams.clear()
+            self._cancel_timer()
+
+    def streaming_jobs(self) -> list:
+        with self._lock:
+            return sorted(self._streams.keys())
+
+    def listener_count(self, job_id: str) -> int:
+        with self._lock:
+            return self._streams.get(job_id, {}).get("listeners", 0)
+
+    def poll(self):
+        """
+        Fetches and sends new lines for every stream that's due.
+        Returns the number of seconds until the next stream is due, or None if there
+        are no streams left.
+
+        The logs get fetched without holding the lock, so streams can be started and
+        stopped in the meantime. A stream that was stopped (or restarted) while its log
+        was being fetched just has the fetched lines dropped.
+        """
+        with self._lock:
+            now = self._clock()
+            due = [
+                (job_id, stream["next_line"])
+                for job_id, stream in sorted(self._streams.items())
+                if stream["next_poll"] <= now
+            ]
+        for job_id, first_line in due:
+            self._poll_stream(job_id, first_line)
+        with self._lock:
+            if not self._streams:
+                return None
+            next_poll = min(stream["next_poll"] for stream in self._streams.values())
+            return max(next_poll - self._clock(), 0)
+
+    def _poll_stream(self, job_id: str, first_line: int) -> None:
+        # Check this before fetching, so the last lines can't be missed if the job
+        # finishes in between.
+        finished = self._is_finished(job_id)
+        try:
+            (num_available, lines) = self._fetch_logs(job_id, first_line)
+        except Exception as e:
+            kblogging.log_event(
+                self._log, "log_stream.error", {"job_id": job_id, "err": str(e)}
+            )
+            with self._lock:
+                stream = self._current_stream(job_id, first_line)
+                if stream is not None:
+                    self._back_off(stream)
+            return
+
+        batch = lines[: self.max_batch_lines]
+        with self._lock:
+            stream = self._current_stream(job_id, first_line)
+            if stream is None:
+                return
+            stream["next_line"] += len(batch)
+            done = finished and stream["next_line"] >= num_available
+            # sent under the lock, so batches for the same job can't go out of order
+            if batch or done:
+                self._send_lines(job_id, first_line, num_available, batch, done)
+            if done:
+                del self._streams[job_id]
+            elif batch:
+                stream["interval"] = self.min_interval
+                stream["next_poll"] = self._clock() + self.min_interval
+            else:
+                self._back_off(stream)
+
+    def _current_stream(self, job_id: str, first_line: int):
+        # The stream the lines starting at first_line were fetched for, or None if it
+        # was stopped or moved on since.
+        stream = self._streams.get(job_id)
+        if stream is None or stream["next_line"] != first_line:
+            return None
+        return stream
+
+    def _back_off(self, stream: dict) -> None:
+        stream["interval"] = min(
+            stream["interval"] * self.backoff_factor, self.max_interval
+        )
+        stream["next_poll"] = self._clock() + stream["interval"]
+
+    def _run(self) -> None:
+        with self._lock:
+            # A Timer that was replaced or canceled while waiting for the lock is stale.
+            if self._timer is not threading.current_thread():
+                return
+        delay = self.poll()
+        with self._lock:
+            # ...or if that happened while it was polling.
+            if self._timer is not threading.current_thread():
+                return
+            if delay is None:
+                self._timer = None
+                return
+            self._start_timer(delay)
+
+    def _restart_timer(self) -> None:
+        self._cancel_timer()
+        self._start_timer(0)
+
+    def _start_timer(self, delay: float) -> None:
+        self._timer = threading.Timer(delay, self._run)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
@@ -0,0 +1,235 @@
+"""
+Per-job polling schedule for the job status lookup loop.
+
+Rather than looking up every job on a fixed timer, each job gets its own next-poll
+time, which is adjusted after every lookup based on the status that came back.
+"""
+import threading
+import time
+from .jobmanager import TERMINAL_STATES
+
+# Statuses for jobs that haven't started running yet. These get backed off.
+QUEUED_STATES = ["created", "estimating", "queued"]
+
+# All intervals are in seconds.
+DEFAULT_BASE_INTERVAL = 10
+DEFAULT_CHANGED_INTERVAL = 2
+DEFAULT_BACKOFF_FACTOR = 1.5
+DEFAULT_MAX_INTERVAL = 60
+DEFAULT_COALESCE_WINDOW = 1
+
+
+class JobPollScheduler:
+    """
+    Keeps track of when each job should next have its status looked up.
+
+    Rules applied after each lookup:
+    * terminal jobs (completed, terminated, error) are dropped and never polled again
+    * jobs whose status just changed get polled again after changed_interval
+    * queued jobs back off by backoff_factor each time, up to max_interval
+    * running jobs get polled every base_interval
+    * jobs whose lookup failed (no state returned) back off like queued jobs
+
+    Jobs that fall due within coalesce_window seconds of each other are returned
+    together from due_jobs, so they can be looked up with a single check_jobs call.
+
+    This is used from both the lookup loop Timer thread and the comm message handlers,
+    so all access is guarded by a lock.
+    """
+
+    def __init__(
+        self,
+        base_interval: float = DEFAULT_BASE_INTERVAL,
+        changed_interval: float = DEFAULT_CHANGED_INTERVAL,
+        backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        max_interval: float = DEFAULT_MAX_INTERVAL,
+        coalesce_window: float = DEFAULT_COALESCE_WINDOW,
+        clock=time.monotonic,
+    ):
+        self._lock = threading.RLock()
+        self._clock = clock
+        # keys = job_id, values = { next_poll = float, interval = float, status = str }
+        self._schedule = dict()
+        # ids of jobs that have been seen in a terminal state
+        self._finished = set()
+        self.configure(
+            base_interval=base_interval,
+            changed_interval=changed_interval,
+            backoff_factor=backoff_factor,
+            max_interval=max_interval,
+            coalesce_window=coalesce_window,
+        )
+
+    def configure(
+        self,
+        base_interval: float = None,
+        changed_interval: float = None,
+        backoff_factor: float = None,
+        max_interval: float = None,
+        coalesce_window: float = None,
+    ) -> None:
+        """
+        Changes any of the polling parameters. Anything left as None is unchanged.
+        New values apply to each job from its next lookup onward.
+        Raises a ValueError if the combination doesn't make sense.
+        """
+        with self._lock:
+            base_interval = self._current("base_interval", base_interval)
+            changed_interval = self._current("changed_interval", changed_interval)
+            backoff_factor = self._current("backoff_factor", backoff_factor)
+            max_interval = self._current("max_interval", max_interval)
+            coalesce_window = self._current("coalesce_window", coalesce_window)
+            if base_interval <= 0 or changed_interval <= 0:
+                raise ValueError("Poll intervals must be greater than 0")
+            if backoff_factor < 1:
+                raise ValueError("Poll backoff factor must be at least 1")
+            if max_interval < base_interval:
+                raise ValueError(
+                    "Maximum poll interval must be at least the base interval"
+                )
+            if coalesce_window < 0:
+                raise ValueError("Poll coalesce window must not be negative")
+            self.base_interval = base_interval
+            self.changed_interval = changed_interval
+            self.backoff_factor = backoff_factor
+            self.max_interval = max_interval
+            self.coalesce_window = coalesce_window
+
+    def _current(self, name: str, value):
+        return getattr(self, name) if value is None else value
+
+    def add_job(self, job_id: str, status: str = None) -> None:
+        """
+        Adds a job to the schedule, due for lookup right away. If the status is known
+        to be terminal, the job is just remembered as finished and never gets scheduled.
+        Jobs that are already scheduled or finished are left alone.
+        """
+        with self._lock:
+            if job_id in self._schedule or job_id in self._finished:
+                return
+            if status in TERMINAL_STATES:
+                self._finished.add(job_id)
+                return
+            self._schedule[job_id] = {
+                "next_poll": self._clock(),
+                "interval": self.base_interval,
+                "status": status,
+            }
+
+    def remove_job(self, job_id: str) -> None:
+        with self._lock:
+            self._schedule.pop(job_id, None)
+            self._finished.discard(job_id)
+
+    def sync_jobs(self, job_ids: list) -> None:
+        """
+        Makes the schedule match the given list of job ids. Any new job ids are added
+        and due right away, and any known jobs not in the list are dropped.
+        """
+        with self._lock:
+            job_ids = set(job_ids)
+            for job_id in list(self._schedule.keys()):
+                if job_id not in job_ids:
+                    del self._schedule[job_id]
+            self._finished &= job_ids
+            for job_id in job_ids:
+                self.add_job(job_id)
+
+    def poll_now(self, job_id: str) -> None:
+        """
+        Makes a scheduled job due right away, without changing its backoff interval.
+        Does nothing for finished or unknown jobs.
+        """
+        with self._lock:
+            if job_id in self._schedule:
+                self._schedule[job_id]["next_poll"] = self._clock()
+
+    def scheduled_jobs(self) -> list:
+        """
+        Returns a sorted list of the ids of all jobs on the schedule, whether or not
+        they're due yet. This is every known job that hasn't been seen to finish. A job
+        that was already finished when it was added stays on until its first update.
+        """
+        with self._lock:
+            return sorted(self._schedule.keys())
+
+    def due_jobs(self, job_ids: list = None) -> list:
+        """
+        Returns a sorted list of the ids of all jobs that are due for a lookup, including
+        those that fall due within the coalesce window.
+        If job_ids is given, only jobs in that list are considered.
+        """
+        with self._lock:
+            cutoff = self._clock() + self.coalesce_window
+            return sorted(
+                job_id
+                for job_id, entry in self._entries(job_ids)
+                if entry["next_poll"] <= cutoff
+            )
+
+    def _entries(self, job_ids: list = None) -> list:
+        if job_ids is None:
+            return list(self._schedule.items())
+        return [
+            (job_id, self._schedule[job_id])
+            for job_id in set(job_ids)
+            if job_id in self._schedule
+        ]
+
+    def update(self, job_id: str, status: str = None) -> None:
+        """
+        Reschedules a job after its lookup, based on the status that came back.
+        A status of None means that the lookup failed, and the job gets backed off.
+        """
+        with self._lock:
+            if status in TERMINAL_STATES:
+                self._schedule.pop(job_id, None)
+                self._finished.add(job_id)
+                return
+            entry = self._schedule.get(job_id)
+            if entry is None:
+                if job_id in self._finished:
+                    return
+                entry = {"interval": self.base_interval, "status": None}
+                self._schedule[job_id] = entry
+
+            previous = entry["status"]
+            if previous is not None and status is not None and status != previous:
+                interval = min(self.changed_interval, self.base_interval)
+            elif status is None or status in QUEUED_STATES:
+                interval = min(
+                    entry["interval"] * self.backoff_factor, self.max_interval
+                )
+            else:
+                interval = self.base_interval
+            entry["next_poll"] = self._clock() + interval
+            # A state change only shortens the next lookup. After that, lookups go back
+            # to the base interval, and any backoff starts over from there.
+            entry["interval"] = max(interval, self.base_interval)
+            if status is not None:
+                entry["status"] = status
+
+    def seconds_until_next_poll(self, job_ids: list = None):
+        """
+        Returns the number of seconds until the next job falls due (0 if any already are),
+        or None if there's nothing scheduled.
+        If job_ids is given, only jobs in that list are considered.
+        """
+        with self._lock:
+            entries = self._entries(job_ids)
+            if not entries:
+                return None
+            next_poll = min(entry["next_poll"] for _, entry in entries)
+            return max(next_poll - self._clock(), 0)
+
+    def is_finished(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._finished
+
+    def __contains__(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._schedule
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._schedule)
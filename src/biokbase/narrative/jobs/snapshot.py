@@ -0,0 +1,184 @@
+"""
+Local snapshot of the jobs in each workspace.
+
+When a kernel restarts, the JobManager has to rebuild all of its Job objects. Doing that
+from EE2 means fetching the full job_input of every job the workspace has ever run. This
+keeps the job metadata, and the final states of finished jobs, in a local SQLite file
+keyed by workspace id, so that only new or unfinished jobs need the full EE2 lookup.
+"""
+import json
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from .job import Job
+
+# If set, this is the path to the snapshot file the JobManager uses.
+JOB_SNAPSHOT_ENV_VAR = "KB_JOB_SNAPSHOT_PATH"
+
+# Bump this when the table layout changes. Older snapshots just get dropped, since
+# they can always be rebuilt from EE2.
+SNAPSHOT_VERSION = 1
+
+
+class JobSnapshot:
+    """
+    A SQLite store of jobs, with one row per workspace id and job id. Each row has the
+    metadata needed to rebuild the Job object, and the job's final state from EE2 once
+    it's finished (or NULL before then).
+
+    A new connection is made for each call, so this can be used from any thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with self._connect() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != SNAPSHOT_VERSION:
+                conn.execute("DROP TABLE IF EXISTS jobs")
+                conn.execute(f"PRAGMA user_version = {SNAPSHOT_VERSION}")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    ws_id TEXT NOT NULL,
+                    job_id TEXT NOT NULL,
+                    job TEXT NOT NULL,
+                    state TEXT,
+                    PRIMARY KEY (ws_id, job_id)
+                )"""
+            )
+
+    def _connect(self):
+        return _Connection(self.path, self._lock)
+
+    def load(self, ws_id) -> dict:
+        """
+        Returns all the jobs stored for the workspace, as a dict with keys = job_id,
+        values = (Job object, final state dict or None).
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT job_id, job, state FROM jobs WHERE ws_id = ?", (str(ws_id),)
+            ).fetchall()
+        jobs = dict()
+        for job_id, job, state in rows:
+            jobs[job_id] = (
+                job_from_record(json.loads(job)),
+                json.loads(state) if state is not None else None,
+            )
+        return jobs
+
+    def save(self, ws_id, jobs: list) -> None:
+        """
+        Stores jobs for the workspace, replacing any that are already there.
+        jobs - a list of (Job object, final state dict or None) tuples
+        """
+        rows = [
+            (
+                str(ws_id),
+                job.job_id,
+                json.dumps(job_to_record(job)),
+                json.dumps(state) if state is not None else None,
+            )
+            for job, state in jobs
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO jobs (ws_id, job_id, job, state) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def save_state(self, ws_id, job_id: str, state: dict) -> None:
+        """
+        Stores the final state of a job that's already in the snapshot.
+        Does nothing if the job isn't there.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ? WHERE ws_id = ? AND job_id = ?",
+                (json.dumps(state), str(ws_id), job_id),
+            )
+
+    def update_jobs(self, ws_id, jobs: list) -> None:
+        """
+        Stores the metadata of jobs that are already in the snapshot, e.g. once their
+        parameters have been fetched, leaving their states alone. Jobs that aren't there
+        are skipped.
+        jobs - a list of Job objects
+        """
+        rows = [
+            (json.dumps(job_to_record(job)), str(ws_id), job.job_id) for job in jobs
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE jobs SET job = ? WHERE ws_id = ? AND job_id = ?", rows
+            )
+
+    def clear(self, ws_id) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE ws_id = ?", (str(ws_id),))
+
+
+class _Connection:
+    """
+    Context manager that opens a connection, commits on success (or rolls back on
+    error), and always closes it. Writes are serialized with the given lock.
+    """
+
+    def __init__(self, path: str, lock: threading.Lock):
+        self._path = path
+        self._lock = lock
+        self._conn = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            self._conn = sqlite3.connect(self._path)
+        except Exception:
+            self._lock.release()
+            raise
+        return self._conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            with closing(self._conn):
+                if exc_type is None:
+                    self._conn.commit()
+                else:
+                    self._conn.rollback()
+        finally:
+            self._lock.release()
+
+
+def job_to_record(job: Job) -> dict:
+    return {
+        "job_id": job.job_id,
+        "app_id": job.app_id,
+        "app_version": job.app_version,
+        "inputs": job.inputs,
+        "owner": job.owner,
+        "tag": job.tag,
+        "cell_id": job.cell_id,
+        "run_id": job.run_id,
+        "token_id": job.token_id,
+        "meta": job.meta,
+    }
+
+
+def job_from_record(record: dict) -> Job:
+    return Job(
+        record["job_id"],
+        record.get("app_id"),
+        record.get("inputs"),
+        record.get("owner"),
+        tag=record.get("tag", "release"),
+        app_version=record.get("app_version"),
+        cell_id=record.get("cell_id"),
+        run_id=record.get("run_id"),
+        token_id=record.get("token_id"),
+        meta=record.get("meta", {}),
+    )
@@ -0,0 +1,87 @@
+"""
+Local cache of the app and type specs from the Narrative Method Store (NMS).
+
+Loading the specs means fetching every app spec for each release tag, and all the type
+specs, which is several MB of JSON - on every kernel start, before any app can run.
+This keeps them on disk, gzipped, one file per environment and tag, along with the NMS
+spec commit they came from. The SpecManager can start from the cached specs right away,
+and only fetch them again when the NMS reports a different commit.
+"""
+import gzip
+import json
+import os
+import tempfile
+from urllib.parse import quote
+
+# If set, this is the directory the SpecManager keeps its spec cache in.
+SPEC_CACHE_ENV_VAR = "KB_SPEC_CACHE_DIR"
+
+# Bump this when the file layout changes. Older files are just ignored, since they can
+# always be rebuilt from the NMS.
+SPEC_CACHE_VERSION = 1
+
+# The key the type specs are stored under, next to the tags.
+TYPES_KEY = "types"
+
+
+class SpecCache:
+    """
+    A directory of cached specs, with one subdirectory per environment, and one file in
+    it per tag (or TYPES_KEY). Each file is gzipped JSON with keys:
+        format - SPEC_CACHE_VERSION
+        version - the NMS spec commit the specs came from
+        specs - the specs themselves
+
+    Files are written to a temp file first, then moved into place, so a reader (or
+    another kernel) never sees half of one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, env: str, key: str) -> str:
+        return os.path.join(self.path, quote(env, safe=""), key + ".json.gz")
+
+    def load(self, env: str, key: str):
+        """
+        Returns (version, specs) for the environment and tag, or None if nothing's
+        cached for them, or the file can't be read.
+        """
+        try:
+            with gzip.open(self._file(env, key), "rt", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(cached, dict) or cached.get("format") != SPEC_CACHE_VERSION:
+            return None
+        return (cached.get("version"), cached.get("specs"))
+
+    def save(self, env: str, key: str, version: str, specs) -> None:
+        """
+        Stores the specs for the environment and tag, replacing whatever was there.
+        """
+        path = self._file(env, key)
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True)
+        (fd, tmp_path) = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.open(
+                raw, "wt", encoding="utf-8"
+            ) as f:
+                json.dump(
+                    {"format": SPEC_CACHE_VERSION, "version": version, "specs": specs},
+                    f,
+                    separators=(",", ":"),
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def clear(self, env: str) -> None:
+        dirname = os.path.dirname(self._file(env, TYPES_KEY))
+        if not os.path.isdir(dirname):
+            return
+        for name in os.listdir(dirname):
+            os.remove(os.path.join(dirname, name))
@@ -1,48 +1,391 @@
 import biokbase.narrative.clients as clients
-from biokbase.narrative.app_util import app_version_tags, check_tag, app_param
+from biokbase.narrative.app_util import (
+    app_version_tags,
+    check_tag,
+    app_param,
+    MappingPlan,
+    ParamIndex,
+)
+from biokbase.narrative.common import kblogging
+from biokbase.narrative.common.util import kbase_env
+from .speccache import SpecCache, SPEC_CACHE_ENV_VAR, TYPES_KEY
+from .appindex import AppSearchIndex, bare_type
 import json
+import os
+import threading
 from jinja2 import Template
 from IPython.display import HTML
 
+DEFAULT_SEARCH_PAGE_SIZE = 20
+
 
 class SpecManager(object):
+    """
+    Keeps the app specs for each tag, and the type specs, from the NMS.
+
+    Nothing is loaded until it's needed, and then only the tag that's asked for, from
+    the spec cache if there is one, or the NMS otherwise. A reload fetches every tag into
+    new dicts, and a background refresh fetches everything that's been loaded so far.
+    Either one swaps them in when they're all done, so readers only ever see complete
+    specs, and never wait on a reload.
+    """
+
     __instance = None
 
+    # keys = tag, values = dict of app id -> spec, for the tags loaded so far
     app_specs = dict()
-    type_specs = dict()
+    # None until they're first needed
+    type_specs = None
+    # keys = (app_id, tag, version), values = MappingPlan
+    mapping_plans = dict()
+    # keys = (app_id, tag, version), values = ParamIndex
+    param_indexes = dict()
+    # keys = tag, values = (the dict of app specs it was made from, AppSearchIndex)
+    search_indexes = dict()
+    # keys = tag, values = (the dict of app specs and dict of type specs they were
+    # made from, dict of bare workspace type -> Viewer or None)
+    viewer_indexes = dict()
+    # keys = tag or TYPES_KEY, values = the NMS spec commit those specs came from, or
+    # None if it's not known
+    spec_versions = dict()
+
+    _log = kblogging.get_logger(__name__)
+    _spec_cache = None
+    _spec_cache_configured = False
+    # held while loading specs that aren't there yet, or swapping in reloaded ones
+    _load_lock = threading.RLock()
+    _refresh_lock = threading.Lock()
+    # the background reload started by refresh, if there is one
+    _refresh_thread = None
+    # checks cached specs against the NMS, once the first ones get loaded from the cache
+    _version_thread = None
+    # the NMS spec commit, once that check is done
+    _nms_version = None
 
     def __new__(cls):
         if SpecManager.__instance is None:
             SpecManager.__instance = object.__new__(cls)
-            SpecManager.__instance.reload()
         return SpecManager.__instance
 
+    def get_app_specs(self, tag="release"):
+        """
+        Returns the dict of app id -> app spec for the tag, loading them the first time
+        they're needed. This is shared, so it shouldn't be modified.
+        Raises a ValueError for an unknown tag.
+        """
+        check_tag(tag, raise_exception=True)
+        specs = self.app_specs.get(tag)
+        if specs is None:
+            with self._load_lock:
+                specs = self.app_specs.get(tag)
+                if specs is None:
+                    (version, spec_list) = self._load_specs(tag)
+                    specs = _spec_dict(spec_list)
+                    self.app_specs[tag] = specs
+                    self.spec_versions[tag] = version
+        return specs
+
+    def get_type_specs(self):
+        """
+        Returns the dict of type id (or module) -> type spec, loading them the first time
+        they're needed. This is shared, so it shouldn't be modified.
+        """
+        type_specs = self.type_specs
+        if type_specs is None:
+            with self._load_lock:
+                type_specs = self.type_specs
+                if type_specs is None:
+                    (version, type_specs) = self._load_specs(TYPES_KEY)
+                    self.type_specs = type_specs
+                    self.spec_versions[TYPES_KEY] = version
+        return type_specs
+
     def get_spec(self, app_id, tag="release"):
         self.check_app(app_id, tag, raise_exception=True)
-        return self.app_specs[tag][app_id]
+        return self.get_app_specs(tag)[app_id]
+
+    def get_mapping_plan(self, app_id, tag="release"):
+        """
+        Returns the MappingPlan for the app's inputs and outputs, making it the first
+        time it's needed for that app version.
+        """
+        spec = self.get_spec(app_id, tag)
+        key = _spec_key(app_id, tag, spec)
+        plan = self.mapping_plans.get(key)
+        if plan is None:
+            plan = MappingPlan(spec, self.get_param_index(app_id, tag))
+            self.mapping_plans[key] = plan
+        return plan
+
+    def get_param_index(self, app_id, tag="release"):
+        """
+        Returns the ParamIndex of the app's params, making it the first time it's
+        needed for that app version. It's shared, so it shouldn't be modified.
+        """
+        spec = self.get_spec(app_id, tag)
+        key = _spec_key(app_id, tag, spec)
+        index = self.param_indexes.get(key)
+        if index is None:
+            index = ParamIndex(self._make_app_params(spec))
+            self.param_indexes[key] = index
+        return index
+
+    def get_search_index(self, tag="release"):
+        """
+        Returns the AppSearchIndex of the tag's app specs, making it the first time it's
+        needed after they're loaded.
+        """
+        specs = self.get_app_specs(tag)
+        cached = self.search_indexes.get(tag)
+        if cached is None or cached[0] is not specs:
+            cached = (specs, AppSearchIndex(specs.values()))
+            self.search_indexes[tag] = cached
+        return cached[1]
+
+    def search_apps(
+        self,
+        query="",
+        input_type=None,
+        output_type=None,
+        tag="release",
+        page_size=DEFAULT_SEARCH_PAGE_SIZE,
+    ):
+        """
+        Searches the apps with the given tag by the words in their name, id, module,
+        categories, and subtitle. Every word in the query has to match (the start of) a
+        word in one of those. If input_type or output_type are given, only apps that
+        take or make objects of that workspace type are found, and the query can be
+        empty.
+        Returns an AppSearchResults, which is the list of app info, best matches first,
+        and is shown in the notebook a page at a time.
+        """
+        index = self.get_search_index(tag)
+        app_ids = index.search(query, input_type=input_type, output_type=output_type)
+        return AppSearchResults(
+            [index.infos[app_id] for app_id in app_ids],
+            query=query,
+            tag=tag,
+            page_size=page_size,
+        )
+
+    def apps_for_type(self, ws_type, tag="release", output=False):
+        """
+        Returns the sorted list of ids of apps that take objects of the workspace type
+        as input, or make them as output if output is True.
+        """
+        return sorted(self.get_search_index(tag).apps_for_type(ws_type, output=output))
+
+    def get_viewer(self, ws_type, tag="release"):
+        """
+        Returns the Viewer for objects of the workspace type (with or without a
+        version), with the viewer app for the given tag. That's worked out the first
+        time it's needed for the type after the specs are loaded.
+        Returns None if there's no type spec for the type (or its module).
+        """
+        app_specs = self.get_app_specs(tag)
+        type_specs = self.get_type_specs()
+        cached = self.viewer_indexes.get(tag)
+        if cached is None or cached[0] is not app_specs or cached[1] is not type_specs:
+            cached = (app_specs, type_specs, dict())
+            self.viewer_indexes[tag] = cached
+        viewers = cached[2]
+        ws_type = bare_type(ws_type)
+        if ws_type not in viewers:
+            viewers[ws_type] = self._make_viewer(ws_type, tag)
+        return viewers[ws_type]
+
+    def _make_viewer(self, ws_type, tag):
+        type_spec = self.get_type_spec(ws_type, raise_exception=False)
+        if type_spec is None:
+            return None
+        view_method_ids = type_spec.get("view_method_ids")
+        if not view_method_ids:
+            return Viewer(None)
+        app_id = view_method_ids[0]
+        try:
+            plan = self.get_mapping_plan(app_id, tag)
+        except ValueError as e:
+            return Viewer(app_id, error=str(e))
+
+        type_module = ws_type.split(".")[0]
+        object_params = tuple(
+            p["id"]
+            for p in plan.spec_params
+            if p.get("allowed_types") is None
+            or any(t == ws_type or t == type_module for t in p["allowed_types"])
+        )
+        app_spec = self.get_spec(app_id, tag)
+        upa_targets = tuple(
+            mapping["target_property"]
+            for mapping in app_spec.get("behavior", {}).get("output_mapping", [])
+            if mapping.get("input_parameter", "") in object_params
+            and "target_property" in mapping
+        )
+        return Viewer(
+            app_id, plan=plan, object_params=object_params, upa_targets=upa_targets
+        )
 
     def get_type_spec(self, type_id, raise_exception=True, allow_module_match=True):
+        type_specs = self.get_type_specs()
         # if we can't find a full match for a type, try to match just the module
-        if (type_id not in self.type_specs) and allow_module_match:
+        if (type_id not in type_specs) and allow_module_match:
             type_id = type_id.split(".")[0]
-        if (type_id not in self.type_specs) and raise_exception:
+        if (type_id not in type_specs) and raise_exception:
             raise ValueError('Unknown type id "{}"'.format(type_id))
-        return self.type_specs.get(type_id)
+        return type_specs.get(type_id)
 
     def reload(self):
         """
-        Reloads all app specs into memory from the latest update.
+        Reloads the app specs for every tag, and the type specs, from the NMS, and stores
+        them in the spec cache, if there is one. Everything gets fetched before any of it
+        is swapped in, so until then the current specs are still used. This blocks until
+        it's done - see refresh for a background version.
+        """
+        self._reload_specs(app_version_tags + [TYPES_KEY])
+
+    def _reload_loaded(self):
+        """
+        Like reload, but only for the tags loaded so far, and the type specs if they've
+        been loaded.
+        """
+        with self._load_lock:
+            keys = list(self.app_specs.keys())
+            if self.type_specs is not None:
+                keys.append(TYPES_KEY)
+        self._reload_specs(keys)
+
+    def _reload_specs(self, keys):
+        version = self._cache_spec_version()
+        fetched = dict((key, self._fetch_specs(key, version)) for key in keys)
+
+        with self._load_lock:
+            # tags loaded in the meantime came straight from the NMS, so they're kept
+            app_specs = dict(self.app_specs)
+            spec_versions = dict(self.spec_versions)
+            for key, (version, specs) in fetched.items():
+                if key != TYPES_KEY:
+                    app_specs[key] = _spec_dict(specs)
+                spec_versions[key] = version
+            if TYPES_KEY in fetched:
+                self.type_specs = fetched[TYPES_KEY][1]
+            self.app_specs = app_specs
+            self.spec_versions = spec_versions
+            self.mapping_plans = dict()
+            self.param_indexes = dict()
+            self.viewer_indexes = dict()
+
+    def refresh(self):
+        """
+        Starts reloading the specs loaded so far in a background thread, and returns that
+        thread. Until it's done, everything keeps using the current specs. If one is
+        already running, that one is returned instead.
+        """
+        with self._refresh_lock:
+            if self._refresh_thread is None or not self._refresh_thread.is_alive():
+                self._refresh_thread = threading.Thread(
+                    target=self._reload_in_background, daemon=True
+                )
+                self._refresh_thread.start()
+            return self._refresh_thread
+
+    def _reload_in_background(self):
+        try:
+            self._reload_loaded()
+        except Exception as e:
+            kblogging.log_event(self._log, "spec_refresh.error", {"err": str(e)})
+
+    def _load_specs(self, key):
+        """
+        Returns (version, specs) for a tag or TYPES_KEY, from the spec cache if they're
+        there and not known to be out of date, or from the NMS otherwise.
+        """
+        cache = self._get_spec_cache()
+        if cache is not None:
+            cached = cache.load(kbase_env.env, key)
+            if cached is not None and self._nms_version in (None, cached[0]):
+                self._check_spec_version()
+                return cached
+        return self._fetch_specs(key, self._cache_spec_version())
+
+    def _fetch_specs(self, key, version):
+        """
+        Fetches the specs for a tag or TYPES_KEY from the NMS, stores them in the spec
+        cache under the given NMS spec commit, and returns (version, specs).
         """
         client = clients.get("narrative_method_store")
-        for tag in app_version_tags:
-            specs = client.list_methods_spec({"tag": tag})
-            spec_dict = dict()
-            for spec in specs:
-                spec_dict[spec["info"]["id"]] = spec
-            self.app_specs[tag] = spec_dict
+        if key == TYPES_KEY:
+            specs = client.list_categories({"load_types": 1})[3]
+        else:
+            specs = client.list_methods_spec({"tag": key})
+        cache = self._get_spec_cache()
+        if cache is not None:
+            try:
+                cache.save(kbase_env.env, key, version, specs)
+            except (OSError, ValueError) as e:
+                kblogging.log_event(self._log, "spec_cache.error", {"err": str(e)})
+        return (version, specs)
+
+    def _cache_spec_version(self):
+        """
+        Returns the commit of the NMS spec repo to store newly fetched specs under. That's
+        only needed to check cached specs later, so without a spec cache this is None,
+        and the NMS isn't asked.
+        """
+        if self._get_spec_cache() is None:
+            return None
+        return self._get_spec_version(clients.get("narrative_method_store"))
+
+    def _get_spec_version(self, client):
+        """
+        Returns the commit of the NMS spec repo, or None if the NMS doesn't say.
+        """
+        try:
+            return client.status().get("git_spec_commit")
+        except Exception as e:
+            kblogging.log_event(self._log, "spec_version.error", {"err": str(e)})
+            return None
+
+    def _check_spec_version(self):
+        """
+        Starts checking the cached specs against the NMS in the background, the first
+        time it's called.
+        """
+        with self._refresh_lock:
+            if self._version_thread is not None:
+                return
+            self._version_thread = threading.Thread(
+                target=self._refresh_if_changed, daemon=True
+            )
+        self._version_thread.start()
 
-        # And let's load all types from the beginning and cache them
-        self.type_specs = client.list_categories({"load_types": 1})[3]
+    def _refresh_if_changed(self):
+        version = self._get_spec_version(clients.get("narrative_method_store"))
+        self._nms_version = version
+        with self._load_lock:
+            versions = list(self.spec_versions.values())
+        if any(v is None or v != version for v in versions):
+            self._reload_in_background()
+
+    def configure_spec_cache(self, path=None):
+        """
+        Sets the directory used as a local cache of the specs, so they don't all have to
+        be fetched from the NMS when a kernel starts. If path is None or empty, the
+        cache is turned off.
+        By default, this uses the directory in the KB_SPEC_CACHE_DIR environment
+        variable, if it's set.
+        """
+        SpecManager._spec_cache_configured = True
+        SpecManager._spec_cache = SpecCache(path) if path else None
+
+    def _get_spec_cache(self):
+        if not self._spec_cache_configured:
+            path = os.environ.get(SPEC_CACHE_ENV_VAR)
+            try:
+                self.configure_spec_cache(path)
+            except OSError as e:
+                kblogging.log_event(self._log, "spec_cache.error", {"err": str(e)})
+                self.configure_spec_cache(None)
+        return self._spec_cache
 
     def app_description(self, app_id, tag="release"):
         """
@@ -102,7 +445,8 @@ class SpecManager(object):
             Template(tmpl).render(
                 tag=tag,
                 apps=sorted(
-                    list(self.app_specs[tag].values()), key=lambda m: m["info"]["id"]
+                    list(self.get_app_specs(tag).values()),
+                    key=lambda m: m["info"]["id"],
                 ),
             )
         )
@@ -124,7 +468,7 @@ class SpecManager(object):
         """
         self.check_app(app_id, tag, raise_exception=True)
 
-        spec = self.app_specs[tag][app_id]
+        spec = self.get_app_specs(tag)[app_id]
 
         # start with basic info
         usage = {
@@ -149,7 +493,7 @@ class SpecManager(object):
         if not tag_ok:
             return False
 
-        if app_id not in self.app_specs[tag]:
+        if app_id not in self.get_app_specs(tag):
             if raise_exception:
                 raise ValueError(
                     'Unknown app id "{}" tagged as "{}"'.format(app_id, tag)
@@ -171,7 +515,17 @@ class SpecManager(object):
             description = string,
             allowed_values = list (optional),
         }
+
+        For a spec that's been loaded, this comes from its ParamIndex, so the params
+        are only made once for each app version.
         """
+        app_id = spec.get("info", {}).get("id")
+        for tag, app_specs in list(self.app_specs.items()):
+            if app_specs.get(app_id) is spec:
+                return list(self.get_param_index(app_id, tag).params)
+        return self._make_app_params(spec)
+
+    def _make_app_params(self, spec):
         params = list()
         for p in spec["parameters"]:
             p_info = app_param(p)
@@ -194,6 +548,116 @@ class SpecManager(object):
         )
 
 
+def _spec_dict(specs):
+    return dict((spec["info"]["id"], spec) for spec in specs)
+
+
+def _spec_key(app_id, tag, spec):
+    info = spec.get("info", {})
+    return (app_id, tag, info.get("git_commit_hash", info.get("ver")))
+
+
+class Viewer(object):
+    """
+    How objects of one workspace type get shown, made by SpecManager.get_viewer.
+
+    app_id - the id of the viewer app, or None if the type doesn't have one
+    plan - the MappingPlan of the viewer app
+    object_params - the ids of the app params the object gets passed in as
+    upa_targets - the output widget params that get the object's UPA
+    error - if the viewer app can't be found, why not
+    """
+
+    def __init__(self, app_id, plan=None, object_params=(), upa_targets=(), error=None):
+        self.app_id = app_id
+        self.plan = plan
+        self.object_params = object_params
+        self.upa_targets = upa_targets
+        self.error = error
+
+
+class AppSearchResults(list):
+    """
+    The list of app info found by SpecManager.search_apps, best matches first. In the
+    notebook, it's shown as a table of one page of results - use page(n) for the others.
+    """
+
+    def __init__(self, infos, query="", tag="release", page_size=20, page_num=1):
+        super().__init__(infos)
+        if page_size < 1:
+            raise ValueError("Search page size must be at least 1")
+        self.query = query
+        self.tag = tag
+        self.page_size = page_size
+        self.num_pages = max(1, -(-len(infos) // page_size))
+        self.page_num = min(max(1, page_num), self.num_pages)
+
+    def page(self, page_num):
+        """
+        Returns the same results, showing the given page (starting from 1).
+        """
+        return AppSearchResults(
+            self,
+            query=self.query,
+            tag=self.tag,
+            page_size=self.page_size,
+            page_num=page_num,
+        )
+
+    def _page_items(self):
+        start = (self.page_num - 1) * self.page_size
+        return (start, self[start : start + self.page_size])
+
+    def _repr_html_(self):
+        tmpl = """
+        <b>{{total}} {{tag}} app{% if total != 1 %}s{% endif %} found{% if query %} for "{{query}}"{% endif %}</b><br>
+        <table class="table table-striped table-bordered table-condensed">
+        <thead>
+            <tr>
+                <th>Id</th>
+                <th>Name</th>
+                <th>Module</th>
+                <th>Subtitle</th>
+            </tr>
+        </thead>
+        {% for m in apps %}
+            <tr>
+                <td>{{ m.id|e }}</td>
+                <td>{{ m.name|e }}</td>
+                <td>{{ m.module_name|e }}</td>
+                <td>{{ m.subtitle|e }}</td>
+            </tr>
+        {% endfor %}
+        </table>
+        {% if num_pages > 1 %}
+        Page {{page_num}} of {{num_pages}} (showing {{start + 1}}-{{start + apps|length}}) - use .page(n) to see the others
+        {% endif %}
+        """
+        (start, apps) = self._page_items()
+        return Template(tmpl).render(
+            apps=apps,
+            start=start,
+            total=len(self),
+            query=self.query,
+            tag=self.tag,
+            page_num=self.page_num,
+            num_pages=self.num_pages,
+        )
+
+    def __str__(self):
+        (start, apps) = self._page_items()
+        lines = [
+            "{}. {} - {}".format(start + idx, info.get("id"), info.get("name"))
+            for idx, info in enumerate(apps, 1)
+        ]
+        if self.num_pages > 1:
+            lines.append("page {} of {}".format(self.page_num, self.num_pages))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return self.__str__()
+
+
 class AppUsage(object):
     """
     A tiny class for representing app usage in HTML (or as a pretty string)
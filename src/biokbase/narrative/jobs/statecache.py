@@ -0,0 +1,32 @@
+"""
+Bounded cache for the post-processed states of finished jobs.
+
+Finished job states never change, so they're kept around to save on EE2 lookups. But a
+long-lived kernel can see a lot of jobs, so this keeps the most recently used states
+in memory, limited by both the number of entries and their estimated size. States
+that get pushed out can optionally be spilled to a local directory and read back from
+there when they're needed again.
+"""
+from biokbase.narrative.common.lrucache import LRUCache
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+
+class JobStateCache(LRUCache):
+    """
+    An LRU cache of job states, with keys = job_id, values = job state dict.
+    See LRUCache for how entries get evicted and spilled.
+    """
+
+    name = "Job state cache"
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        spill_dir: str = None,
+    ):
+        super().__init__(
+            max_entries=max_entries, max_bytes=max_bytes, spill_dir=spill_dir
+        )
@@ -0,0 +1,185 @@
+"""
+A pool of agent tokens for launching apps.
+
+Every job needs an agent token, and getting one is a (blocking) call to the auth
+service that also makes a new long-lived token. Rather than doing that for every job,
+the pool hands out the same token for the same login token and token name, until it
+gets too old. A replacement gets fetched in the background shortly before that, so
+launching apps doesn't have to wait on auth.
+
+Jobs keep running with the token they were launched with, so tokens that were handed
+out are never revoked here. Only tokens that were fetched and never used get revoked,
+when they're replaced or when the kernel shuts down.
+"""
+import atexit
+import threading
+import time
+import biokbase.auth as auth
+from biokbase.narrative.common import kblogging
+
+# All times are in seconds.
+# How long a token gets handed out for after it was fetched.
+DEFAULT_MAX_AGE = 3600
+# A token only gets handed out if it has at least this long before it expires, so
+# that jobs launched with it have time to run.
+DEFAULT_MIN_LIFETIME = 24 * 3600
+# How long before a token gets too old to start fetching its replacement.
+DEFAULT_REFRESH_AHEAD = 300
+
+
+class AgentTokenPool:
+    """
+    Hands out agent tokens, keyed by login token and token name. Each entry is
+    {"token": the token info from auth.get_agent_token, "fetched": time, "used": bool}.
+
+    This can be used from several threads at once. Each key has its own lock, so only
+    one token gets fetched at a time for it.
+    """
+
+    _log = kblogging.get_logger(__name__)
+
+    def __init__(
+        self,
+        max_age: float = DEFAULT_MAX_AGE,
+        min_lifetime: float = DEFAULT_MIN_LIFETIME,
+        refresh_ahead: float = DEFAULT_REFRESH_AHEAD,
+        clock=time.time,
+    ):
+        self._lock = threading.Lock()
+        self._clock = clock
+        # keys = (login token, token name), values = entry
+        self._current = dict()
+        # same keys, values = entry fetched in the background, not yet handed out
+        self._next = dict()
+        # same keys, values = threading.Lock
+        self._key_locks = dict()
+        # same keys, values = threading.Thread
+        self._refreshing = dict()
+        self.max_age = None
+        self.min_lifetime = None
+        self.refresh_ahead = None
+        self.configure(
+            max_age=max_age, min_lifetime=min_lifetime, refresh_ahead=refresh_ahead
+        )
+
+    def configure(
+        self,
+        max_age: float = None,
+        min_lifetime: float = None,
+        refresh_ahead: float = None,
+    ) -> None:
+        """
+        Changes how long tokens get reused for, how long they need before they expire,
+        and how far ahead replacements get fetched. Anything left as None is unchanged.
+        A max_age of 0 means every launch gets a new token.
+        Raises a ValueError for negative values.
+        """
+        for name, value in [
+            ("max age", max_age),
+            ("min lifetime", min_lifetime),
+            ("refresh ahead", refresh_ahead),
+        ]:
+            if value is not None and value < 0:
+                raise ValueError(
+                    "Agent token pool {} must not be negative".format(name)
+                )
+        with self._lock:
+            if max_age is not None:
+                self.max_age = max_age
+            if min_lifetime is not None:
+                self.min_lifetime = min_lifetime
+            if refresh_ahead is not None:
+                self.refresh_ahead = refresh_ahead
+
+    def get(self, login_token: str, token_name: str) -> dict:
+        """
+        Returns an agent token for the login token, with the given name. This is the
+        same dict as auth.get_agent_token returns.
+        Raises whatever that raises if a new token can't be made.
+        """
+        key = (login_token, token_name)
+        with self._key_lock(key):
+            entry = self._current.get(key)
+            if not self._usable(entry):
+                entry = self._next.pop(key, None)
+                if not self._usable(entry):
+                    self._revoke_unused(key, entry)
+                    entry = self._fetch(key)
+                self._current[key] = entry
+            entry["used"] = True
+            age = self._clock() - entry["fetched"]
+            if self.max_age and age >= self.max_age - self.refresh_ahead:
+                self._start_refresh(key)
+            return entry["token"]
+
+    def _key_lock(self, key: tuple) -> threading.Lock:
+        with self._lock:
+            if key not in self._key_locks:
+                self._key_locks[key] = threading.Lock()
+            return self._key_locks[key]
+
+    def _usable(self, entry: dict) -> bool:
+        if entry is None:
+            return False
+        now = self._clock()
+        if now - entry["fetched"] >= self.max_age:
+            return False
+        expires = entry["token"].get("expires")
+        # expires is in ms since the epoch
+        return expires is None or expires / 1000 - now >= self.min_lifetime
+
+    def _fetch(self, key: tuple) -> dict:
+        token = auth.get_agent_token(key[0], token_name=key[1])
+        return {"token": token, "fetched": self._clock(), "used": False}
+
+    def _start_refresh(self, key: tuple) -> None:
+        with self._lock:
+            if key in self._next or key in self._refreshing:
+                return
+            thread = threading.Thread(target=self._refresh, args=(key,), daemon=True)
+            self._refreshing[key] = thread
+        thread.start()
+
+    def _refresh(self, key: tuple) -> None:
+        try:
+            entry = self._fetch(key)
+            with self._lock:
+                self._next[key] = entry
+        except Exception as e:
+            # the next launch will just fetch one itself
+            kblogging.log_event(self._log, "refresh_error", {"err": str(e)})
+        finally:
+            with self._lock:
+                self._refreshing.pop(key, None)
+
+    def _revoke_unused(self, key: tuple, entry: dict) -> None:
+        if entry is None or entry["used"]:
+            return
+        try:
+            auth.revoke_token(key[0], entry["token"]["id"])
+        except Exception as e:
+            kblogging.log_event(self._log, "revoke_error", {"err": str(e)})
+
+    def shutdown(self) -> None:
+        """
+        Revokes any tokens that were fetched but never handed out, and empties the
+        pool. Tokens that jobs were launched with are left alone.
+        """
+        with self._lock:
+            threads = list(self._refreshing.values())
+        for thread in threads:
+            thread.join()
+        with self._lock:
+            entries = list(self._current.items()) + list(self._next.items())
+            self._current.clear()
+            self._next.clear()
+        for key, entry in entries:
+            self._revoke_unused(key, entry)
+
+
+_agent_token_pool = AgentTokenPool()
+atexit.register(_agent_token_pool.shutdown)
+
+
+def get_agent_token_pool() -> AgentTokenPool:
+    return _agent_token_pool
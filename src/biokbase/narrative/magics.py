@@ -20,6 +20,8 @@ from IPython.core.magic import (
 # KBase
 import biokbase.auth
 
+from biokbase.narrative.app_util import clear_system_variable_cache
+from biokbase.narrative.objectcache import clear_object_cache, invalidate_resolved_refs
 from biokbase.narrative.common.url_config import URLS
 from biokbase.narrative.common.log_common import EVENT_MSG_SEP
 
@@ -62,6 +64,9 @@ def set_token(newtoken):
         user_profile = biokbase.auth.User(token=token)
         user_id = user_profile.user_id
         # If we had a previous session, clear it out
+        clear_system_variable_cache()
+        clear_object_cache()
+        invalidate_resolved_refs()
 
 
 def clear_token():
@@ -72,6 +77,9 @@ def clear_token():
         token = None
         user_profile = None
     biokbase.auth.set_environ_token(None)
+    clear_system_variable_cache()
+    clear_object_cache()
+    invalidate_resolved_refs()
 
 
 # Define the KBase notebook magics
@@ -0,0 +1,421 @@
+"""
+A local cache of Workspace objects that can't change.
+
+An object addressed by a full UPA (ws_id/obj_id/version), or a reference path made only
+of those, always points at the same data. So once its info or data has been fetched,
+it can be read locally the next time a viewer gets rendered or an app gets validated.
+
+Anything else - names, or references without a version - can point at something new at
+any time. The RefResolver remembers what those resolved to for a few seconds, so that
+validating all the parameters of an app (or a batch of apps) doesn't look up the same
+names over and over.
+"""
+
+import re
+import threading
+import time
+import biokbase.narrative.clients as clients
+from biokbase.narrative.common import kblogging
+from biokbase.narrative.common.lrucache import LRUCache
+
+DEFAULT_INFO_MAX_ENTRIES = 10000
+DEFAULT_INFO_MAX_BYTES = 20 * 1024 * 1024
+DEFAULT_DATA_MAX_ENTRIES = 1000
+DEFAULT_DATA_MAX_BYTES = 500 * 1024 * 1024
+# Object info includes the object and workspace names, and those can change if either
+# gets renamed. So cached info only gets used for this many seconds.
+DEFAULT_INFO_MAX_AGE = 300
+# How long (in seconds) the RefResolver trusts what a name or mutable reference resolved to.
+DEFAULT_RESOLVE_TTL = 30
+# When the RefResolver has more entries than this, it drops the expired ones.
+RESOLVE_PURGE_SIZE = 10000
+
+_immutable_ref_regex = re.compile(r"^\d+(\/\d+){2}(;\d+(\/\d+){2})*$")
+
+
+def is_immutable_ref(ref) -> bool:
+    """
+    Returns True if the reference always points at the same object, i.e. if it's a
+    full UPA or a path of them.
+    """
+    return isinstance(ref, str) and _immutable_ref_regex.match(ref) is not None
+
+
+def _info_upa(info: list) -> str:
+    return "{}/{}/{}".format(info[6], info[0], info[4])
+
+
+def _object_size(info, default):
+    # the Workspace reports the size of each object's data in its info
+    if info is not None and len(info) > 9 and isinstance(info[9], int):
+        return info[9]
+    return default
+
+
+class ObjectInfoCache(LRUCache):
+    name = "Object info cache"
+
+
+class ObjectDataCache(LRUCache):
+    name = "Object data cache"
+
+
+class ObjectCache:
+    """
+    Caches Workspace object info and object data, in two separate LRU tiers, keyed by
+    immutable reference. Each tier can spill what it evicts into a subdirectory of the
+    spill directory.
+
+    Values that come out of the cache are shared, so they shouldn't be modified.
+    """
+
+    def __init__(
+        self,
+        info_max_entries: int = DEFAULT_INFO_MAX_ENTRIES,
+        info_max_bytes: int = DEFAULT_INFO_MAX_BYTES,
+        data_max_entries: int = DEFAULT_DATA_MAX_ENTRIES,
+        data_max_bytes: int = DEFAULT_DATA_MAX_BYTES,
+        info_max_age: float = DEFAULT_INFO_MAX_AGE,
+        spill_dir: str = None,
+        clock=time.time,
+    ):
+        self._info = ObjectInfoCache(
+            max_entries=info_max_entries, max_bytes=info_max_bytes
+        )
+        self._data = ObjectDataCache(
+            max_entries=data_max_entries, max_bytes=data_max_bytes
+        )
+        self.info_max_age = info_max_age
+        self._clock = clock
+        self.configure(spill_dir=spill_dir)
+
+    def configure(
+        self,
+        info_max_entries: int = None,
+        info_max_bytes: int = None,
+        data_max_entries: int = None,
+        data_max_bytes: int = None,
+        info_max_age: float = None,
+        spill_dir: str = None,
+    ) -> None:
+        """
+        Changes the limits of either tier, how long object info stays fresh, or the
+        spill directory. Anything left as None is unchanged. To stop spilling to disk,
+        set spill_dir to an empty string.
+        Raises a ValueError for bad limits.
+        """
+        if info_max_age is not None and info_max_age < 0:
+            raise ValueError("Object info max age must not be negative")
+        info_spill_dir = data_spill_dir = spill_dir
+        if spill_dir:
+            info_spill_dir = spill_dir.rstrip("/") + "/info"
+            data_spill_dir = spill_dir.rstrip("/") + "/data"
+        self._info.configure(
+            max_entries=info_max_entries,
+            max_bytes=info_max_bytes,
+            spill_dir=info_spill_dir,
+        )
+        self._data.configure(
+            max_entries=data_max_entries,
+            max_bytes=data_max_bytes,
+            spill_dir=data_spill_dir,
+        )
+        if info_max_age is not None:
+            self.info_max_age = info_max_age
+
+    def get_object_info(self, refs: list, include_metadata: bool = False) -> list:
+        """
+        Returns the object info for each reference, in the same order, like the
+        Workspace's get_object_info_new. Anything not cached gets looked up in a single
+        Workspace call.
+        """
+        infos = [self.cached_object_info(ref, include_metadata) for ref in refs]
+        missing = [idx for idx, info in enumerate(infos) if info is None]
+        if not missing:
+            return infos
+
+        fetched = clients.get("workspace").get_object_info_new(
+            {
+                "objects": [{"ref": refs[idx]} for idx in missing],
+                "includeMetadata": 1 if include_metadata else 0,
+            }
+        )
+        for idx, info in zip(missing, fetched):
+            infos[idx] = info
+            self.add_object_info(refs[idx], info, include_metadata)
+        return infos
+
+    def cached_object_info(self, ref: str, include_metadata: bool = False):
+        """
+        Returns the cached info for the reference, or None if it's not cached (or
+        can't be).
+        """
+        if not is_immutable_ref(ref):
+            return None
+        entry = self._info.get(self._info_key(ref, include_metadata))
+        if entry is None or self._clock() - entry["time"] > self.info_max_age:
+            return None
+        return entry["info"]
+
+    def add_object_info(self, ref: str, info: list, include_metadata: bool = False):
+        """
+        Caches object info that was looked up some other way.
+        """
+        entry = {"time": self._clock(), "info": info}
+        for key in self._cache_keys(ref, info):
+            self._info.put(self._info_key(key, include_metadata), entry)
+
+    @staticmethod
+    def _info_key(ref: str, include_metadata: bool) -> str:
+        return "meta:" + ref if include_metadata else ref
+
+    def get_objects(self, refs: list) -> list:
+        """
+        Returns the object data for each reference, in the same order. Each item is
+        what the Workspace's get_objects2 returns for that object, with the object under
+        the "data" key. Anything not cached gets fetched in a single Workspace call.
+        """
+        objects = [None] * len(refs)
+        missing = list()
+        for idx, ref in enumerate(refs):
+            if is_immutable_ref(ref):
+                objects[idx] = self._data.get(ref)
+            if objects[idx] is None:
+                missing.append(idx)
+        if not missing:
+            return objects
+
+        ws = clients.get("workspace")
+        fetched = ws.get_objects2({"objects": [{"ref": refs[idx]} for idx in missing]})[
+            "data"
+        ]
+        # the response already got counted, so there's no need to serialize the objects
+        # again to size them
+        stats = clients.get_call_stats(ws)
+        share = stats["response_bytes"] // len(fetched) if stats and fetched else None
+        for idx, obj in zip(missing, fetched):
+            objects[idx] = obj
+            size = _object_size(obj.get("info"), share)
+            for key in self._cache_keys(refs[idx], obj.get("info")):
+                self._data.put(key, obj, size=size)
+        return objects
+
+    @staticmethod
+    def _cache_keys(ref: str, info) -> list:
+        """
+        Returns the keys to cache a looked up object under. A plain name or unversioned
+        reference still resolves to a full UPA, so the object is cached under that.
+        """
+        keys = list()
+        if is_immutable_ref(ref):
+            keys.append(ref)
+        if info is not None and ";" not in ref:
+            upa = _info_upa(info)
+            if upa not in keys:
+                keys.append(upa)
+        return keys
+
+    def clear(self) -> None:
+        """
+        Empties both tiers, in memory and on disk.
+        """
+        self._info.clear()
+        self._data.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns the stats for each tier, as a dict with keys info and data. See
+        LRUCache.stats.
+        """
+        return {"info": self._info.stats(), "data": self._data.stats()}
+
+
+class RefResolver:
+    """
+    Resolves object names and references to object info, like the Workspace's
+    get_object_info_new.
+
+    Full UPAs get their info from the ObjectCache. Names (keyed by workspace and name)
+    and other references get remembered for ttl seconds. Lookups that fail aren't
+    remembered, so they fail again (with the Workspace's error) the next time.
+
+    Anything that saves objects from the kernel should call invalidate(), since a name
+    might point at a new object afterward.
+    """
+
+    _log = kblogging.get_logger(__name__)
+
+    def __init__(
+        self,
+        object_cache: ObjectCache,
+        ttl: float = DEFAULT_RESOLVE_TTL,
+        clock=time.time,
+    ):
+        self._object_cache = object_cache
+        self._clock = clock
+        self._lock = threading.Lock()
+        # keys = (workspace, name) or (None, ref), values = (time, info)
+        self._entries = dict()
+        self.ttl = None
+        self.configure(ttl=ttl)
+
+    def configure(self, ttl: float = None) -> None:
+        """
+        Changes how long resolved names are trusted, in seconds. 0 turns that off.
+        Raises a ValueError for a negative ttl.
+        """
+        if ttl is not None:
+            if ttl < 0:
+                raise ValueError("Ref resolver TTL must not be negative")
+            self.ttl = ttl
+
+    @staticmethod
+    def _key(workspace: str, value: str) -> tuple:
+        # references don't depend on the current workspace
+        return (None, value) if "/" in value else (workspace, value)
+
+    @staticmethod
+    def _object_ident(workspace: str, value: str) -> dict:
+        if "/" in value:
+            return {"ref": value}
+        return {"workspace": workspace, "name": value}
+
+    def _cached(self, workspace: str, value: str):
+        if is_immutable_ref(value):
+            return self._object_cache.cached_object_info(value)
+        with self._lock:
+            entry = self._entries.get(self._key(workspace, value))
+        if entry is None or self._clock() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def _add(self, workspace: str, value: str, info: list) -> None:
+        if is_immutable_ref(value):
+            self._object_cache.add_object_info(value, info)
+            return
+        if not self.ttl:
+            return
+        now = self._clock()
+        with self._lock:
+            self._entries[self._key(workspace, value)] = (now, info)
+            if len(self._entries) > RESOLVE_PURGE_SIZE:
+                self._entries = {
+                    key: entry
+                    for key, entry in self._entries.items()
+                    if now - entry[0] <= self.ttl
+                }
+
+    def resolve(self, workspace: str, value: str) -> list:
+        """
+        Returns the object info for the name (in the given workspace) or reference.
+        Raises whatever the Workspace raises if it can't be found.
+        """
+        info = self._cached(workspace, value)
+        if info is not None:
+            return info
+        info = clients.get("workspace").get_object_info_new(
+            {"objects": [self._object_ident(workspace, value)]}
+        )[0]
+        self._add(workspace, value, info)
+        return info
+
+    def resolve_all(self, workspace: str, values: list) -> None:
+        """
+        Looks up all the names and references that aren't already known, in a single
+        get_object_info3 call, so that resolving them after this is a local read.
+        Anything that can't be found is skipped here - it only raises an error once
+        it's resolved.
+
+        If the Workspace rejects the whole call (e.g. one of them is a malformed
+        reference), they get looked up one per call instead, in a single client batch.
+        """
+        unknown = list()
+        for value in values:
+            if (
+                isinstance(value, str)
+                and value
+                and value not in unknown
+                and self._cached(workspace, value) is None
+            ):
+                unknown.append(value)
+        if not unknown:
+            return
+        ws = clients.get("workspace")
+        try:
+            result = ws.get_object_info3(
+                {
+                    "objects": [self._object_ident(workspace, v) for v in unknown],
+                    "ignoreErrors": 1,
+                }
+            )
+        except Exception as e:
+            kblogging.log_event(self._log, "resolve_all.error", {"err": str(e)})
+            self._resolve_each(ws, workspace, unknown)
+            return
+        for value, info in zip(unknown, result["infos"]):
+            if info is not None:
+                self._add(workspace, value, info)
+
+    def _resolve_each(self, ws, workspace: str, values: list) -> None:
+        """
+        Looks up each of the values with its own get_object_info_new call, all run
+        concurrently in one batch. The ones that fail are skipped.
+        """
+        with clients.batch(ws) as batch:
+            futures = [
+                batch.get_object_info_new(
+                    {"objects": [self._object_ident(workspace, v)]}
+                )
+                for v in values
+            ]
+        for value, future in zip(values, futures):
+            if future.exception() is None:
+                self._add(workspace, value, future.result()[0])
+
+    def invalidate(self) -> None:
+        """
+        Forgets everything that names and mutable references resolved to.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+_object_cache = ObjectCache()
+_ref_resolver = RefResolver(_object_cache)
+
+
+def get_object_cache() -> ObjectCache:
+    return _object_cache
+
+
+def get_ref_resolver() -> RefResolver:
+    return _ref_resolver
+
+
+def resolve_object_info(workspace: str, value: str) -> list:
+    return _ref_resolver.resolve(workspace, value)
+
+
+def resolve_all_object_info(workspace: str, values: list) -> None:
+    _ref_resolver.resolve_all(workspace, values)
+
+
+def invalidate_resolved_refs() -> None:
+    _ref_resolver.invalidate()
+
+
+def clear_object_cache() -> None:
+    """
+    Empties the shared object cache, including anything it spilled to disk. Cached
+    objects were fetched with the current token, so this needs to happen whenever that
+    changes.
+    """
+    _object_cache.clear()
+
+
+def get_object_info(refs: list, include_metadata: bool = False) -> list:
+    return _object_cache.get_object_info(refs, include_metadata=include_metadata)
+
+
+def get_objects(refs: list) -> list:
+    return _object_cache.get_objects(refs)
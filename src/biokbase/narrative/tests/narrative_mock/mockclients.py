@@ -2,6 +2,22 @@ from ..util import TestConfig
 from biokbase.workspace.baseclient import ServerError
 
 
+def _exclude_fields(info, fields):
+    """
+    Returns a copy of the job info without the given fields. Like EE2, fields of
+    job_input (or any other nested dict) can be left out with a dotted path.
+    """
+    info = dict(info)
+    for f in fields:
+        (top, _, sub) = f.partition(".")
+        if not sub:
+            info.pop(top, None)
+        elif isinstance(info.get(top), dict):
+            info[top] = dict(info[top])
+            info[top].pop(sub, None)
+    return info
+
+
 class MockClients:
     """
     Mock KBase service clients as needed for Narrative backend tests.
@@ -52,10 +68,16 @@ class MockClients:
         return "bar"
 
     def check_workspace_jobs(self, params):
-        return self.ee2_job_info
+        return dict(
+            (job_id, _exclude_fields(info, params.get("exclude_fields", [])))
+            for job_id, info in self.ee2_job_info.items()
+        )
 
     # ----- Narrative Method Store functions ------
 
+    def status(self):
+        return {"git_spec_commit": "mock_spec_commit"}
+
     def list_methods_spec(self, params):
         return self.config.load_json_file(self.config.get("specs", "app_specs_file"))
 
@@ -197,24 +219,9 @@ class MockClients:
         # return ret_val
 
     def get_object_info3(self, params):
-        infos = [
-            [
-                5,
-                "Sbicolor2",
-                "KBaseGenomes.Genome-12.3",
-                "2017-03-31T23:42:59+0000",
-                1,
-                "wjriehl",
-                18836,
-                "wjriehl:1490995018528",
-                "278abf8f0dbf8ab5ce349598a8674a6e",
-                109180038,
-                None,
-            ]
-        ]
-        paths = [["18836/5/1"]]
-        num_objects = len(params.get("objects", [0]))
-        return {"infos": infos * num_objects, "paths": paths * num_objects}
+        infos = self.get_object_info_new(params)
+        paths = [["{}/{}/{}".format(info[6], info[0], info[4])] for info in infos]
+        return {"infos": infos, "paths": paths}
 
     # ----- Narrative Job Service functions -----
 
@@ -227,19 +234,15 @@ class MockClients:
     def check_job_canceled(self, params):
         return {"finished": 0, "canceled": 0, "job_id": params.get("job_id")}
 
-    def get_job_params(self, job_id):
-        return self.ee2_job_info.get(job_id, {}).get("job_input", {})
+    def get_job_params(self, params):
+        return self.ee2_job_info.get(params["job_id"], {}).get("job_input", {})
 
     def check_job(self, params):
         job_id = params.get("job_id")
         if not job_id:
             return {}
         info = self.ee2_job_info.get(job_id, {})
-        if "exclude_fields" in params:
-            for f in params["exclude_fields"]:
-                if f in info:
-                    del info[f]
-        return info
+        return _exclude_fields(info, params.get("exclude_fields", []))
 
     def check_jobs(self, params):
         job_ids = params.get("job_ids")
@@ -252,8 +255,9 @@ class MockClients:
 
     def get_job_logs(self, params):
         """
-        params: job_id, skip_lines
-        skip_lines = number of lines to skip, get all the rest
+        params: job_id, skip_lines, offset, limit
+        skip_lines = number of lines to skip, get all the rest (legacy version of offset)
+        limit = max number of lines to return (optional)
 
         single line: {
             is_error 0,1
@@ -262,14 +266,18 @@ class MockClients:
         there are only 100 "log lines" in total.
         """
         total_lines = 100
-        skip = params.get("skip_lines", 0)
+        skip = params.get("offset", params.get("skip_lines", 0))
+        last_line = total_lines
+        if params.get("limit") is not None:
+            last_line = min(total_lines, skip + params["limit"])
         lines = list()
-        if skip < total_lines:
-            for i in range(total_lines - skip):
-                lines.append(
-                    {"is_error": 0, "line": "This is line {}".format(i + skip)}
-                )
-        return {"last_line_number": max(total_lines, skip), "lines": lines}
+        for i in range(skip, last_line):
+            lines.append({"is_error": 0, "line": "This is line {}".format(i)})
+        return {
+            "last_line_number": total_lines,
+            "lines": lines,
+            "count": len(lines),
+        }
 
     # ----- Service Wizard functions -----
     def sync_call(self, call, params):
@@ -461,6 +469,9 @@ class FailingMockClient:
     def check_workspace_jobs(self, params):
         raise ServerError("JSONRPCError", -32000, "Job lookup failed.")
 
+    def check_jobs(self, params):
+        raise ServerError("JSONRPCError", -32000, "Job lookup failed.")
+
     def cancel_job(self, params):
         raise ServerError("JSONRPCError", -32000, "Can't cancel job")
 
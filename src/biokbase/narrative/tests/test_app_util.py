@@ -6,10 +6,18 @@ import biokbase.auth
 from biokbase.narrative.app_util import (
     check_tag,
     system_variable,
+    clear_system_variable_cache,
     get_result_sub_path,
     map_inputs_from_job,
     map_outputs_from_state,
+    MappingPlan,
+    ParamIndex,
+    param_index,
+    compile_input_mapping,
+    resolve_ref,
+    resolve_param_refs,
 )
+from biokbase.narrative import objectcache
 from .narrative_mock.mockclients import get_mock_client
 import os
 import mock
@@ -75,11 +83,91 @@ class AppUtilTestCase(unittest.TestCase):
         os.environ["KB_WORKSPACE_ID"] = self.workspace
         self.assertEqual(system_variable("workspace_id"), 12345)
 
+    @mock.patch.dict(os.environ)
+    def test_sys_var_workspace_id_memoized(self):
+        clear_system_variable_cache()
+        self.addCleanup(clear_system_variable_cache)
+        ws_client = mock.MagicMock()
+        ws_client.get_workspace_info.side_effect = lambda p: [
+            {"ws_a": 1, "ws_b": 2}[p["workspace"]]
+        ]
+        with mock.patch(
+            "biokbase.narrative.app_util.clients.get", return_value=ws_client
+        ):
+            os.environ["KB_WORKSPACE_ID"] = "ws_a"
+            self.assertEqual(system_variable("workspace_id"), 1)
+            self.assertEqual(system_variable("workspace_id"), 1)
+            self.assertEqual(ws_client.get_workspace_info.call_count, 1)
+            # a new workspace gets looked up again
+            os.environ["KB_WORKSPACE_ID"] = "ws_b"
+            self.assertEqual(system_variable("workspace_id"), 2)
+            self.assertEqual(ws_client.get_workspace_info.call_count, 2)
+            clear_system_variable_cache()
+            self.assertEqual(system_variable("workspace_id"), 2)
+            self.assertEqual(ws_client.get_workspace_info.call_count, 3)
+
+    @mock.patch.dict(os.environ)
+    @mock.patch("biokbase.narrative.app_util.biokbase.auth.get_user_info")
+    def test_sys_var_user_memoized(self, get_user_info):
+        clear_system_variable_cache()
+        self.addCleanup(clear_system_variable_cache)
+        get_user_info.side_effect = lambda token: {"user": token + "_user"}
+        biokbase.auth.set_environ_token("token_a")
+        self.assertEqual(system_variable("user_id"), "token_a_user")
+        self.assertEqual(system_variable("user_id"), "token_a_user")
+        self.assertEqual(get_user_info.call_count, 1)
+        # logging in as someone else means a new lookup
+        biokbase.auth.set_environ_token("token_b")
+        self.assertEqual(system_variable("user_id"), "token_b_user")
+        self.assertEqual(get_user_info.call_count, 2)
+        # failures aren't remembered
+        get_user_info.side_effect = Exception("auth is down")
+        biokbase.auth.set_environ_token("token_c")
+        self.assertIsNone(system_variable("user_id"))
+        self.assertIsNone(system_variable("user_id"))
+        self.assertEqual(get_user_info.call_count, 4)
+
     @mock.patch("biokbase.narrative.app_util.clients.get", get_mock_client)
     def test_sys_var_workspace_id_except(self):
         os.environ["KB_WORKSPACE_ID"] = "invalid_workspace"
         self.assertIsNone(system_variable("workspace_id"))
 
+    @mock.patch("biokbase.narrative.app_util.clients.get", get_mock_client)
+    def test_resolve_ref_list(self):
+        refs = resolve_ref(
+            "some_workspace",
+            ["rhodobacterium.art.q20.int.PE.reads", "Sbicolor2", "1/2/3;4/5/6"],
+        )
+        self.assertEqual(refs, ["12345/7/1", "18836/5/1", "1/2/3;18836/5/1"])
+        self.assertEqual(resolve_ref("some_workspace", "Sbicolor2"), "18836/5/1")
+
+    @mock.patch("biokbase.narrative.app_util.clients.get", get_mock_client)
+    def test_resolve_ref_list_bad(self):
+        with self.assertRaises(ValueError) as e:
+            resolve_ref("some_workspace", ["Sbicolor2", "1/2/3/4"])
+        self.assertIn("has too many slashes", str(e.exception))
+
+    @mock.patch("biokbase.narrative.app_util.clients.get", get_mock_client)
+    def test_resolve_param_refs(self):
+        objectcache.invalidate_resolved_refs()
+        spec_params = [
+            {"id": "reads", "allowed_types": ["KBaseFile.PairedEndLibrary"]},
+            {"id": "output", "allowed_types": ["KBaseGenomes.Genome"], "is_output": 1},
+            {"id": "count", "allowed_types": []},
+        ]
+        param_sets = [
+            {"reads": "rhodobacterium.art.q20.int.PE.reads", "output": "out1"},
+            {"reads": ["rhodobacterium.art.q10.PE.reads"], "count": 5},
+        ]
+        with mock.patch.object(
+            objectcache.get_ref_resolver(), "resolve_all"
+        ) as resolve_all:
+            resolve_param_refs(spec_params, param_sets, "some_workspace")
+        resolve_all.assert_called_once_with(
+            "some_workspace",
+            ["rhodobacterium.art.q20.int.PE.reads", "rhodobacterium.art.q10.PE.reads"],
+        )
+
     def test_sys_var_user_bad(self):
         biokbase.auth.set_environ_token(self.bad_fake_token)
         self.assertIsNone(system_variable("user_id"))
@@ -235,6 +323,133 @@ class AppUtilTestCase(unittest.TestCase):
         with self.assertRaises(ValueError):
             map_outputs_from_state(state, params, app_spec)
 
+    def test_mapping_plan(self):
+        app_spec = {
+            "parameters": [
+                {
+                    "id": "an_input",
+                    "field_type": "text",
+                    "short_hint": "an input",
+                    "description": "an input",
+                    "optional": 0,
+                    "allow_multiple": 0,
+                    "default_values": [""],
+                    "text_options": {"valid_ws_types": []},
+                }
+            ],
+            "behavior": {
+                "kb_service_input_mapping": [
+                    {"target_position": 0, "input_parameter": "an_input"}
+                ],
+                "kb_service_output_mapping": [
+                    {"input_parameter": "an_input", "target_property": "obj"},
+                    {
+                        "service_method_output_path": ["0", "report_ref"],
+                        "target_property": "report",
+                    },
+                ],
+            },
+            "widgets": {"input": "null", "output": "testOutputWidget"},
+        }
+        plan = MappingPlan(app_spec)
+        self.assertEqual([p["id"] for p in plan.spec_params], ["an_input"])
+        self.assertIn("an_input", plan.spec_params_map)
+        # the same plan works for any number of jobs
+        for i in range(3):
+            state = {"job_output": {"result": [{"report_ref": "1/2/{}".format(i)}]}}
+            params = plan.unmap_inputs(["obj{}".format(i)])
+            self.assertEqual(params, {"an_input": "obj{}".format(i)})
+            self.assertEqual(
+                plan.map_outputs(state, params),
+                map_outputs_from_state(state, params, app_spec),
+            )
+            self.assertEqual(
+                plan.map_outputs(state, params)[1],
+                {"obj": "obj{}".format(i), "report": "1/2/{}".format(i)},
+            )
+        self.assertIs(plan.map_input_steps(), plan.map_input_steps())
+
+        # missing output paths map to None, like get_result_sub_path
+        self.assertEqual(
+            plan.map_outputs({"job_output": {"result": []}}, {})[1],
+            {"obj": None, "report": None},
+        )
+
+    def test_mapping_plan_viewer(self):
+        plan = MappingPlan({"parameters": [], "behavior": {"output_mapping": []}})
+        self.assertEqual(plan.map_input_steps(), [])
+        with self.assertRaises(KeyError):
+            plan.unmap_inputs([])
+        with self.assertRaisesRegex(ValueError, "unable to map outputs"):
+            MappingPlan({"parameters": []}).map_outputs(None, None)
+
+    def test_param_index(self):
+        spec_params = [
+            {"id": "reads", "allowed_types": ["KBaseFile.PairedEndLibrary"]},
+            {"id": "group", "type": "group", "parameter_ids": ["a", "b"]},
+            {"id": "a"},
+            {"id": "b"},
+            {"id": "output", "allowed_types": ["KBaseGenomes.Genome"], "is_output": 1},
+        ]
+        index = ParamIndex(spec_params)
+        self.assertEqual(list(index), spec_params)
+        self.assertEqual(len(index), 5)
+        self.assertIn("reads", index)
+        self.assertNotIn("nope", index)
+        self.assertIs(index.by_id["a"], spec_params[2])
+        self.assertEqual(dict(index.grouped), {"a": "group", "b": "group"})
+        self.assertEqual(index.output_params, (spec_params[4],))
+        self.assertEqual(index.object_params, (spec_params[0],))
+        with self.assertRaises(TypeError):
+            index.by_id["c"] = {"id": "c"}
+        self.assertIs(param_index(index), index)
+        self.assertEqual(param_index(spec_params).params, index.params)
+
+    def test_compile_input_mapping(self):
+        spec_params = {
+            "an_input": {"id": "an_input", "type": "string"},
+            "a_group": {"id": "a_group", "type": "group"},
+        }
+        steps = compile_input_mapping(
+            [
+                {
+                    "input_parameter": "an_input",
+                    "target_argument_position": 1,
+                    "target_property": "nested/path\\/with\\\\slashes",
+                    "target_type_transform": "ref",
+                },
+                {"input_parameter": "a_group"},
+                {"narrative_system_variable": "workspace", "target_property": "ws"},
+            ],
+            spec_params,
+        )
+        self.assertEqual(steps[0]["position"], 1)
+        self.assertEqual(steps[0]["target_path"], ["nested", "path/with\\slashes"])
+        self.assertEqual(steps[0]["transform"], "ref")
+        self.assertIs(steps[0]["spec_param"], spec_params["an_input"])
+        self.assertFalse(steps[0]["is_group"])
+        self.assertTrue(steps[1]["is_group"])
+        self.assertIsNone(steps[1]["target_path"])
+        self.assertEqual(steps[1]["position"], 0)
+        self.assertEqual(steps[2]["system_variable"], "workspace")
+        self.assertEqual(steps[2]["target_path"], ["ws"])
+        with self.assertRaises(KeyError):
+            compile_input_mapping([{"input_parameter": "not_a_param"}], spec_params)
+
+    def test_compile_input_mapping_empty_keys(self):
+        spec_params = {"an_input": {"id": "an_input", "type": "string"}}
+        paths = {
+            "/a//b": ["a", "b"],
+            "a/": ["a", ""],
+            "//": [""],
+        }
+        for target_prop, path in paths.items():
+            steps = compile_input_mapping(
+                [{"input_parameter": "an_input", "target_property": target_prop}],
+                spec_params,
+            )
+            self.assertEqual(steps[0]["target_path"], path)
+
 
 if __name__ == "__main__":
     unittest.main()
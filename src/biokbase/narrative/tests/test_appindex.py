@@ -0,0 +1,118 @@
+import unittest
+from biokbase.narrative.jobs.appindex import AppSearchIndex, bare_type
+
+
+def make_spec(app_id, name, subtitle="", categories=None, inputs=None, outputs=None):
+    params = [
+        {"id": "in_" + t, "text_options": {"valid_ws_types": [t], "is_output_name": 0}}
+        for t in inputs or []
+    ]
+    params += [
+        {"id": "out_" + t, "text_options": {"valid_ws_types": [t], "is_output_name": 1}}
+        for t in outputs or []
+    ]
+    params.append({"id": "some_number", "text_options": {"validate_as": "int"}})
+    return {
+        "info": {
+            "id": app_id,
+            "name": name,
+            "module_name": app_id.split("/")[0],
+            "subtitle": subtitle,
+            "categories": categories or ["active"],
+        },
+        "parameters": params,
+    }
+
+
+SPECS = [
+    make_spec(
+        "kb_SPAdes/run_SPAdes",
+        "Assemble Reads with SPAdes",
+        subtitle="Assemble bacterial genomes from reads",
+        categories=["active", "assembly"],
+        inputs=["KBaseFile.PairedEndLibrary"],
+        outputs=["KBaseGenomeAnnotations.Assembly"],
+    ),
+    make_spec(
+        "MEGAHIT/run_megahit",
+        "Assemble Reads with MEGAHIT",
+        categories=["active", "assembly"],
+        inputs=["KBaseFile.PairedEndLibrary", "KBaseFile.SingleEndLibrary"],
+        outputs=["KBaseGenomeAnnotations.Assembly"],
+    ),
+    make_spec(
+        "RAST_SDK/annotate_genome",
+        "Annotate Microbial Genome",
+        subtitle="Uses RAST to annotate a genome",
+        categories=["active", "annotation"],
+        inputs=["KBaseGenomes.Genome"],
+        outputs=["KBaseGenomes.Genome"],
+    ),
+    {"parameters": []},
+]
+
+
+class AppSearchIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = AppSearchIndex(SPECS)
+
+    def test_bare_type(self):
+        self.assertEqual(bare_type("KBaseGenomes.Genome-14.2"), "KBaseGenomes.Genome")
+        self.assertEqual(bare_type("KBaseGenomes.Genome"), "KBaseGenomes.Genome")
+
+    def test_search(self):
+        self.assertEqual(
+            self.index.search("assemble"),
+            ["kb_SPAdes/run_SPAdes", "MEGAHIT/run_megahit"],
+        )
+        # the name counts more than the subtitle
+        self.assertEqual(
+            self.index.search("genome"),
+            ["RAST_SDK/annotate_genome", "kb_SPAdes/run_SPAdes"],
+        )
+        # every word has to match, case doesn't matter, and words can be partial
+        self.assertEqual(self.index.search("Assem MEGA"), ["MEGAHIT/run_megahit"])
+        self.assertEqual(self.index.search("megahit"), ["MEGAHIT/run_megahit"])
+        self.assertEqual(self.index.search("spades"), ["kb_SPAdes/run_SPAdes"])
+        self.assertEqual(self.index.search("rast_sdk"), ["RAST_SDK/annotate_genome"])
+        self.assertEqual(self.index.search("annotation"), ["RAST_SDK/annotate_genome"])
+        self.assertEqual(self.index.search("assemble nothing"), [])
+        self.assertEqual(self.index.search(""), [])
+
+    def test_search_types(self):
+        self.assertEqual(
+            self.index.search(input_type="KBaseFile.SingleEndLibrary-2.1"),
+            ["MEGAHIT/run_megahit"],
+        )
+        self.assertEqual(
+            self.index.search("assemble", input_type="KBaseFile.PairedEndLibrary"),
+            ["kb_SPAdes/run_SPAdes", "MEGAHIT/run_megahit"],
+        )
+        self.assertEqual(
+            self.index.search("genome", output_type="KBaseGenomes.Genome"),
+            ["RAST_SDK/annotate_genome"],
+        )
+        self.assertEqual(
+            self.index.search(
+                input_type="KBaseGenomes.Genome",
+                output_type="KBaseGenomeAnnotations.Assembly",
+            ),
+            [],
+        )
+
+    def test_apps_for_type(self):
+        self.assertEqual(
+            self.index.apps_for_type("KBaseFile.PairedEndLibrary"),
+            {"kb_SPAdes/run_SPAdes", "MEGAHIT/run_megahit"},
+        )
+        self.assertEqual(
+            self.index.apps_for_type("KBaseGenomeAnnotations.Assembly"), set()
+        )
+        self.assertEqual(
+            self.index.apps_for_type("KBaseGenomeAnnotations.Assembly", output=True),
+            {"kb_SPAdes/run_SPAdes", "MEGAHIT/run_megahit"},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,10 +5,11 @@ from biokbase.narrative.jobs.appmanager import AppManager
 import biokbase.narrative.jobs.specmanager as specmanager
 import biokbase.narrative.app_util as app_util
 from biokbase.narrative.jobs.job import Job
+from biokbase.narrative.jobs.jobmanager import JobManager
 from IPython.display import HTML
 import unittest
 import mock
-from .narrative_mock.mockclients import get_mock_client
+from .narrative_mock.mockclients import get_mock_client, MockClients
 import os
 from .util import TestConfig
 
@@ -39,6 +40,11 @@ class AppManagerTestCase(unittest.TestCase):
             "pipeline": "",
             "min_contig_len": None,
         }
+        # these validate against the mock Workspace, for run_app_bulk
+        cls.bulk_app_params = dict(
+            cls.test_app_params,
+            read_library_names=["rhodobacterium.art.q20.int.PE.reads"],
+        )
         cls.test_job_id = config.get("app_tests", "test_job_id")
         cls.test_tag = config.get("app_tests", "test_app_tag")
         cls.public_ws = config.get("app_tests", "public_ws_name")
@@ -80,6 +86,13 @@ class AppManagerTestCase(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.am.available_apps(self.bad_tag)
 
+    def test_search_apps(self):
+        results = self.am.search_apps("test input", tag=self.good_tag)
+        self.assertEqual(results[0]["id"], self.good_app_id)
+        self.assertTrue(results._repr_html_())
+        with self.assertRaises(ValueError):
+            self.am.search_apps("test", tag=self.bad_tag)
+
     @mock.patch("biokbase.narrative.jobs.appmanager.clients.get", get_mock_client)
     @mock.patch("biokbase.narrative.jobs.appmanager.JobComm")
     @mock.patch(
@@ -154,6 +167,153 @@ class AppManagerTestCase(unittest.TestCase):
             self.am.run_app(self.good_app_id, None, tag=self.good_tag, version=">0.0.1")
         )
 
+    @mock.patch("biokbase.narrative.jobs.appmanager.clients.get", get_mock_client)
+    @mock.patch("biokbase.narrative.jobs.appmanager.JobComm")
+    @mock.patch(
+        "biokbase.narrative.jobs.appmanager.auth.get_agent_token",
+        side_effect=mock_agent_token,
+    )
+    def test_run_app_bulk_dry_run(self, auth, c):
+        os.environ["KB_WORKSPACE_ID"] = self.public_ws
+        output = self.am.run_app_bulk(
+            self.test_app_id,
+            [self.bulk_app_params, self.bulk_app_params],
+            tag=self.test_tag,
+            dry_run=True,
+        )
+        self.assertEqual(len(output), 2)
+        for idx, job_inputs in enumerate(output):
+            self.assertEqual(job_inputs["app_id"], self.test_app_id)
+            self.assertEqual(job_inputs["meta"]["bulk_index"], idx)
+            self.assertEqual(job_inputs["meta"]["bulk_size"], 2)
+        self.assertEqual(
+            output[0]["meta"]["bulk_group_id"], output[1]["meta"]["bulk_group_id"]
+        )
+
+    @mock.patch("biokbase.narrative.jobs.appmanager.clients.get", get_mock_client)
+    @mock.patch("biokbase.narrative.jobs.appmanager.JobComm")
+    @mock.patch(
+        "biokbase.narrative.jobs.appmanager.auth.get_agent_token",
+        side_effect=mock_agent_token,
+    )
+    def test_run_app_bulk_good_inputs(self, auth, c):
+        os.environ["KB_WORKSPACE_ID"] = self.public_ws
+        with mock.patch.object(
+            MockClients,
+            "run_job",
+            side_effect=lambda p: "bulk_job_{}".format(p["meta"]["bulk_index"]),
+        ):
+            new_jobs = self.am.run_app_bulk(
+                self.test_app_id,
+                [self.bulk_app_params] * 3,
+                tag=self.test_tag,
+                max_concurrent=2,
+            )
+        self.assertEqual(
+            [job.job_id for job in new_jobs], ["bulk_job_0", "bulk_job_1", "bulk_job_2"]
+        )
+        for job in new_jobs:
+            self.assertIsInstance(job, Job)
+            self.assertEqual(job.app_id, self.test_app_id)
+            self.assertEqual(job.tag, self.test_tag)
+        group_id = new_jobs[0].meta["bulk_group_id"]
+        self.assertEqual(
+            JobManager().get_job_group(group_id), [job.job_id for job in new_jobs]
+        )
+        # their states get looked up together
+        c.return_value.lookup_job_states.assert_called_once_with(
+            [job.job_id for job in new_jobs]
+        )
+        c.return_value.lookup_job_state.assert_not_called()
+
+    @mock.patch("biokbase.narrative.jobs.appmanager.clients.get", get_mock_client)
+    @mock.patch("biokbase.narrative.jobs.appmanager.JobComm")
+    @mock.patch(
+        "biokbase.narrative.jobs.appmanager.auth.get_agent_token",
+        side_effect=mock_agent_token,
+    )
+    def test_run_app_bulk_partial_fail(self, auth, c):
+        def run_job(params):
+            if params["meta"]["bulk_index"] == 1:
+                raise ValueError("EE2 is down")
+            return "bulk_job_{}".format(params["meta"]["bulk_index"])
+
+        os.environ["KB_WORKSPACE_ID"] = self.public_ws
+        with mock.patch.object(MockClients, "run_job", side_effect=run_job):
+            self.assertIsNone(
+                self.am.run_app_bulk(
+                    self.test_app_id,
+                    [self.bulk_app_params] * 3,
+                    tag=self.test_tag,
+                    max_concurrent=1,
+                )
+            )
+        # the first one still got started and registered
+        JobManager().get_job("bulk_job_0")
+        error_msg = c.return_value.send_comm_message.call_args[0][1]
+        self.assertEqual(error_msg["event"], "error")
+        self.assertIn("Only 1 of 3 jobs were started", error_msg["error_message"])
+
+    @mock.patch("biokbase.narrative.jobs.appmanager.clients.get", get_mock_client)
+    @mock.patch("biokbase.narrative.jobs.appmanager.JobComm")
+    @mock.patch(
+        "biokbase.narrative.jobs.appmanager.auth.get_agent_token",
+        side_effect=mock_agent_token,
+    )
+    def test_run_app_bulk_bad_params(self, auth, c):
+        os.environ["KB_WORKSPACE_ID"] = self.public_ws
+        bad_params = dict(self.bulk_app_params, not_a_param="foo")
+        with mock.patch.object(MockClients, "run_job") as run_job:
+            self.assertIsNone(
+                self.am.run_app_bulk(
+                    self.test_app_id,
+                    [self.bulk_app_params, bad_params, self.bulk_app_params],
+                    tag=self.test_tag,
+                )
+            )
+        # none of them get started
+        run_job.assert_not_called()
+        error_msg = c.return_value.send_comm_message.call_args[0][1]
+        self.assertEqual(error_msg["event"], "error")
+        self.assertIn("Parameter set 1: Unknown parameters", error_msg["error_message"])
+
+    @mock.patch("biokbase.narrative.jobs.appmanager.clients.get", get_mock_client)
+    @mock.patch("biokbase.narrative.jobs.appmanager.JobComm")
+    @mock.patch(
+        "biokbase.narrative.jobs.appmanager.auth.get_agent_token",
+        side_effect=mock_agent_token,
+    )
+    def test_run_app_bulk_chunked(self, auth, c):
+        os.environ["KB_WORKSPACE_ID"] = self.public_ws
+        with mock.patch.object(
+            MockClients,
+            "run_job",
+            side_effect=lambda p: "bulk_job_{}".format(p["meta"]["bulk_index"]),
+        ) as run_job:
+            # a generator, not a list
+            new_jobs = self.am.run_app_bulk(
+                self.test_app_id,
+                (self.bulk_app_params for _ in range(5)),
+                tag=self.test_tag,
+                chunk_size=2,
+            )
+        self.assertEqual(run_job.call_count, 5)
+        self.assertEqual(
+            [job.job_id for job in new_jobs],
+            ["bulk_job_{}".format(i) for i in range(5)],
+        )
+        self.assertEqual(len(set(job.meta["bulk_group_id"] for job in new_jobs)), 1)
+
+    def test_configure_bulk_run_bad(self):
+        with self.assertRaises(ValueError) as e:
+            self.am.configure_bulk_run(max_concurrent=0)
+        self.assertIn("max concurrent must be at least 1", str(e.exception))
+        with self.assertRaises(ValueError) as e:
+            self.am._run_app_bulk_internal(
+                self.test_app_id, [], "release", None, None, None, False, 1, 0
+            )
+        self.assertIn("chunk size must be at least 1", str(e.exception))
+
     # Running an app with missing inputs is now allowed. The app can
     # crash if it wants to, it can leave its process behind.
     @mock.patch("biokbase.narrative.jobs.appmanager.clients.get", get_mock_client)
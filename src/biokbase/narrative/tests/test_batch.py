@@ -12,6 +12,7 @@ from biokbase.narrative.jobs.batch import (
     _generate_vals,
     _is_singleton,
     generate_input_batch,
+    iter_input_batch,
     _prepare_output_vals,
 )
 import biokbase.narrative.jobs.specmanager
@@ -313,6 +314,46 @@ class BatchTestCase(unittest.TestCase):
         for v in out_strs.values():
             self.assertEqual(v, 1)
 
+    @mock.patch(
+        "biokbase.narrative.jobs.batch.specmanager.clients.get", get_mock_client
+    )
+    @mock.patch("biokbase.narrative.jobs.specmanager.clients.get", get_mock_client)
+    def test_iter_input_batch(self):
+        biokbase.narrative.jobs.specmanager.SpecManager().reload()
+        app_id = "kb_trimmomatic/run_trimmomatic"
+        # inputs get checked up front
+        with self.assertRaises(ValueError) as e:
+            iter_input_batch(app_id, not_an_input="something")
+        self.assertIn("is not a parameter", str(e.exception))
+
+        inputs = {
+            "output_reads_name": "foo_${run_number}",
+            "palindrome_clip_threshold": [5, 7],
+            "min_length": (0, 10, 100),
+        }
+        batch = iter_input_batch(app_id, **inputs)
+        self.assertEqual(len(batch), 22)
+        # same as the eager version, in the same order
+        self.assertEqual(list(batch), generate_input_batch(app_id, **inputs))
+
+        chunks = list(batch.chunks(10))
+        self.assertEqual([len(c) for c in chunks], [10, 10, 2])
+        self.assertEqual(chunks[2][1]["output_reads_name"], "foo_21")
+        with self.assertRaises(ValueError):
+            next(batch.chunks(0))
+
+        # big sweeps don't get made up front
+        batch = iter_input_batch(
+            app_id,
+            output_reads_name="foo_${run_number}",
+            min_length=(0, 1, 9999),
+            palindrome_clip_threshold=(0, 1, 9),
+        )
+        self.assertEqual(len(batch), 100000)
+        first = next(iter(batch))
+        self.assertEqual(first["min_length"], 0)
+        self.assertEqual(first["output_reads_name"], "foo_0")
+
     def test__prepare_output_vals(self):
         basic_params_dict = {
             "output": {"default": None, "is_output": True},
@@ -0,0 +1,357 @@
+import gzip
+import io
+import json
+import os
+import threading
+import time
+import unittest
+import zlib
+from unittest import mock
+import requests
+from biokbase.narrative import clients
+from biokbase.workspace.baseclient import BaseClient, ServerError
+from biokbase.narrative.common.rpc import (
+    RPCBatch,
+    RPCTransport,
+    get_json_codec,
+    use_transport,
+)
+from biokbase.narrative.common import sessions
+
+
+class ClientsTestCase(unittest.TestCase):
+    def setUp(self):
+        clients.reset()
+
+    def tearDown(self):
+        clients.reset()
+        sessions.configure(
+            pool_connections=sessions.DEFAULT_POOL_CONNECTIONS,
+            pool_maxsize=sessions.DEFAULT_POOL_MAXSIZE,
+            max_retries=sessions.DEFAULT_MAX_RETRIES,
+            retry_backoff=sessions.DEFAULT_RETRY_BACKOFF,
+            keep_alive=sessions.DEFAULT_KEEP_ALIVE,
+        )
+
+    def test_client_reused(self):
+        ws = clients.get("workspace", token="some_token")
+        self.assertIs(clients.get("workspace", token="some_token"), ws)
+        self.assertIsNot(clients.get("workspace", token="other_token"), ws)
+        self.assertIsNot(clients.get("catalog", token="some_token"), ws)
+
+    def test_env_token_client(self):
+        with mock.patch.dict(os.environ, {"KB_AUTH_TOKEN": "env_token"}):
+            ws = clients.get("workspace")
+            self.assertIs(clients.get("workspace"), ws)
+        with mock.patch.dict(os.environ, {"KB_AUTH_TOKEN": "new_env_token"}):
+            self.assertIsNot(clients.get("workspace"), ws)
+
+    def test_reset(self):
+        ws = clients.get("workspace", token="some_token")
+        clients.reset()
+        self.assertIsNot(clients.get("workspace", token="some_token"), ws)
+
+    def test_max_cached_clients(self):
+        with mock.patch.object(clients, "MAX_CACHED_CLIENTS", 2):
+            first = clients.get("workspace", token="token1")
+            clients.get("workspace", token="token2")
+            clients.get("workspace", token="token3")
+            self.assertIsNot(clients.get("workspace", token="token1"), first)
+
+    def test_shared_sessions(self):
+        ws = clients.get("workspace", token="some_token")
+        ws2 = clients.get("workspace", token="other_token")
+        nms = clients.get("narrative_method_store", token="some_token")
+        self.assertIsNotNone(ws._client.rpc_transport.session)
+        self.assertIs(
+            ws._client.rpc_transport.session, ws2._client.rpc_transport.session
+        )
+        self.assertIs(
+            nms.session, sessions.get_session(clients.URLS.narrative_method_store)
+        )
+
+    def test_generated_client_transport(self):
+        ws = clients.get("workspace", token="some_token")
+        transport = ws._client.rpc_transport
+        self.assertEqual(transport._client._call, transport.call)
+        self.assertIs(transport.server_error, ServerError)
+        # the generated BaseClient class itself is left alone
+        client = BaseClient("https://kbase.us/services/ws", token="some_token")
+        self.assertFalse(hasattr(client, "rpc_transport"))
+
+    def test_unknown_client(self):
+        with self.assertRaises(ValueError) as e:
+            clients.get("not_a_service")
+        self.assertIn('Unknown client name "not_a_service"', str(e.exception))
+
+
+class SlowClient:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def echo(self, value):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        if value is None:
+            raise ValueError("no value")
+        return value
+
+
+class BatchTestCase(unittest.TestCase):
+    def test_batch_concurrent(self):
+        client = SlowClient()
+        with RPCBatch(client, 4) as batch:
+            futures = [batch.echo(i) for i in range(8)]
+        self.assertEqual([f.result() for f in futures], list(range(8)))
+        self.assertGreater(client.max_running, 1)
+        self.assertLessEqual(client.max_running, 4)
+
+    def test_batch_errors(self):
+        with RPCBatch(SlowClient(), 2) as batch:
+            good = batch.echo("foo")
+            bad = batch.echo(None)
+        self.assertEqual(good.result(), "foo")
+        with self.assertRaises(ValueError):
+            bad.result()
+
+    def test_batch_outside_with(self):
+        batch = RPCBatch(SlowClient(), 2)
+        with self.assertRaises(ValueError) as e:
+            batch.echo("foo")
+        self.assertIn("inside a with block", str(e.exception))
+        with self.assertRaises(AttributeError):
+            batch.lock
+
+    def test_service_client_batch(self):
+        ws = clients.get("workspace", token="some_token")
+        batch = clients.batch(ws, max_workers=3)
+        self.assertIs(batch._client, ws)
+        self.assertEqual(batch._max_workers, 3)
+        with self.assertRaises(ValueError) as e:
+            clients.batch(ws, max_workers=0)
+        self.assertIn("max workers must be at least 1", str(e.exception))
+
+
+def make_response(status_code, body, content_type="application/json"):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers["content-type"] = content_type
+    response.raw = io.BytesIO(body)
+    return response
+
+
+class FakeSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = list()
+
+    def post(self, url, **kwargs):
+        self.calls.append((url, kwargs))
+        return self.responses.pop(0)
+
+
+class JSONCodecTestCase(unittest.TestCase):
+    def test_codecs(self):
+        obj = {"a": [1, 2.5, "three", None, True], "b": {"c": "d"}, 5: "five"}
+        for name in ["json", "orjson"]:
+            codec = get_json_codec(name)
+            self.assertEqual(codec.name, name)
+            encoded = codec.dumps(obj)
+            self.assertIsInstance(encoded, bytes)
+            self.assertEqual(
+                codec.loads(encoded),
+                {"a": [1, 2.5, "three", None, True], "b": {"c": "d"}, "5": "five"},
+            )
+            self.assertEqual(codec.loads(codec.dumps({"s": {1}})), {"s": [1]})
+            # too big for orjson, so it falls back to the standard library
+            self.assertEqual(codec.loads(codec.dumps([2 ** 70])), [2 ** 70])
+
+    def test_default_codec(self):
+        self.assertEqual(get_json_codec().name, "orjson")
+        self.assertEqual(RPCTransport.json_codec.name, "orjson")
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError) as e:
+            get_json_codec("yaml")
+        self.assertIn("Unknown JSON codec yaml", str(e.exception))
+
+    def test_call_decodes_bytes(self):
+        for name in ["json", "orjson"]:
+            client = BaseClient("https://kbase.us/services/ws", token="some_token")
+            transport = use_transport(client)
+            transport.json_codec = get_json_codec(name)
+            transport.session = FakeSession(
+                make_response(200, b'{"result": [{"x": [1, 2, 3]}]}')
+            )
+            self.assertEqual(
+                client.call_method("Workspace.foo", [{"y": 1}]), {"x": [1, 2, 3]}
+            )
+            (url, kwargs) = transport.session.calls[0]
+            sent = get_json_codec("json").loads(kwargs["data"])
+            self.assertEqual(sent["method"], "Workspace.foo")
+            self.assertEqual(sent["params"], [{"y": 1}])
+
+    def test_call_server_error(self):
+        client = BaseClient("https://kbase.us/services/ws", token="some_token")
+        transport = use_transport(client)
+        transport.session = FakeSession(
+            make_response(
+                500,
+                b'{"error": {"name": "JSONRPCError", "code": -32500, '
+                b'"message": "no such object"}}',
+            )
+        )
+        with self.assertRaises(ServerError) as e:
+            client.call_method("Workspace.foo", [])
+        self.assertEqual(e.exception.message, "no such object")
+
+        transport.session = FakeSession(make_response(500, b"oops", "text/plain"))
+        with self.assertRaises(ServerError) as e:
+            client.call_method("Workspace.foo", [])
+        self.assertEqual(e.exception.message, "oops")
+
+
+class CompressionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = BaseClient("https://kbase.us/services/ws", token="some_token")
+        self.transport = use_transport(self.client)
+        self.transport.compress_min_bytes = 100
+        self.params = [{"data": "x" * 1000}]
+
+    def test_compress_request(self):
+        for encoding, decompress in [
+            ("gzip", gzip.decompress),
+            ("deflate", zlib.decompress),
+        ]:
+            self.transport.compress_encoding = encoding
+            self.transport.session = FakeSession(make_response(200, b'{"result": [1]}'))
+            self.assertEqual(self.client.call_method("Workspace.foo", self.params), 1)
+            (_, kwargs) = self.transport.session.calls[0]
+            self.assertEqual(kwargs["headers"]["Content-Encoding"], encoding)
+            self.assertEqual(kwargs["headers"]["Accept-Encoding"], "gzip, deflate")
+            sent = json.loads(decompress(kwargs["data"]))
+            self.assertEqual(sent["params"], self.params)
+            stats = self.transport.get_call_stats()
+            self.assertEqual(stats["request_bytes_sent"], len(kwargs["data"]))
+            self.assertLess(stats["request_bytes_sent"], stats["request_bytes"])
+            self.assertEqual(stats["response_bytes"], len(b'{"result": [1]}'))
+            self.assertEqual(stats["response_bytes_received"], stats["response_bytes"])
+        totals = self.transport.get_byte_stats()
+        self.assertEqual(totals["calls"], 2)
+        self.assertEqual(totals["response_bytes"], 2 * len(b'{"result": [1]}'))
+
+    def test_small_request_not_compressed(self):
+        self.transport.session = FakeSession(make_response(200, b'{"result": [1]}'))
+        self.client.call_method("Workspace.foo", [])
+        (_, kwargs) = self.transport.session.calls[0]
+        self.assertNotIn("Content-Encoding", kwargs["headers"])
+        stats = self.transport.get_call_stats()
+        self.assertEqual(stats["request_bytes_sent"], stats["request_bytes"])
+
+    def test_compression_unsupported(self):
+        parse_error = make_response(
+            500,
+            b'{"error": {"name": "JSONRPCError", "code": -32700, '
+            b'"message": "Parse error"}}',
+        )
+        self.transport.session = FakeSession(
+            parse_error,
+            make_response(200, b'{"result": [1]}'),
+            make_response(200, b'{"result": [2]}'),
+        )
+        self.assertEqual(self.client.call_method("Workspace.foo", self.params), 1)
+        self.assertEqual(self.client.call_method("Workspace.foo", self.params), 2)
+        headers = [kwargs["headers"] for (_, kwargs) in self.transport.session.calls]
+        self.assertEqual(headers[0]["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Encoding", headers[1])
+        self.assertNotIn("Content-Encoding", headers[2])
+        self.assertEqual(self.transport.get_byte_stats()["calls"], 3)
+
+    def test_configure_compression(self):
+        clients.reset()
+        try:
+            clients.configure_compression(min_bytes=1000, encoding="deflate")
+            ws = clients.get("workspace", token="some_token")
+            transport = ws._client.rpc_transport
+            self.assertEqual(transport.compress_min_bytes, 1000)
+            self.assertEqual(transport.compress_encoding, "deflate")
+            clients.configure_compression()
+            self.assertIsNone(transport.compress_min_bytes)
+            self.assertIsNone(clients.get_call_stats(ws))
+            with self.assertRaises(ValueError) as e:
+                clients.configure_compression(encoding="br")
+            self.assertIn('must be "gzip" or "deflate"', str(e.exception))
+        finally:
+            clients.configure_compression()
+            clients.reset()
+
+
+class SessionsTestCase(unittest.TestCase):
+    def tearDown(self):
+        sessions.configure(
+            pool_connections=sessions.DEFAULT_POOL_CONNECTIONS,
+            pool_maxsize=sessions.DEFAULT_POOL_MAXSIZE,
+            max_retries=sessions.DEFAULT_MAX_RETRIES,
+            retry_backoff=sessions.DEFAULT_RETRY_BACKOFF,
+            keep_alive=sessions.DEFAULT_KEEP_ALIVE,
+        )
+
+    def test_session_per_host(self):
+        s1 = sessions.get_session("https://kbase.us/services/ws")
+        self.assertIs(sessions.get_session("https://KBase.us/services/catalog"), s1)
+        self.assertIsNot(sessions.get_session("https://appdev.kbase.us/services"), s1)
+        self.assertIsNot(sessions.get_session("http://kbase.us/services/ws"), s1)
+
+    def test_configure(self):
+        s1 = sessions.get_session("https://kbase.us/services/ws")
+        sessions.configure(
+            pool_maxsize=20, max_retries=1, retry_backoff=0, keep_alive=False
+        )
+        s2 = sessions.get_session("https://kbase.us/services/ws")
+        self.assertIsNot(s1, s2)
+        self.assertEqual(s2.headers["Connection"], "close")
+        adapter = s2.get_adapter("https://kbase.us")
+        self.assertEqual(adapter._pool_maxsize, 20)
+        self.assertEqual(adapter.max_retries.connect, 1)
+        self.assertEqual(adapter.max_retries.read, 0)
+        config = sessions.get_config()
+        self.assertEqual(config["pool_maxsize"], 20)
+        self.assertEqual(config["pool_connections"], sessions.DEFAULT_POOL_CONNECTIONS)
+
+    def test_configure_drops_clients(self):
+        ws = clients.get("workspace", token="some_token")
+        old_session = ws._client.rpc_transport.session
+        sessions.configure(pool_maxsize=20)
+        ws2 = clients.get("workspace", token="some_token")
+        self.assertIsNot(ws2, ws)
+        self.assertIsNot(ws2._client.rpc_transport.session, old_session)
+        self.assertIs(
+            ws2._client.rpc_transport.session,
+            sessions.get_session(clients.URLS.workspace),
+        )
+
+    def test_configure_bad(self):
+        bad = [
+            ({"pool_connections": 0}, "pool connections must be at least 1"),
+            ({"pool_maxsize": 0}, "pool max size must be at least 1"),
+            ({"max_retries": -1}, "max retries must not be negative"),
+            ({"retry_backoff": -1}, "retry backoff must not be negative"),
+        ]
+        for kwargs, msg in bad:
+            with self.assertRaises(ValueError) as e:
+                sessions.configure(**kwargs)
+            self.assertIn(msg, str(e.exception))
+
+    def test_no_cookies(self):
+        session = sessions.get_session("https://kbase.us/services/ws")
+        self.assertEqual(session.cookies.get_policy().allowed_domains(), ())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -209,3 +209,59 @@ class JobTest(unittest.TestCase):
         with self.assertRaises(Exception) as e:
             job.parameters()
         self.assertIn("Unable to fetch parameters for job", str(e.exception))
+
+    def test_log_tail_long_log(self):
+        total_lines = 123456
+        # the most lines EE2 returns at once
+        page_size = 4
+        fetched = list()
+
+        class LongLogClient:
+            def get_job_logs(self, params):
+                offset = params.get("offset", 0)
+                last_line = min(total_lines, offset + page_size)
+                if params.get("limit") is not None:
+                    last_line = min(last_line, offset + params["limit"])
+                lines = [
+                    {"is_error": 0, "line": f"This is line {i}"}
+                    for i in range(offset, last_line)
+                ]
+                fetched.append(len(lines))
+                return {
+                    "last_line_number": total_lines,
+                    "lines": lines,
+                    "count": len(lines),
+                }
+
+        job = self._mocked_job()
+        with mock.patch(
+            "biokbase.narrative.jobs.job.clients.get",
+            lambda name, token=None: LongLogClient(),
+        ):
+            (first_line, num_available, lines) = job.log_tail(10)
+            self.assertEqual(total_lines - 10, first_line)
+            self.assertEqual(total_lines, num_available)
+            self.assertEqual(10, len(lines))
+            for i, line in enumerate(lines):
+                self.assertEqual(f"This is line {first_line + i}", line["line"])
+            # one call finds the end, then the tail takes a page at a time
+            self.assertEqual([4, 4, 4, 2], fetched)
+
+            # the tail is stored now, so it's not fetched again
+            fetched.clear()
+            self.assertEqual(lines, job.log_tail(10)[2])
+            self.assertEqual(0, sum(fetched))
+
+            # the head of the log gets filled in a page at a time too
+            (num_available, head) = job.log(num_lines=10)
+            self.assertEqual(total_lines, num_available)
+            self.assertEqual(
+                [f"This is line {i}" for i in range(10)], [line["line"] for line in head]
+            )
+
+    @mock.patch("biokbase.narrative.jobs.job.clients.get", get_mock_client)
+    def test_logs_per_job(self):
+        job = self._mocked_job()
+        job.log()
+        other_job = self._mocked_job()
+        self.assertEqual(0, other_job._log_store.total_lines)
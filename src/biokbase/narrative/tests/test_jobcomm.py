@@ -1,6 +1,7 @@
 import unittest
 from unittest import mock
 import os
+import copy
 
 import biokbase.narrative.jobs.jobcomm
 import biokbase.narrative.jobs.jobmanager
@@ -46,6 +47,12 @@ class JobCommTestCase(unittest.TestCase):
     def setUp(self):
         self.jc._comm.clear_message_cache()
         self.jc._jm.initialize_jobs()
+        # forget any polling schedule from earlier tests
+        self.jc._poll_scheduler.sync_jobs([])
+
+    def tearDown(self):
+        self.jc.stop_job_status_loop()
+        self.jc._log_streamer.stop_all()
 
     def test_send_comm_msg_ok(self):
         self.jc.send_comm_message("some_msg", {"foo": "bar"})
@@ -76,6 +83,189 @@ class JobCommTestCase(unittest.TestCase):
         self.assertFalse(self.jc._running_lookup_loop)
         self.assertIsNone(self.jc._lookup_timer)
 
+    @mock.patch(
+        "biokbase.narrative.jobs.jobcomm.jobmanager.clients.get", get_mock_client
+    )
+    def test_job_status_loop_polls_due_jobs(self):
+        self.jc.start_job_status_loop()
+        msg = self.jc._comm.last_message
+        self.assertEqual("job_status_delta", msg["data"]["msg_type"])
+        self.assertTrue(msg["data"]["content"]["full"])
+        self.assertCountEqual(self.job_ids, msg["data"]["content"]["states"].keys())
+        # the completed job is never polled again, the others aren't due yet
+        self.assertTrue(self.jc._poll_scheduler.is_finished(self.job_ids[0]))
+        self.assertEqual([], self.jc._poll_scheduler.due_jobs())
+        self.jc._comm.clear_message_cache()
+        # run the loop as if from its own Timer thread
+        timer = self.jc._lookup_timer
+        with mock.patch.object(self.jc._jm, "lookup_job_states") as lookup, mock.patch(
+            "biokbase.narrative.jobs.jobcomm.threading.current_thread",
+            return_value=timer,
+        ):
+            self.jc._lookup_job_status_loop()
+            lookup.assert_not_called()
+        self.assertIsNot(timer, self.jc._lookup_timer)
+        self.assertIsNone(self.jc._comm.last_message)
+        self.jc.stop_job_status_loop()
+
+    def _run_loop_from_timer(self):
+        """
+        Runs the lookup loop as if from its own Timer thread, with the JobManager's
+        lookup_job_states mocked out. Returns the mock.
+        """
+        with mock.patch.object(
+            self.jc._jm, "lookup_job_states", return_value={}
+        ) as lookup, mock.patch(
+            "biokbase.narrative.jobs.jobcomm.threading.current_thread",
+            return_value=self.jc._lookup_timer,
+        ):
+            self.jc._lookup_job_status_loop()
+        return lookup
+
+    @mock.patch(
+        "biokbase.narrative.jobs.jobcomm.jobmanager.clients.get", get_mock_client
+    )
+    def test_job_status_loop_subscribed_only(self):
+        created_id, running_id = self.job_ids[1], self.job_ids[2]
+        self.jc.start_job_status_loop()
+        self.jm._running_jobs[running_id]["refresh"] = 0
+        self.jc._poll_scheduler.poll_now(created_id)
+        self.jc._poll_scheduler.poll_now(running_id)
+        lookup = self._run_loop_from_timer()
+        lookup.assert_called_once_with([created_id])
+
+        # a sweep picks up the job without listeners, too
+        self.jc._last_sweep -= self.jc._sweep_interval
+        lookup = self._run_loop_from_timer()
+        lookup.assert_called_once_with([created_id, running_id])
+        self.jc.stop_job_status_loop()
+
+    @mock.patch(
+        "biokbase.narrative.jobs.jobcomm.jobmanager.clients.get", get_mock_client
+    )
+    def test_job_status_loop_all_jobs(self):
+        created_id, running_id = self.job_ids[1], self.job_ids[2]
+        self.jc.configure_job_polling(subscribed_only=False)
+        try:
+            self.jc.start_job_status_loop()
+            self.jm._running_jobs[running_id]["refresh"] = 0
+            self.jc._poll_scheduler.poll_now(created_id)
+            self.jc._poll_scheduler.poll_now(running_id)
+            lookup = self._run_loop_from_timer()
+            lookup.assert_called_once_with([created_id, running_id])
+        finally:
+            self.jc.stop_job_status_loop()
+            self.jc.configure_job_polling(subscribed_only=True)
+
+    @mock.patch(
+        "biokbase.narrative.jobs.jobcomm.jobmanager.clients.get", get_mock_client
+    )
+    def test_job_status_loop_stops_without_listeners(self):
+        for job_id in self.job_ids:
+            self.jm._running_jobs[job_id]["refresh"] = 0
+        self.jc.start_job_status_loop()
+        # the first run still sends all the states
+        msg = self.jc._comm.last_message
+        self.assertEqual("job_status_delta", msg["data"]["msg_type"])
+        self.assertTrue(msg["data"]["content"]["full"])
+        self.assertFalse(self.jc._running_lookup_loop)
+        self.assertIsNone(self.jc._lookup_timer)
+
+    @mock.patch(
+        "biokbase.narrative.jobs.jobcomm.jobmanager.clients.get", get_mock_client
+    )
+    def test_job_status_loop_sends_deltas(self):
+        created_id, running_id = self.job_ids[1], self.job_ids[2]
+        self.jc.start_job_status_loop()
+        msg = self.jc._comm.last_message["data"]
+        seq = msg["content"]["seq"]
+        self.assertEqual(1, msg["content"]["protocol"])
+        self.assertEqual([], msg["content"]["removed"])
+        states = msg["content"]["states"]
+
+        # nothing changed, nothing sent
+        self.jc._comm.clear_message_cache()
+        self.jc._poll_scheduler.poll_now(created_id)
+        self.jc._poll_scheduler.poll_now(running_id)
+        with mock.patch.object(
+            self.jc._jm,
+            "lookup_job_states",
+            return_value={
+                created_id: states[created_id],
+                running_id: states[running_id],
+            },
+        ), mock.patch(
+            "biokbase.narrative.jobs.jobcomm.threading.current_thread",
+            return_value=self.jc._lookup_timer,
+        ):
+            self.jc._lookup_job_status_loop()
+        self.assertIsNone(self.jc._comm.last_message)
+
+        # one job changed, the other went away
+        new_state = copy.deepcopy(states[running_id])
+        new_state["state"]["updated"] += 1
+        self.jc._poll_scheduler.poll_now(created_id)
+        self.jc._poll_scheduler.poll_now(running_id)
+        del self.jm._running_jobs[created_id]
+        with mock.patch.object(
+            self.jc._jm, "lookup_job_states", return_value={running_id: new_state}
+        ), mock.patch(
+            "biokbase.narrative.jobs.jobcomm.threading.current_thread",
+            return_value=self.jc._lookup_timer,
+        ):
+            self.jc._lookup_job_status_loop()
+        msg = self.jc._comm.last_message["data"]
+        self.assertEqual("job_status_delta", msg["msg_type"])
+        self.assertEqual(seq + 1, msg["content"]["seq"])
+        self.assertFalse(msg["content"]["full"])
+        self.assertEqual({running_id: new_state}, msg["content"]["states"])
+        self.assertEqual([created_id], msg["content"]["removed"])
+        self.jc.stop_job_status_loop()
+
+    @mock.patch(
+        "biokbase.narrative.jobs.jobcomm.jobmanager.clients.get", get_mock_client
+    )
+    def test_resync_job_states(self):
+        self.jc._lookup_all_job_states(None)
+        seq = self.jc._status_seq
+        req = make_comm_msg("resync_job_status", None, False)
+        with mock.patch.object(self.jc._jm, "lookup_job_states") as lookup:
+            self.jc._handle_comm_message(req)
+            lookup.assert_not_called()
+        msg = self.jc._comm.last_message["data"]
+        self.assertEqual("job_status_delta", msg["msg_type"])
+        self.assertEqual(seq + 1, msg["content"]["seq"])
+        self.assertTrue(msg["content"]["full"])
+        self.assertCountEqual(self.job_ids, msg["content"]["states"].keys())
+        for state in msg["content"]["states"].values():
+            validate_job_state(state)
+
+    @mock.patch(
+        "biokbase.narrative.jobs.jobcomm.jobmanager.clients.get", get_mock_client
+    )
+    def test_resync_job_states_removed(self):
+        job_id = self.job_ids[1]
+        self.jc._lookup_all_job_states(None)
+        del self.jm._running_jobs[job_id]
+        # the delta that says the job is gone goes missing, so the resync says it again
+        self.jc._prune_job_states()
+        self.jc._resync_job_states(None)
+        msg = self.jc._comm.last_message["data"]
+        self.assertTrue(msg["content"]["full"])
+        self.assertNotIn(job_id, msg["content"]["states"])
+        self.assertEqual([job_id], msg["content"]["removed"])
+
+        # once it's back, it's no longer removed
+        self.jc._jm.initialize_jobs()
+        self.jc._resync_job_states(None)
+        msg = self.jc._comm.last_message["data"]
+        self.assertEqual([], msg["content"]["removed"])
+
+    def test_configure_job_polling_bad(self):
+        with self.assertRaises(ValueError) as e:
+            self.jc.configure_job_polling(sweep_interval=0)
+        self.assertIn("Sweep interval must be greater than 0", str(e.exception))
+
     # ---------------------
     # Lookup all job states
     # ---------------------
@@ -108,6 +298,25 @@ class JobCommTestCase(unittest.TestCase):
         self.assertEqual("job_status", msg["data"]["msg_type"])
         validate_job_state(state)
 
+    @mock.patch(
+        "biokbase.narrative.jobs.jobcomm.jobmanager.clients.get", get_mock_client
+    )
+    def test_lookup_job_states_direct_ok(self):
+        job_ids = self.job_ids[:2]
+        with mock.patch.object(
+            self.jc, "send_comm_message", wraps=self.jc.send_comm_message
+        ) as send_comm_message, mock.patch.object(
+            self.jm, "_check_jobs", wraps=self.jm._check_jobs
+        ) as check_jobs:
+            self.jm._completed_job_states.clear()
+            states = self.jc.lookup_job_states(job_ids)
+        self.assertCountEqual(job_ids, states.keys())
+        self.assertLessEqual(check_jobs.call_count, 1)
+        self.assertEqual(
+            [mock.call("job_status", states[job_id]) for job_id in job_ids],
+            send_comm_message.call_args_list,
+        )
+
     def test_lookup_job_state_no_job(self):
         job_id = None
         req = make_comm_msg("job_state", job_id, True)
@@ -136,6 +345,9 @@ class JobCommTestCase(unittest.TestCase):
     # ---------------
     # Lookup job info
     # ---------------
+    @mock.patch(
+        "biokbase.narrative.jobs.jobcomm.jobmanager.clients.get", get_mock_client
+    )
     def test_lookup_job_info_ok(self):
         job_id = "5d64935ab215ad4128de94d6"
         req = make_comm_msg("job_info", job_id, True)
@@ -353,6 +565,9 @@ class JobCommTestCase(unittest.TestCase):
         self.assertEqual(msg["data"]["msg_type"], "job_status")
         validate_job_state(msg["data"]["content"])
 
+    @mock.patch(
+        "biokbase.narrative.jobs.jobcomm.jobmanager.clients.get", get_mock_client
+    )
     def test_handle_job_info_msg(self):
         job_id = "5d64935ab215ad4128de94d6"
         req = make_comm_msg("job_info", job_id, False)
@@ -379,11 +594,42 @@ class JobCommTestCase(unittest.TestCase):
         req = make_comm_msg("start_job_update", job_id, False)
         self.jc._handle_comm_message(req)
         msg = self.jc._comm.last_message
-        self.assertEqual(msg["data"]["msg_type"], "job_status_all")
+        self.assertEqual(msg["data"]["msg_type"], "job_status_delta")
+        self.assertIn(job_id, msg["data"]["content"]["states"])
         self.assertEqual(self.jm._running_jobs[job_id]["refresh"], refresh_count + 1)
         self.assertTrue(self.jc._running_lookup_loop)
         self.jc.stop_job_status_loop()
 
+    @mock.patch(
+        "biokbase.narrative.jobs.jobcomm.jobmanager.clients.get", get_mock_client
+    )
+    def test_handle_start_job_update_msg_loop_running(self):
+        running_id = self.job_ids[2]
+        self.jc.start_job_status_loop()
+        states = self.jc._comm.last_message["data"]["content"]["states"]
+        seq = self.jc._status_seq
+        timer = self.jc._lookup_timer
+        self.jc._comm.clear_message_cache()
+        new_state = copy.deepcopy(states[running_id])
+        new_state["state"]["updated"] += 1
+        req = make_comm_msg("start_job_update", running_id, False)
+        with mock.patch.object(
+            self.jc._jm, "lookup_job_states", return_value={running_id: new_state}
+        ) as lookup:
+            self.jc._handle_comm_message(req)
+        # only the new subscription is looked up, and sent as a normal delta
+        lookup.assert_called_once_with([running_id])
+        msg = self.jc._comm.last_message["data"]
+        self.assertEqual("job_status_delta", msg["msg_type"])
+        self.assertEqual(seq + 1, msg["content"]["seq"])
+        self.assertFalse(msg["content"]["full"])
+        self.assertEqual({running_id: new_state}, msg["content"]["states"])
+        # and the loop carries on with a new timer
+        self.assertIsNotNone(self.jc._lookup_timer)
+        self.assertIsNot(timer, self.jc._lookup_timer)
+        self.assertFalse(self.jc._initial_sweep)
+        self.jc.stop_job_status_loop()
+
     def test_handle_stop_job_update_msg(self):
         job_id = "5d64935ab215ad4128de94d6"
         refresh_count = self.jm._running_jobs[job_id]["refresh"]
@@ -417,6 +663,90 @@ class JobCommTestCase(unittest.TestCase):
         msg = self.jc._comm.last_message
         self.assertEqual(msg["data"]["msg_type"], "job_logs")
 
+    # -------------------
+    # Streaming job logs
+    # -------------------
+    @mock.patch(
+        "biokbase.narrative.jobs.jobcomm.jobmanager.clients.get", get_mock_client
+    )
+    @mock.patch(
+        "biokbase.narrative.jobs.jobcomm.JobLogStreamer._start_timer",
+        lambda self, delay: None,
+    )
+    def test_log_stream(self):
+        job_id = "5d64935ab215ad4128de94d6"
+        req = make_comm_msg("start_log_stream", job_id, False, {"first_line": 90})
+        self.jc._handle_comm_message(req)
+        self.jc._handle_comm_message(req)
+        self.assertEqual(2, self.jc._log_streamer.listener_count(job_id))
+        self.jc._log_streamer.poll()
+        msg = self.jc._comm.last_message
+        self.assertEqual("job_log_stream", msg["data"]["msg_type"])
+        content = msg["data"]["content"]
+        self.assertEqual(job_id, content["job_id"])
+        self.assertEqual(90, content["first"])
+        self.assertEqual(100, content["max_lines"])
+        self.assertEqual(10, len(content["lines"]))
+        self.assertIn("This is line 90", content["lines"][0]["line"])
+        # the job is completed, so once all the lines are out, the stream's done
+        self.assertTrue(content["finished"])
+        self.assertEqual([], self.jc._log_streamer.streaming_jobs())
+
+    @mock.patch(
+        "biokbase.narrative.jobs.jobcomm.JobLogStreamer._start_timer",
+        lambda self, delay: None,
+    )
+    def test_stop_log_stream(self):
+        job_id = "5d64935ab215ad4128de94d6"
+        self.jc._handle_comm_message(make_comm_msg("start_log_stream", job_id, False))
+        self.assertEqual([job_id], self.jc._log_streamer.streaming_jobs())
+        self.jc._handle_comm_message(make_comm_msg("stop_log_stream", job_id, False))
+        self.assertEqual([], self.jc._log_streamer.streaming_jobs())
+
+    @mock.patch(
+        "biokbase.narrative.jobs.jobcomm.JobLogStreamer._start_timer",
+        lambda self, delay: None,
+    )
+    def test_log_stream_finishes_without_status_loop(self):
+        running_id = self.job_ids[2]
+        # nothing is listening to the job's status, so the loop isn't looking it up
+        self.jm._running_jobs[running_id]["refresh"] = 0
+        self.assertIsNone(self.jc._lookup_timer)
+        running = {"state": {"job_id": running_id, "status": "running"}}
+        finished = {"state": {"job_id": running_id, "status": "completed"}}
+        lines = [{"is_error": 0, "line": "a line"}]
+        self.jc._handle_comm_message(
+            make_comm_msg("start_log_stream", running_id, False)
+        )
+        with mock.patch.object(
+            self.jc._jm, "get_job_logs", side_effect=[(0, 1, lines), (1, 1, [])]
+        ), mock.patch.object(
+            self.jc._jm,
+            "lookup_job_states",
+            side_effect=[{running_id: running}, {running_id: finished}],
+        ) as lookup:
+            self.jc._log_streamer.poll()
+            self.assertEqual([running_id], self.jc._log_streamer.streaming_jobs())
+            self.assertFalse(self.jc._comm.last_message["data"]["content"]["finished"])
+            self.jc._log_streamer._streams[running_id]["next_poll"] = 0
+            self.jc._log_streamer.poll()
+            lookup.assert_called_with([running_id])
+        # the job finished, so the stream did too
+        msg = self.jc._comm.last_message["data"]
+        self.assertEqual("job_log_stream", msg["msg_type"])
+        self.assertTrue(msg["content"]["finished"])
+        self.assertEqual([], self.jc._log_streamer.streaming_jobs())
+
+    def test_log_stream_bad_job(self):
+        job_id = "bad_job"
+        req = make_comm_msg("start_log_stream", job_id, False)
+        with self.assertRaises(ValueError) as e:
+            self.jc._handle_comm_message(req)
+        self.assertIn(f"No job present with id {job_id}", str(e.exception))
+        msg = self.jc._comm.last_message
+        self.assertEqual("job_does_not_exist", msg["data"]["msg_type"])
+        self.assertEqual([], self.jc._log_streamer.streaming_jobs())
+
 
 class JobRequestTestCase(unittest.TestCase):
     """
@@ -1,14 +1,22 @@
 """
 Tests for job management
 """
+import threading
+import time
 import unittest
 from unittest import mock
 import biokbase.narrative.jobs.jobmanager
 from biokbase.narrative.jobs.job import Job
 from .util import TestConfig
 import os
+import tempfile
 from IPython.display import HTML
-from .narrative_mock.mockclients import get_mock_client, get_failing_mock_client
+from .narrative_mock.mockclients import (
+    get_mock_client,
+    get_failing_mock_client,
+    MockClients,
+)
+from biokbase.workspace.baseclient import ServerError
 from biokbase.narrative.exception_util import NarrativeException
 
 __author__ = "Bill Riehl <wjriehl@lbl.gov>"
@@ -34,6 +42,31 @@ def create_jm_message(r_type, job_id=None, data={}):
     return {"content": {"data": data}}
 
 
+class ChunkedMockClient(MockClients):
+    """
+    Records the job ids sent with each check_jobs call, and fails calls that include
+    any job id in fail_ids, up to fail_times times each.
+    """
+
+    def __init__(self, calls, fail_ids=None, fail_times=0):
+        super().__init__()
+        self.calls = calls
+        self.fail_ids = fail_ids or []
+        self.fail_times = fail_times
+
+    def check_jobs(self, params):
+        self.calls.append(params["job_ids"])
+        failed = [
+            job_id
+            for job_id in params["job_ids"]
+            if job_id in self.fail_ids
+            and sum(job_id in call for call in self.calls) <= self.fail_times
+        ]
+        if failed:
+            raise ServerError("JSONRPCError", -32000, "Job lookup failed.")
+        return super().check_jobs(params)
+
+
 class JobManagerTest(unittest.TestCase):
     @classmethod
     @mock.patch("biokbase.narrative.jobs.jobmanager.clients.get", get_mock_client)
@@ -110,6 +143,308 @@ class JobManagerTest(unittest.TestCase):
         states = self.jm.lookup_all_job_states(ignore_refresh_flag=True)
         self.assertEqual(len(states), 3)
 
+    def test_get_job_ids(self):
+        self.assertCountEqual(self.job_ids, self.jm.get_job_ids())
+        # the completed job has no listeners after initializing
+        self.assertCountEqual(
+            self.job_ids[1:], self.jm.get_job_ids(refreshing_only=True)
+        )
+
+    def test_job_group(self):
+        for idx in [1, 0, 2]:
+            job = Job(
+                "bulk_job_{}".format(idx),
+                "NarrativeTest/test_editor",
+                [],
+                "kbasetest",
+                meta={"bulk_group_id": "some_group", "bulk_index": idx, "bulk_size": 3},
+            )
+            self.jm.register_new_job(job)
+        job_ids = ["bulk_job_0", "bulk_job_1", "bulk_job_2"]
+        self.assertEqual(self.jm.get_job_group("some_group"), job_ids)
+        self.assertEqual(self.jm.get_job_group("other_group"), [])
+
+        states = {
+            "bulk_job_0": {"state": {"status": "completed"}},
+            "bulk_job_1": {"state": {"status": "running"}},
+        }
+        with mock.patch.object(self.jm, "lookup_job_states", return_value=states):
+            group_state = self.jm.lookup_job_group_state("some_group")
+        self.assertEqual(group_state["job_ids"], job_ids)
+        self.assertEqual(group_state["size"], 3)
+        self.assertEqual(
+            group_state["status_counts"], {"completed": 1, "running": 1, "unknown": 1}
+        )
+        self.assertEqual(group_state["finished"], 1)
+        self.assertEqual(group_state["job_states"], states)
+
+        with self.assertRaises(ValueError) as e:
+            self.jm.lookup_job_group_state("other_group")
+        self.assertIn("No jobs present in group other_group", str(e.exception))
+
+        # chunked runs from a generator don't know their size up front
+        job = Job(
+            "chunked_job_0",
+            "NarrativeTest/test_editor",
+            [],
+            "kbasetest",
+            meta={"bulk_group_id": "chunked_group", "bulk_index": 0, "bulk_size": None},
+        )
+        self.jm.register_new_job(job)
+        with mock.patch.object(self.jm, "lookup_job_states", return_value={}):
+            self.assertEqual(self.jm.lookup_job_group_state("chunked_group")["size"], 1)
+
+    @mock.patch("biokbase.narrative.jobs.jobmanager.clients.get", get_mock_client)
+    def test_job_state_cache(self):
+        # the first job is completed, so its state gets cached
+        job_id = self.job_ids[0]
+        self.jm._completed_job_states.remove(job_id)
+        before = self.jm.get_job_state_cache_stats()
+        state = self.jm.lookup_job_states([job_id])[job_id]
+        self.assertEqual(state, self.jm.lookup_job_states([job_id])[job_id])
+        after = self.jm.get_job_state_cache_stats()
+        self.assertEqual(after["misses"], before["misses"] + 1)
+        self.assertEqual(after["hits"], before["hits"] + 1)
+
+    @mock.patch("biokbase.narrative.jobs.jobmanager.clients.get", get_mock_client)
+    def test_finished_job_invalidates_refs(self):
+        # a job that finishes may have saved new versions of named objects
+        job_id = self.job_ids[0]
+        self.jm._completed_job_states.remove(job_id)
+        self.jm._snapshot_job_states.pop(job_id, None)
+        with mock.patch(
+            "biokbase.narrative.jobs.jobmanager.invalidate_resolved_refs"
+        ) as invalidate:
+            self.jm.lookup_job_states(self.job_ids[1:])
+            invalidate.assert_not_called()
+            self.jm.lookup_job_states([job_id])
+            invalidate.assert_called_once()
+            # already known to be finished
+            self.jm.lookup_job_states([job_id])
+            invalidate.assert_called_once()
+
+    def test_initialize_jobs_snapshot(self):
+        calls = list()
+
+        class SnapshotMockClient(MockClients):
+            def check_workspace_jobs(self, params):
+                calls.append(("check_workspace_jobs", params))
+                return super().check_workspace_jobs(params)
+
+            def check_jobs(self, params):
+                calls.append(("check_jobs", params))
+                return super().check_jobs(params)
+
+        def get_client(client_name, token=None):
+            return SnapshotMockClient()
+
+        completed_id = self.job_ids[0]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.jm.configure_job_snapshot(os.path.join(tmp_dir, "jobs.db"))
+            try:
+                with mock.patch(
+                    "biokbase.narrative.jobs.jobmanager.clients.get", get_client
+                ):
+                    # first time, nothing's in the snapshot
+                    self.jm.initialize_jobs()
+                    self.assertEqual(1, len(calls))
+                    self.assertEqual(
+                        biokbase.narrative.jobs.jobmanager.JOB_INIT_EXCLUDED_JOB_STATE_FIELDS,
+                        calls[0][1]["exclude_fields"],
+                    )
+                    first_jobs = {
+                        job_id: self.jm.get_job(job_id).inputs
+                        for job_id in self.job_ids
+                    }
+
+                    # second time, everything comes from the snapshot
+                    calls.clear()
+                    self.jm.initialize_jobs()
+                    self.assertEqual(1, len(calls))
+                    self.assertEqual(
+                        biokbase.narrative.jobs.jobmanager.EXCLUDED_JOB_STATE_FIELDS,
+                        calls[0][1]["exclude_fields"],
+                    )
+                    for job_id in self.job_ids:
+                        self.assertEqual(
+                            first_jobs[job_id], self.jm.get_job(job_id).inputs
+                        )
+
+                    # parameters that got fetched are kept in the snapshot
+                    self.jm._load_job_parameters([completed_id])
+                    calls.clear()
+                    self.jm.initialize_jobs()
+                    self.assertEqual(
+                        job_info[completed_id]["job_input"]["params"],
+                        self.jm.get_job(completed_id).inputs,
+                    )
+                    self.jm.lookup_job_info(completed_id)
+                    self.assertEqual(1, len(calls))
+
+                    # and the completed job's state doesn't need a lookup
+                    calls.clear()
+                    self.jm._completed_job_states.remove(completed_id)
+                    state = self.jm.lookup_job_states([completed_id])
+                    self.assertEqual(
+                        "completed", state[completed_id]["state"]["status"]
+                    )
+                    self.assertEqual([], calls)
+            finally:
+                self.jm.configure_job_snapshot(None)
+
+    @mock.patch("biokbase.narrative.jobs.jobmanager.clients.get", get_mock_client)
+    def test_initialize_jobs_lazy_parameters(self):
+        # the job listing leaves out parameters, but has the app and cell info
+        for job_id in self.job_ids:
+            job = self.jm.get_job(job_id)
+            self.assertIsNone(job.inputs)
+            self.assertEqual(job_info[job_id]["job_input"]["app_id"], job.app_id)
+        completed_id = self.job_ids[0]
+        expected = job_info[completed_id]["job_input"]["params"]
+        self.assertEqual(expected, self.jm.lookup_job_info(completed_id)["job_params"])
+        job_id = self.job_ids[1]
+        self.assertEqual(
+            job_info[job_id]["job_input"]["params"],
+            self.jm.get_job(job_id).parameters(),
+        )
+
+    @mock.patch("biokbase.narrative.jobs.jobmanager.clients.get", get_mock_client)
+    def test_load_job_parameters(self):
+        completed_id = self.job_ids[0]
+        self.jm._load_job_parameters(self.job_ids)
+        expected = job_info[completed_id]["job_input"]["params"]
+        self.assertEqual(expected, self.jm.get_job(completed_id).inputs)
+
+    @mock.patch("biokbase.narrative.jobs.jobmanager.clients.get", get_mock_client)
+    def test_lookup_finished_job_viewer_info(self):
+        completed_id = self.job_ids[0]
+        self.jm._completed_job_states.remove(completed_id)
+        self.jm._snapshot_job_states[completed_id] = dict(
+            self.jm._slim_job_state(job_info[completed_id]),
+            finished=job_info[completed_id]["updated"],
+        )
+        self.assertEqual(0, self.jm._running_jobs[completed_id]["refresh"])
+        # nothing's listening, so no viewer info, and no parameters fetched for it
+        with mock.patch.object(self.jm, "_load_job_parameters") as load_params:
+            state = self.jm.lookup_job_states([completed_id])[completed_id]
+            load_params.assert_called_once_with([])
+        self.assertEqual("completed", state["state"]["status"])
+        self.assertIsNone(state["widget_info"])
+        self.assertIsNone(self.jm._completed_job_states.get(completed_id))
+        self.assertIsNone(self.jm.get_job(completed_id).inputs)
+
+        # once it's opened, it gets its viewer info
+        self.jm.modify_job_refresh(completed_id, 1)
+        state = self.jm.lookup_job_states([completed_id])[completed_id]
+        self.assertIsNotNone(state["widget_info"])
+        self.assertIsNotNone(self.jm.get_job(completed_id).inputs)
+        self.assertEqual(state, self.jm._completed_job_states.get(completed_id))
+
+    def _check_jobs_chunked(self, fail_ids=None, fail_times=0, retries=1):
+        calls = list()
+        self.sleeps = list()
+        this_thread = threading.current_thread()
+        real_sleep = time.sleep
+
+        def sleep(secs):
+            # time.sleep is patched everywhere, so other threads still really wait
+            if threading.current_thread() is this_thread:
+                self.sleeps.append(secs)
+            else:
+                real_sleep(secs)
+
+        def get_client(client_name, token=None):
+            return ChunkedMockClient(calls, fail_ids=fail_ids, fail_times=fail_times)
+
+        self.jm.configure_job_fetching(
+            chunk_size=1, max_workers=2, retries=retries, retry_backoff=0.1
+        )
+        try:
+            with mock.patch(
+                "biokbase.narrative.jobs.jobmanager.clients.get", get_client
+            ), mock.patch("biokbase.narrative.jobs.jobmanager.time.sleep", sleep):
+                states, failed_ids = self.jm._check_jobs(self.job_ids)
+        finally:
+            self.jm.configure_job_fetching(
+                chunk_size=biokbase.narrative.jobs.jobmanager.DEFAULT_CHECK_JOBS_CHUNK_SIZE,
+                max_workers=biokbase.narrative.jobs.jobmanager.DEFAULT_CHECK_JOBS_MAX_WORKERS,
+                retries=biokbase.narrative.jobs.jobmanager.DEFAULT_CHECK_JOBS_RETRIES,
+                retry_backoff=biokbase.narrative.jobs.jobmanager.DEFAULT_CHECK_JOBS_RETRY_BACKOFF,
+            )
+        return states, failed_ids, calls
+
+    def test_check_jobs_chunked(self):
+        states, failed_ids, calls = self._check_jobs_chunked()
+        self.assertCountEqual(self.job_ids, states.keys())
+        self.assertEqual([], failed_ids)
+        self.assertCountEqual([[job_id] for job_id in self.job_ids], calls)
+        self.assertEqual([], self.sleeps)
+
+    def test_check_jobs_retry(self):
+        states, failed_ids, calls = self._check_jobs_chunked(
+            fail_ids=[self.job_ids[0]], fail_times=1
+        )
+        self.assertCountEqual(self.job_ids, states.keys())
+        self.assertEqual([], failed_ids)
+        # the failed chunk is retried, the others aren't
+        self.assertEqual(len(self.job_ids) + 1, len(calls))
+        self.assertEqual([0.1], self.sleeps)
+
+    def test_check_jobs_partial_fail(self):
+        states, failed_ids, calls = self._check_jobs_chunked(
+            fail_ids=[self.job_ids[0]], fail_times=5, retries=2
+        )
+        self.assertCountEqual(self.job_ids[1:], states.keys())
+        self.assertEqual([self.job_ids[0]], failed_ids)
+        self.assertEqual(len(self.job_ids) + 2, len(calls))
+        # the wait doubles for each retry
+        self.assertEqual([0.1, 0.2], self.sleeps)
+
+    def test_lookup_job_states_check_fail(self):
+        # jobs that can't be looked up get an error state, which isn't cached
+        failing_id = self.job_ids[1]
+
+        def get_client(client_name, token=None):
+            return ChunkedMockClient(list(), fail_ids=[failing_id], fail_times=5)
+
+        self.jm.configure_job_fetching(chunk_size=1, retries=0)
+        try:
+            with mock.patch(
+                "biokbase.narrative.jobs.jobmanager.clients.get", get_client
+            ):
+                states = self.jm.lookup_job_states(self.job_ids[1:])
+        finally:
+            self.jm.configure_job_fetching(
+                chunk_size=biokbase.narrative.jobs.jobmanager.DEFAULT_CHECK_JOBS_CHUNK_SIZE,
+                retries=biokbase.narrative.jobs.jobmanager.DEFAULT_CHECK_JOBS_RETRIES,
+            )
+        self.assertCountEqual(self.job_ids[1:], states.keys())
+        self.assertEqual("error", states[failing_id]["state"]["status"])
+        self.assertEqual(
+            "Unable to return job state", states[failing_id]["state"]["errormsg"]
+        )
+        self.assertNotEqual("error", states[self.job_ids[2]]["state"]["status"])
+        self.assertIsNone(self.jm._completed_job_states.get(failing_id))
+
+    @mock.patch(
+        "biokbase.narrative.jobs.jobmanager.clients.get", get_failing_mock_client
+    )
+    def test_check_jobs_fail(self):
+        with self.assertRaises(ServerError):
+            self.jm._check_jobs(self.job_ids)
+
+    def test_configure_job_fetching_bad(self):
+        bad_configs = [
+            ({"chunk_size": 0}, "check_jobs chunk size must be at least 1"),
+            ({"max_workers": 0}, "check_jobs max workers must be at least 1"),
+            ({"retries": -1}, "check_jobs retries must not be negative"),
+            ({"retry_backoff": -1}, "check_jobs retry backoff must not be negative"),
+        ]
+        for config, err in bad_configs:
+            with self.assertRaises(ValueError) as e:
+                self.jm.configure_job_fetching(**config)
+            self.assertIn(err, str(e.exception))
+
     # @mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', get_mock_client)
     # def test_job_status_fetching(self):
     #     self.jm._handle_comm_message(create_jm_message("all_status"))
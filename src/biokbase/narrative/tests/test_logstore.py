@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+from biokbase.narrative.jobs.logstore import JobLogStore, configure_log_spill
+
+
+def make_lines(first_line, num_lines):
+    return [
+        {"is_error": 0, "line": f"line {i}"}
+        for i in range(first_line, first_line + num_lines)
+    ]
+
+
+class JobLogStoreTestCase(unittest.TestCase):
+    def test_add_get_lines(self):
+        store = JobLogStore(page_size=10)
+        store.add_lines(0, make_lines(0, 25))
+        self.assertEqual(25, store.total_lines)
+        self.assertEqual(make_lines(5, 15), store.get_lines(5, 20))
+        self.assertEqual(make_lines(0, 25), store.get_lines(0, 25))
+        self.assertEqual([], store.get_lines(10, 10))
+        self.assertIsNone(store.first_missing(0, 25))
+
+    def test_sparse_lines(self):
+        store = JobLogStore(page_size=10)
+        store.add_lines(95, make_lines(95, 5))
+        self.assertEqual(100, store.total_lines)
+        self.assertEqual(make_lines(95, 5), store.get_lines(95, 100))
+        self.assertEqual([None] * 3 + make_lines(95, 2), store.get_lines(92, 97))
+        self.assertEqual(92, store.first_missing(92, 100))
+        self.assertIsNone(store.first_missing(95, 100))
+        # only the page with the tail is in memory
+        self.assertEqual(10, store.memory_lines())
+
+    def test_spill_to_segment(self):
+        with tempfile.TemporaryDirectory() as segment_dir:
+            store = JobLogStore(
+                page_size=10, segment_dir=segment_dir, max_memory_lines=20
+            )
+            store.add_lines(0, make_lines(0, 55))
+            self.assertLessEqual(store.memory_lines(), 20)
+            self.assertEqual(1, len(os.listdir(segment_dir)))
+            # spilled pages get read back
+            self.assertEqual(make_lines(0, 55), store.get_lines(0, 55))
+            store.close()
+            self.assertEqual([], os.listdir(segment_dir))
+            self.assertEqual(0, store.total_lines)
+
+    def test_configure_log_spill(self):
+        with tempfile.TemporaryDirectory() as segment_dir:
+            configure_log_spill(segment_dir=segment_dir, max_memory_lines=2000)
+            try:
+                store = JobLogStore()
+                self.assertEqual(segment_dir, store.segment_dir)
+                self.assertEqual(2000, store.max_memory_lines)
+            finally:
+                configure_log_spill(segment_dir=None, max_memory_lines=100000)
+        with self.assertRaises(ValueError) as e:
+            configure_log_spill(max_memory_lines=10)
+        self.assertIn("Log max memory lines must be at least", str(e.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
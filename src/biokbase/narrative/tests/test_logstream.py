@@ -0,0 +1,141 @@
+import threading
+import unittest
+from unittest import mock
+from biokbase.narrative.jobs.logstream import JobLogStreamer
+from .test_scheduler import FakeClock
+
+
+class FakeLog:
+    def __init__(self, num_lines=0):
+        self.lines = [f"line {i}" for i in range(num_lines)]
+        self.fetches = list()
+        self.sent = list()
+        self.finished = False
+        self.fail = False
+
+    def add_lines(self, num_lines):
+        start = len(self.lines)
+        self.lines += [f"line {i}" for i in range(start, start + num_lines)]
+
+    def fetch(self, job_id, first_line):
+        self.fetches.append((job_id, first_line))
+        if self.fail:
+            raise Exception("Can't get job logs")
+        return (len(self.lines), self.lines[first_line:])
+
+    def send(self, job_id, first_line, num_available, lines, finished):
+        self.sent.append((job_id, first_line, num_available, lines, finished))
+
+    def is_finished(self, job_id):
+        return self.finished
+
+
+@mock.patch.object(JobLogStreamer, "_start_timer", lambda self, delay: None)
+class JobLogStreamerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.log = FakeLog(5)
+        self.streamer = JobLogStreamer(
+            self.log.fetch,
+            self.log.send,
+            self.log.is_finished,
+            min_interval=1,
+            max_interval=8,
+            backoff_factor=2,
+            max_batch_lines=3,
+            clock=self.clock,
+        )
+
+    def test_stream_batches(self):
+        self.streamer.start_stream("job")
+        self.assertEqual(1, self.streamer.poll())
+        self.assertEqual(
+            [("job", 0, 5, ["line 0", "line 1", "line 2"], False)], self.log.sent
+        )
+        # not due yet
+        self.streamer.poll()
+        self.assertEqual(1, len(self.log.sent))
+        self.clock.advance(1)
+        self.streamer.poll()
+        self.assertEqual(("job", 3, 5, ["line 3", "line 4"], False), self.log.sent[-1])
+        self.assertEqual([("job", 0), ("job", 3)], self.log.fetches)
+
+    def test_stream_first_line(self):
+        self.streamer.start_stream("job", first_line=4)
+        self.streamer.poll()
+        self.assertEqual([("job", 4, 5, ["line 4"], False)], self.log.sent)
+
+    def test_backoff(self):
+        self.streamer.start_stream("job", first_line=5)
+        delays = [self.streamer.poll()]
+        for _ in range(4):
+            self.clock.advance(delays[-1])
+            delays.append(self.streamer.poll())
+        self.assertEqual([2, 4, 8, 8, 8], delays)
+        self.assertEqual([], self.log.sent)
+        # new lines bring it back to the minimum
+        self.log.add_lines(2)
+        self.clock.advance(8)
+        self.assertEqual(1, self.streamer.poll())
+        self.assertEqual([("job", 5, 7, ["line 5", "line 6"], False)], self.log.sent)
+
+    def test_shared_stream(self):
+        self.streamer.start_stream("job")
+        self.streamer.start_stream("job", first_line=2)
+        self.assertEqual(2, self.streamer.listener_count("job"))
+        self.streamer.poll()
+        self.assertEqual([("job", 0)], self.log.fetches)
+        self.streamer.stop_stream("job")
+        self.assertEqual(["job"], self.streamer.streaming_jobs())
+        self.streamer.stop_stream("job")
+        self.assertEqual([], self.streamer.streaming_jobs())
+        self.assertIsNone(self.streamer.poll())
+
+    def test_finished_job(self):
+        self.streamer.start_stream("job")
+        self.log.finished = True
+        self.streamer.poll()
+        self.clock.advance(1)
+        self.streamer.poll()
+        self.assertEqual(("job", 3, 5, ["line 3", "line 4"], True), self.log.sent[-1])
+        self.assertEqual([], self.streamer.streaming_jobs())
+
+    def test_fetch_error(self):
+        self.streamer.start_stream("job")
+        self.log.fail = True
+        self.assertEqual(2, self.streamer.poll())
+        self.assertEqual([], self.log.sent)
+        self.assertEqual(["job"], self.streamer.streaming_jobs())
+
+    def test_stop_while_fetching(self):
+        # the lock isn't held while fetching, so another thread can stop the stream
+        def fetch(job_id, first_line):
+            stopper = threading.Thread(target=self.streamer.stop_stream, args=[job_id])
+            stopper.start()
+            stopper.join(timeout=5)
+            self.assertFalse(stopper.is_alive())
+            return self.log.fetch(job_id, first_line)
+
+        self.streamer._fetch_logs = fetch
+        self.streamer.start_stream("job")
+        self.assertIsNone(self.streamer.poll())
+        self.assertEqual([("job", 0)], self.log.fetches)
+        self.assertEqual([], self.log.sent)
+
+    def test_bad_config(self):
+        bad_configs = [
+            ({"min_interval": 0}, "Log stream intervals must be greater than 0"),
+            ({"max_interval": 0.5}, "with the maximum at least the minimum"),
+            ({"backoff_factor": 0.5}, "Log stream backoff factor must be at least 1"),
+            ({"max_batch_lines": 0}, "Log stream batch size must be at least 1"),
+        ]
+        for config, err in bad_configs:
+            with self.assertRaises(ValueError) as e:
+                JobLogStreamer(
+                    self.log.fetch, self.log.send, self.log.is_finished, **config
+                )
+            self.assertIn(err, str(e.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
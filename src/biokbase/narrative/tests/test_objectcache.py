@@ -0,0 +1,327 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import biokbase.narrative.magics as magics
+from biokbase.narrative.objectcache import (
+    ObjectCache,
+    RefResolver,
+    get_object_cache,
+    get_ref_resolver,
+    is_immutable_ref,
+)
+from .test_scheduler import FakeClock
+
+
+def make_info(upa, name="some_object"):
+    (ws_id, obj_id, ver) = [int(i) for i in upa.split("/")]
+    return [
+        obj_id,
+        name,
+        "KBaseGenomes.Genome-1.0",
+        "",
+        ver,
+        "",
+        ws_id,
+        "ws",
+        "",
+        1,
+        None,
+    ]
+
+
+class CountingWorkspace:
+    """
+    Resolves anything that isn't a UPA to 1/2/3, and counts calls.
+    """
+
+    def __init__(self):
+        self.info_calls = list()
+        self.info3_calls = list()
+        self.data_calls = list()
+
+    def _upa(self, ref):
+        ref = ref.split(";")[-1]
+        return ref if is_immutable_ref(ref) else "1/2/3"
+
+    def _info(self, obj_ident):
+        if obj_ident.get("name") == "missing":
+            return None
+        return make_info(self._upa(obj_ident.get("ref", obj_ident.get("name"))))
+
+    def get_object_info_new(self, params):
+        self.info_calls.append(params)
+        infos = [self._info(o) for o in params["objects"]]
+        if None in infos:
+            raise ValueError("Object missing cannot be accessed")
+        return infos
+
+    def get_object_info3(self, params):
+        self.info3_calls.append(params)
+        return {"infos": [self._info(o) for o in params["objects"]]}
+
+    def get_objects2(self, params):
+        self.data_calls.append(params)
+        return {
+            "data": [
+                {"data": {"ref": o["ref"]}, "info": make_info(self._upa(o["ref"]))}
+                for o in params["objects"]
+            ]
+        }
+
+
+class ObjectCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ws = CountingWorkspace()
+        self.clock = FakeClock()
+        self.cache = ObjectCache(info_max_age=60, clock=self.clock)
+        patcher = mock.patch(
+            "biokbase.narrative.objectcache.clients.get", lambda *args: self.ws
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_is_immutable_ref(self):
+        for ref in ["1/2/3", "1/2/3;4/5/6"]:
+            self.assertTrue(is_immutable_ref(ref))
+        for ref in ["1/2", "ws/obj/3", "1/2/3;4/5", "foo", None]:
+            self.assertFalse(is_immutable_ref(ref))
+
+    def test_object_info(self):
+        infos = self.cache.get_object_info(["4/5/6", "7/8/9"])
+        self.assertEqual(infos, [make_info("4/5/6"), make_info("7/8/9")])
+        self.assertEqual(self.cache.get_object_info(["7/8/9", "4/5/6"]), infos[::-1])
+        self.assertEqual(len(self.ws.info_calls), 1)
+
+        # only the missing one gets looked up
+        self.cache.get_object_info(["4/5/6", "10/11/12"])
+        self.assertEqual(len(self.ws.info_calls), 2)
+        self.assertEqual(self.ws.info_calls[1]["objects"], [{"ref": "10/11/12"}])
+
+        # info with metadata is kept apart
+        self.cache.get_object_info(["4/5/6"], include_metadata=True)
+        self.assertEqual(len(self.ws.info_calls), 3)
+        self.assertEqual(self.ws.info_calls[2]["includeMetadata"], 1)
+
+    def test_object_info_expires(self):
+        self.cache.get_object_info(["4/5/6"])
+        self.clock.advance(61)
+        self.cache.get_object_info(["4/5/6"])
+        self.assertEqual(len(self.ws.info_calls), 2)
+
+    def test_mutable_refs_bypass(self):
+        for ref in ["ws/obj", "ws/obj/3", "4/5"]:
+            self.cache.get_object_info([ref])
+            self.cache.get_object_info([ref])
+            self.cache.get_objects([ref])
+            self.cache.get_objects([ref])
+        self.assertEqual(len(self.ws.info_calls), 6)
+        self.assertEqual(len(self.ws.data_calls), 6)
+        # but what they resolved to gets cached by UPA
+        self.cache.get_object_info(["1/2/3"])
+        self.cache.get_objects(["1/2/3"])
+        self.assertEqual(len(self.ws.info_calls), 6)
+        self.assertEqual(len(self.ws.data_calls), 6)
+
+    def test_objects(self):
+        objs = self.cache.get_objects(["4/5/6", "4/5/6;7/8/9"])
+        self.assertEqual(objs[1]["data"], {"ref": "4/5/6;7/8/9"})
+        self.assertEqual(self.cache.get_objects(["4/5/6;7/8/9"]), objs[1:])
+        self.assertEqual(len(self.ws.data_calls), 1)
+        stats = self.cache.stats()
+        self.assertEqual(stats["data"]["hits"], 1)
+        self.assertEqual(stats["data"]["entries"], 2)
+
+    def test_object_sizes(self):
+        # sizes come from the object info, or a share of the response, without
+        # serializing the objects again
+        with mock.patch(
+            "biokbase.narrative.common.lrucache.json.dumps"
+        ) as dumps, mock.patch(
+            "biokbase.narrative.objectcache.clients.get_call_stats",
+            return_value={"response_bytes": 1000},
+        ):
+            self.cache.get_objects(["4/5/6", "7/8/9"])
+            self.assertEqual(self.cache.stats()["data"]["bytes"], 2)
+
+            self.ws.get_objects2 = lambda params: {
+                "data": [{"data": {}, "info": None} for o in params["objects"]]
+            }
+            self.cache.get_objects(["1/1/1", "1/1/2"])
+            self.assertEqual(self.cache.stats()["data"]["bytes"], 1002)
+            dumps.assert_not_called()
+
+    def test_spill(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            self.cache.configure(data_max_entries=1, spill_dir=spill_dir)
+            self.cache.get_objects(["4/5/6"])
+            self.cache.get_objects(["7/8/9"])
+            self.assertEqual(
+                os.listdir(os.path.join(spill_dir, "data")), ["4%2F5%2F6.json"]
+            )
+            self.assertEqual(
+                self.cache.get_objects(["4/5/6"])[0]["data"], {"ref": "4/5/6"}
+            )
+            self.assertEqual(len(self.ws.data_calls), 2)
+            self.assertEqual(self.cache.stats()["data"]["spill_hits"], 1)
+
+    def test_clear(self):
+        self.cache.get_objects(["4/5/6"])
+        self.cache.clear()
+        self.cache.get_objects(["4/5/6"])
+        self.assertEqual(len(self.ws.data_calls), 2)
+
+    @mock.patch("biokbase.narrative.magics.biokbase.auth")
+    def test_token_change(self, auth):
+        cache = get_object_cache()
+        self.addCleanup(cache.clear)
+        with tempfile.TemporaryDirectory() as spill_dir:
+            cache.configure(data_max_entries=1, spill_dir=spill_dir)
+            self.addCleanup(
+                cache.configure,
+                data_max_entries=self.cache._data.max_entries,
+                spill_dir="",
+            )
+            cache.get_objects(["4/5/6", "7/8/9"])
+            cache.get_object_info(["4/5/6"])
+            self.assertEqual(len(os.listdir(os.path.join(spill_dir, "data"))), 1)
+
+            # nothing fetched with one user's token gets used with another's
+            magics.set_token("other_token")
+            self.assertEqual(os.listdir(os.path.join(spill_dir, "data")), [])
+            self.assertIsNone(cache.cached_object_info("4/5/6"))
+            cache.get_objects(["4/5/6", "7/8/9"])
+            self.assertEqual(len(self.ws.data_calls), 2)
+
+            magics.clear_token()
+            self.assertEqual(cache.stats()["data"]["entries"], 0)
+            self.assertEqual(os.listdir(os.path.join(spill_dir, "data")), [])
+
+    def test_configure_bad(self):
+        with self.assertRaises(ValueError) as e:
+            self.cache.configure(info_max_age=-1)
+        self.assertIn("max age must not be negative", str(e.exception))
+        with self.assertRaises(ValueError) as e:
+            self.cache.configure(data_max_bytes=0)
+        self.assertIn(
+            "Object data cache max bytes must be at least 1", str(e.exception)
+        )
+
+
+class RefResolverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ws = CountingWorkspace()
+        self.clock = FakeClock()
+        self.cache = ObjectCache(clock=self.clock)
+        self.resolver = RefResolver(self.cache, ttl=30, clock=self.clock)
+        patcher = mock.patch(
+            "biokbase.narrative.objectcache.clients.get", lambda *args: self.ws
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_resolve(self):
+        self.assertEqual(self.resolver.resolve("my_ws", "foo"), make_info("1/2/3"))
+        self.assertEqual(
+            self.ws.info_calls[0]["objects"], [{"workspace": "my_ws", "name": "foo"}]
+        )
+        self.resolver.resolve("my_ws", "foo")
+        self.assertEqual(len(self.ws.info_calls), 1)
+        # the same name in another workspace is something else
+        self.resolver.resolve("other_ws", "foo")
+        self.assertEqual(len(self.ws.info_calls), 2)
+        # references don't depend on the workspace
+        self.resolver.resolve("my_ws", "ws/foo")
+        self.resolver.resolve("other_ws", "ws/foo")
+        self.assertEqual(self.ws.info_calls[2]["objects"], [{"ref": "ws/foo"}])
+        self.assertEqual(len(self.ws.info_calls), 3)
+
+    def test_resolve_expires(self):
+        self.resolver.resolve("my_ws", "foo")
+        self.clock.advance(31)
+        self.resolver.resolve("my_ws", "foo")
+        self.assertEqual(len(self.ws.info_calls), 2)
+
+    def test_resolve_upa(self):
+        self.resolver.resolve("my_ws", "4/5/6")
+        self.assertEqual(self.cache.get_object_info(["4/5/6"]), [make_info("4/5/6")])
+        self.assertEqual(len(self.ws.info_calls), 1)
+
+    def test_resolve_missing(self):
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                self.resolver.resolve("my_ws", "missing")
+        self.assertEqual(len(self.ws.info_calls), 2)
+
+    def test_invalidate(self):
+        self.resolver.resolve("my_ws", "foo")
+        self.resolver.invalidate()
+        self.resolver.resolve("my_ws", "foo")
+        self.assertEqual(len(self.ws.info_calls), 2)
+
+    @mock.patch("biokbase.narrative.magics.biokbase.auth")
+    def test_token_change(self, auth):
+        resolver = get_ref_resolver()
+        self.addCleanup(resolver.invalidate)
+        resolver.resolve("my_ws", "foo")
+        magics.set_token("other_token")
+        resolver.resolve("my_ws", "foo")
+        self.assertEqual(len(self.ws.info_calls), 2)
+        magics.clear_token()
+        resolver.resolve("my_ws", "foo")
+        self.assertEqual(len(self.ws.info_calls), 3)
+
+    def test_resolve_all(self):
+        self.resolver.resolve("my_ws", "foo")
+        self.resolver.resolve_all(
+            "my_ws", ["foo", "bar", "bar", "4/5/6", "ws/baz", "missing", None, 5]
+        )
+        self.assertEqual(len(self.ws.info3_calls), 1)
+        self.assertEqual(
+            self.ws.info3_calls[0]["objects"],
+            [
+                {"workspace": "my_ws", "name": "bar"},
+                {"ref": "4/5/6"},
+                {"ref": "ws/baz"},
+                {"workspace": "my_ws", "name": "missing"},
+            ],
+        )
+        self.assertEqual(self.ws.info3_calls[0]["ignoreErrors"], 1)
+        for value in ["bar", "4/5/6", "ws/baz"]:
+            self.resolver.resolve("my_ws", value)
+        self.assertEqual(len(self.ws.info_calls), 1)
+        with self.assertRaises(ValueError):
+            self.resolver.resolve("my_ws", "missing")
+
+        # nothing new, nothing looked up
+        self.resolver.resolve_all("my_ws", ["foo", "bar"])
+        self.assertEqual(len(self.ws.info3_calls), 1)
+
+    def test_resolve_all_error(self):
+        # if the whole lookup fails, each value gets looked up on its own
+        with mock.patch.object(
+            self.ws, "get_object_info3", side_effect=ValueError("bad ref")
+        ):
+            self.resolver.resolve_all("my_ws", ["foo", "missing", "ws/bar"])
+        self.assertEqual(
+            sorted(c["objects"][0].get("name", "") for c in self.ws.info_calls),
+            ["", "foo", "missing"],
+        )
+        self.resolver.resolve("my_ws", "foo")
+        self.resolver.resolve("my_ws", "ws/bar")
+        self.assertEqual(len(self.ws.info_calls), 3)
+        with self.assertRaises(ValueError):
+            self.resolver.resolve("my_ws", "missing")
+
+    def test_no_ttl(self):
+        self.resolver.configure(ttl=0)
+        self.resolver.resolve("my_ws", "foo")
+        self.resolver.resolve("my_ws", "foo")
+        self.assertEqual(len(self.ws.info_calls), 2)
+        with self.assertRaises(ValueError) as e:
+            self.resolver.configure(ttl=-1)
+        self.assertIn("TTL must not be negative", str(e.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
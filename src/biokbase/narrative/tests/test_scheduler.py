@@ -0,0 +1,142 @@
+import unittest
+from biokbase.narrative.jobs.scheduler import JobPollScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class JobPollSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sched = JobPollScheduler(
+            base_interval=10,
+            changed_interval=2,
+            backoff_factor=2,
+            max_interval=30,
+            coalesce_window=1,
+            clock=self.clock,
+        )
+
+    def test_new_jobs_are_due(self):
+        self.sched.sync_jobs(["b", "a"])
+        self.assertEqual(self.sched.due_jobs(), ["a", "b"])
+        self.assertEqual(self.sched.seconds_until_next_poll(), 0)
+
+    def test_empty_schedule(self):
+        self.assertEqual(self.sched.due_jobs(), [])
+        self.assertIsNone(self.sched.seconds_until_next_poll())
+
+    def test_running_job_base_interval(self):
+        self.sched.add_job("a")
+        self.sched.update("a", "running")
+        self.assertEqual(self.sched.due_jobs(), [])
+        self.assertEqual(self.sched.seconds_until_next_poll(), 10)
+        self.clock.advance(10)
+        self.assertEqual(self.sched.due_jobs(), ["a"])
+
+    def test_queued_job_backoff(self):
+        self.sched.add_job("a")
+        expected = [20, 30, 30]
+        for interval in expected:
+            self.sched.update("a", "queued")
+            self.assertEqual(self.sched.seconds_until_next_poll(), interval)
+
+    def test_changed_job_polled_sooner(self):
+        self.sched.add_job("a")
+        self.sched.update("a", "queued")
+        self.sched.update("a", "queued")
+        self.sched.update("a", "running")
+        self.assertEqual(self.sched.seconds_until_next_poll(), 2)
+        # after the change, back to the normal rate
+        self.sched.update("a", "running")
+        self.assertEqual(self.sched.seconds_until_next_poll(), 10)
+
+    def test_failed_lookup_backoff(self):
+        self.sched.add_job("a")
+        self.sched.update("a", "running")
+        self.sched.update("a", None)
+        self.assertEqual(self.sched.seconds_until_next_poll(), 20)
+
+    def test_terminal_jobs_never_polled(self):
+        self.sched.sync_jobs(["a", "b"])
+        self.sched.update("a", "completed")
+        self.assertNotIn("a", self.sched)
+        self.assertTrue(self.sched.is_finished("a"))
+        # re-syncing doesn't reschedule it
+        self.sched.sync_jobs(["a", "b"])
+        self.assertEqual(self.sched.due_jobs(), ["b"])
+        self.sched.poll_now("a")
+        self.assertEqual(self.sched.due_jobs(), ["b"])
+
+    def test_add_terminal_job(self):
+        self.sched.add_job("a", status="error")
+        self.assertNotIn("a", self.sched)
+        self.assertEqual(len(self.sched), 0)
+
+    def test_sync_drops_jobs(self):
+        self.sched.sync_jobs(["a", "b"])
+        self.sched.update("b", "terminated")
+        self.sched.sync_jobs(["c"])
+        self.assertEqual(self.sched.due_jobs(), ["c"])
+        self.assertFalse(self.sched.is_finished("b"))
+
+    def test_coalesce_due_jobs(self):
+        self.sched.add_job("a")
+        self.sched.add_job("b")
+        self.sched.update("a", "running")
+        self.clock.advance(0.5)
+        self.sched.update("b", "running")
+        self.clock.advance(9.6)
+        # "a" is due, "b" is due within the coalesce window
+        self.assertEqual(self.sched.due_jobs(), ["a", "b"])
+
+    def test_filter_jobs(self):
+        self.sched.sync_jobs(["a", "b", "c"])
+        self.sched.update("a", "running")
+        self.sched.update("c", "completed")
+        self.assertEqual(self.sched.due_jobs(["a", "b", "c", "d"]), ["b"])
+        self.assertEqual(self.sched.seconds_until_next_poll(["a"]), 10)
+        self.assertIsNone(self.sched.seconds_until_next_poll(["c", "d"]))
+        self.assertEqual(self.sched.scheduled_jobs(), ["a", "b"])
+
+    def test_poll_now(self):
+        self.sched.add_job("a")
+        self.sched.update("a", "running")
+        self.sched.poll_now("a")
+        self.assertEqual(self.sched.due_jobs(), ["a"])
+
+    def test_configure(self):
+        self.sched.configure(base_interval=5)
+        self.assertEqual(self.sched.base_interval, 5)
+        self.assertEqual(self.sched.max_interval, 30)
+        self.sched.add_job("a")
+        self.sched.update("a", "running")
+        self.assertEqual(self.sched.seconds_until_next_poll(), 5)
+
+    def test_configure_bad(self):
+        bad_configs = [
+            ({"base_interval": 0}, "Poll intervals must be greater than 0"),
+            ({"backoff_factor": 0.5}, "Poll backoff factor must be at least 1"),
+            (
+                {"max_interval": 5},
+                "Maximum poll interval must be at least the base interval",
+            ),
+            ({"coalesce_window": -1}, "Poll coalesce window must not be negative"),
+        ]
+        for config, err in bad_configs:
+            with self.assertRaises(ValueError) as e:
+                self.sched.configure(**config)
+            self.assertIn(err, str(e.exception))
+        self.assertEqual(self.sched.base_interval, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from biokbase.narrative.jobs.job import Job
+from biokbase.narrative.jobs.snapshot import JobSnapshot, job_to_record
+
+
+def make_job(job_id):
+    return Job(
+        job_id,
+        "NarrativeTest/test_editor",
+        [{"param": "value"}],
+        "kbasetest",
+        tag="dev",
+        app_version="0.0.1",
+        cell_id="some_cell",
+        run_id="some_run",
+        meta={"cell_id": "some_cell"},
+    )
+
+
+class JobSnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "snapshots", "jobs.db")
+        self.snapshot = JobSnapshot(self.path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_load(self):
+        final_state = {"job_id": "job1", "status": "completed"}
+        self.snapshot.save(1, [(make_job("job1"), final_state)])
+        self.snapshot.save(1, [(make_job("job2"), None)])
+        self.snapshot.save(2, [(make_job("job3"), None)])
+
+        jobs = self.snapshot.load(1)
+        self.assertCountEqual(["job1", "job2"], jobs.keys())
+        job, state = jobs["job1"]
+        self.assertEqual(job_to_record(make_job("job1")), job_to_record(job))
+        self.assertEqual(final_state, state)
+        self.assertIsNone(jobs["job2"][1])
+        self.assertEqual({}, self.snapshot.load(3))
+
+    def test_save_state(self):
+        self.snapshot.save(1, [(make_job("job1"), None)])
+        self.snapshot.save_state(1, "job1", {"status": "error"})
+        # not in the snapshot, so nothing happens
+        self.snapshot.save_state(1, "job2", {"status": "error"})
+        jobs = self.snapshot.load(1)
+        self.assertEqual(["job1"], list(jobs.keys()))
+        self.assertEqual({"status": "error"}, jobs["job1"][1])
+
+    def test_update_jobs(self):
+        self.snapshot.save(1, [(make_job("job1"), {"status": "completed"})])
+        job = make_job("job1")
+        job.inputs = [{"some": "params"}]
+        # job2 isn't in the snapshot, so it's skipped
+        self.snapshot.update_jobs(1, [job, make_job("job2")])
+        jobs = self.snapshot.load(1)
+        self.assertEqual(["job1"], list(jobs.keys()))
+        self.assertEqual([{"some": "params"}], jobs["job1"][0].inputs)
+        self.assertEqual({"status": "completed"}, jobs["job1"][1])
+
+    def test_clear(self):
+        self.snapshot.save(1, [(make_job("job1"), None)])
+        self.snapshot.save(2, [(make_job("job2"), None)])
+        self.snapshot.clear(1)
+        self.assertEqual({}, self.snapshot.load(1))
+        self.assertEqual(["job2"], list(self.snapshot.load(2).keys()))
+
+    def test_old_version_dropped(self):
+        self.snapshot.save(1, [(make_job("job1"), None)])
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA user_version = 0")
+        conn.commit()
+        conn.close()
+        self.assertEqual({}, JobSnapshot(self.path).load(1))
+
+
+if __name__ == "__main__":
+    unittest.main()
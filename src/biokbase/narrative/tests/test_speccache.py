@@ -0,0 +1,57 @@
+import gzip
+import os
+import tempfile
+import unittest
+from biokbase.narrative.jobs.speccache import SpecCache, TYPES_KEY
+
+
+class SpecCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "specs")
+        self.cache = SpecCache(self.path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_load(self):
+        specs = [{"info": {"id": "foo/bar"}, "parameters": []}]
+        self.cache.save("ci", "release", "abc123", specs)
+        self.cache.save("ci", TYPES_KEY, "abc123", {"KBaseFBA.FBA": {}})
+        self.assertEqual(("abc123", specs), self.cache.load("ci", "release"))
+        self.assertEqual(
+            ("abc123", {"KBaseFBA.FBA": {}}), self.cache.load("ci", TYPES_KEY)
+        )
+        # other tags and environments are separate
+        self.assertIsNone(self.cache.load("ci", "dev"))
+        self.assertIsNone(self.cache.load("prod", "release"))
+
+        # replacing leaves no temp files around
+        self.cache.save("ci", "release", "def456", [])
+        self.assertEqual(("def456", []), self.cache.load("ci", "release"))
+        self.assertCountEqual(
+            ["release.json.gz", TYPES_KEY + ".json.gz"],
+            os.listdir(os.path.join(self.path, "ci")),
+        )
+
+    def test_load_bad(self):
+        os.makedirs(os.path.join(self.path, "ci"))
+        with open(os.path.join(self.path, "ci", "release.json.gz"), "w") as f:
+            f.write("not gzipped")
+        self.assertIsNone(self.cache.load("ci", "release"))
+        # wrong format version
+        with gzip.open(os.path.join(self.path, "ci", "dev.json.gz"), "wt") as f:
+            f.write('{"format": 0, "version": "abc123", "specs": []}')
+        self.assertIsNone(self.cache.load("ci", "dev"))
+
+    def test_clear(self):
+        self.cache.save("ci", "release", "abc123", [])
+        self.cache.save("prod", "release", "abc123", [])
+        self.cache.clear("ci")
+        self.cache.clear("appdev")
+        self.assertIsNone(self.cache.load("ci", "release"))
+        self.assertEqual(("abc123", []), self.cache.load("prod", "release"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,13 @@
+import tempfile
+import threading
 import unittest
 
 import mock
 
 from biokbase.narrative.jobs.specmanager import SpecManager
-from .narrative_mock.mockclients import get_mock_client
+from biokbase.narrative.jobs.speccache import SpecCache, TYPES_KEY
+from biokbase.narrative.common.util import kbase_env
+from .narrative_mock.mockclients import get_mock_client, MockClients
 
 
 class SpecManagerTestCase(unittest.TestCase):
@@ -19,9 +23,44 @@ class SpecManagerTestCase(unittest.TestCase):
     def tearDownClass(cls):
         cls.sm.reload()
 
+    def _unload(self):
+        """
+        Makes the SpecManager look like nothing's been loaded yet, and puts back what
+        was loaded after the test.
+        """
+        unloaded = {
+            "app_specs": dict(),
+            "type_specs": None,
+            "spec_versions": dict(),
+            "mapping_plans": dict(),
+            "param_indexes": dict(),
+            "search_indexes": dict(),
+            "viewer_indexes": dict(),
+            "_version_thread": None,
+            "_nms_version": None,
+        }
+        state = dict((attr, getattr(self.sm, attr)) for attr in unloaded)
+        for attr, value in unloaded.items():
+            setattr(self.sm, attr, value)
+
+        def restore():
+            for attr, value in state.items():
+                setattr(self.sm, attr, value)
+
+        self.addCleanup(restore)
+
+    @mock.patch("biokbase.narrative.jobs.specmanager.clients.get", get_mock_client)
     def test_apps_present(self):
-        # on startup, should have app_specs
-        self.assertTrue(self.good_tag in self.sm.app_specs)
+        self._unload()
+        self.assertEqual(self.sm.app_specs, {})
+        # only the tag that's needed gets loaded
+        self.assertTrue(self.sm.check_app(self.good_app_id, self.good_tag))
+        self.assertEqual(list(self.sm.app_specs.keys()), [self.good_tag])
+        self.assertIsNone(self.sm.type_specs)
+        # there's no spec cache, so no version to check it against
+        self.assertEqual(self.sm.spec_versions, {self.good_tag: None})
+        with self.assertRaises(ValueError):
+            self.sm.get_app_specs(self.bad_tag)
 
     def test_check_app(self):
         # good id and good tag
@@ -52,6 +91,248 @@ class SpecManagerTestCase(unittest.TestCase):
                 list(self.sm.get_type_spec("KBaseExpression.NU_FBA").keys()),
             )
 
+    @mock.patch("biokbase.narrative.jobs.specmanager.clients.get", get_mock_client)
+    def test_get_mapping_plan(self):
+        self.sm.reload()
+        plan = self.sm.get_mapping_plan(self.good_app_id, self.good_tag)
+        self.assertIs(plan, self.sm.get_mapping_plan(self.good_app_id, self.good_tag))
+        self.assertIs(
+            plan.spec_params,
+            self.sm.get_param_index(self.good_app_id, self.good_tag),
+        )
+        with self.assertRaises(ValueError):
+            self.sm.get_mapping_plan(self.bad_app_id, self.good_tag)
+        self.sm.reload()
+        self.assertIsNot(
+            plan, self.sm.get_mapping_plan(self.good_app_id, self.good_tag)
+        )
+
+    @mock.patch("biokbase.narrative.jobs.specmanager.clients.get", get_mock_client)
+    def test_get_param_index(self):
+        self.sm.reload()
+        spec = self.sm.get_spec(self.good_app_id, self.good_tag)
+        index = self.sm.get_param_index(self.good_app_id, self.good_tag)
+        self.assertIs(index, self.sm.get_param_index(self.good_app_id, self.good_tag))
+        params = self.sm._make_app_params(spec)
+        self.assertEqual(list(index), params)
+        self.assertEqual(list(index.by_id.keys()), [p["id"] for p in params])
+        self.assertEqual(
+            list(index.output_params), [p for p in params if p.get("is_output")]
+        )
+
+        # app_params uses the index for loaded specs, but is still a new list
+        with mock.patch.object(self.sm, "_make_app_params") as make_app_params:
+            app_params = self.sm.app_params(spec)
+            make_app_params.assert_not_called()
+        self.assertEqual(app_params, params)
+        self.assertIsNot(app_params, self.sm.app_params(spec))
+        self.assertIs(app_params[0], index.params[0])
+        # a copy of a spec isn't the loaded one, so it gets its own params
+        self.assertIsNot(self.sm.app_params(dict(spec))[0], index.params[0])
+
+        with self.assertRaises(ValueError):
+            self.sm.get_param_index(self.bad_app_id, self.good_tag)
+        self.sm.reload()
+        self.assertIsNot(
+            index, self.sm.get_param_index(self.good_app_id, self.good_tag)
+        )
+
+    @mock.patch("biokbase.narrative.jobs.specmanager.clients.get", get_mock_client)
+    def test_get_viewer(self):
+        self.sm.reload()
+        self.assertIsNone(self.sm.get_viewer("NotAModule.NotAType"))
+
+        # the mock specs don't have the genome viewer app
+        viewer = self.sm.get_viewer("KBaseGenomes.Genome-14.2")
+        self.assertEqual(viewer.app_id, "NarrativeViewers/view_genome")
+        self.assertIn("Unknown app id", viewer.error)
+        self.assertIsNone(viewer.plan)
+        # the version doesn't matter
+        self.assertIs(viewer, self.sm.get_viewer("KBaseGenomes.Genome"))
+
+        self.sm.reload()
+        ws_type = "KBaseRNASeq.RNASeqAnalysis"
+        with mock.patch.object(
+            self.sm,
+            "get_type_spec",
+            return_value={"view_method_ids": ["view_rnaseq_analysis"]},
+        ) as get_type_spec:
+            viewer = self.sm.get_viewer(ws_type + "-1.0")
+            self.assertIs(viewer, self.sm.get_viewer(ws_type))
+            get_type_spec.assert_called_once_with(ws_type, raise_exception=False)
+        self.assertIsNone(viewer.error)
+        self.assertIs(viewer.plan, self.sm.get_mapping_plan("view_rnaseq_analysis"))
+        self.assertEqual(viewer.object_params, ("param0",))
+        self.assertEqual(viewer.upa_targets, ("output",))
+
+        self.sm.reload()
+        self.assertIsNot(viewer, self.sm.get_viewer(ws_type))
+
+    @mock.patch("biokbase.narrative.jobs.specmanager.clients.get", get_mock_client)
+    def test_search_apps(self):
+        self.sm.reload()
+        results = self.sm.search_apps("metabolic model", tag=self.good_tag)
+        self.assertEqual(
+            [info["id"] for info in results],
+            ["build_a_metabolic_model", "run_flux_balance_analysis"],
+        )
+        self.assertEqual(
+            [
+                info["id"]
+                for info in self.sm.search_apps(
+                    "reads", input_type="KBaseFile.PairedEndLibrary", tag=self.good_tag
+                )
+            ],
+            ["AssemblyRAST/run_arast", "kb_trimmomatic/run_trimmomatic"],
+        )
+        self.assertEqual(
+            self.sm.apps_for_type("KBaseFBA.FBAModel-1.0", tag=self.good_tag),
+            ["NarrativeTest/test_input_params", "run_flux_balance_analysis"],
+        )
+        self.assertEqual(
+            self.sm.apps_for_type("KBaseFBA.FBAModel", tag=self.good_tag, output=True),
+            ["build_a_metabolic_model"],
+        )
+        with self.assertRaises(ValueError):
+            self.sm.search_apps("reads", tag=self.bad_tag)
+
+        # the index is kept until the specs are reloaded
+        index = self.sm.get_search_index(self.good_tag)
+        self.assertIs(index, self.sm.get_search_index(self.good_tag))
+        self.sm.reload()
+        self.assertIsNot(index, self.sm.get_search_index(self.good_tag))
+
+    @mock.patch("biokbase.narrative.jobs.specmanager.clients.get", get_mock_client)
+    def test_search_apps_pages(self):
+        results = self.sm.search_apps("active", tag=self.good_tag, page_size=3)
+        self.assertEqual(len(results), 7)
+        self.assertEqual(results.num_pages, 3)
+        html = results._repr_html_()
+        self.assertIn('7 dev apps found for "active"', html)
+        self.assertIn("Page 1 of 3 (showing 1-3)", html)
+        self.assertIn(results[0]["id"], html)
+        self.assertNotIn(results[3]["id"], html)
+        last = results.page(3)
+        self.assertEqual(list(last), list(results))
+        self.assertIn("Page 3 of 3 (showing 7-7)", last._repr_html_())
+        self.assertEqual(
+            str(last),
+            "7. {} - {}\npage 3 of 3".format(results[6]["id"], results[6]["name"]),
+        )
+        # out of range pages show the last (or first) one
+        self.assertEqual(results.page(10).page_num, 3)
+        self.assertEqual(results.page(0).page_num, 1)
+        with self.assertRaisesRegex(ValueError, "page size must be at least 1"):
+            self.sm.search_apps("active", tag=self.good_tag, page_size=0)
+
+    @mock.patch("biokbase.narrative.jobs.specmanager.clients.get", get_mock_client)
+    def test_refresh(self):
+        self._unload()
+        specs = self.sm.get_app_specs(self.good_tag)
+        fetching = threading.Event()
+        done_fetching = threading.Event()
+        fetch_specs = self.sm._fetch_specs
+
+        def slow_fetch(key, version):
+            fetching.set()
+            done_fetching.wait()
+            return fetch_specs(key, version)
+
+        with mock.patch.object(self.sm, "_fetch_specs", side_effect=slow_fetch):
+            thread = self.sm.refresh()
+            fetching.wait()
+            # one at a time
+            self.assertIs(thread, self.sm.refresh())
+            # still the old specs, and nothing waits for the new ones
+            self.assertIs(self.sm.get_app_specs(self.good_tag), specs)
+            self.assertTrue(self.sm.check_app(self.good_app_id, self.good_tag))
+            done_fetching.set()
+            thread.join()
+        new_specs = self.sm.get_app_specs(self.good_tag)
+        self.assertIsNot(new_specs, specs)
+        self.assertEqual(new_specs, specs)
+        # only the loaded tag gets reloaded
+        self.assertEqual(list(self.sm.app_specs.keys()), [self.good_tag])
+
+    @mock.patch("biokbase.narrative.jobs.specmanager.clients.get", get_mock_client)
+    def test_reload_unloaded(self):
+        # a reload loads every tag, even if nothing's been loaded yet
+        self._unload()
+        self.sm.reload()
+        self.assertCountEqual(self.sm.app_specs.keys(), ["release", "beta", "dev"])
+        self.assertIsNotNone(self.sm.type_specs)
+        with mock.patch.object(MockClients, "list_methods_spec") as list_methods_spec:
+            self.sm.get_app_specs("release")
+            list_methods_spec.assert_not_called()
+
+    @mock.patch("biokbase.narrative.jobs.specmanager.clients.get", get_mock_client)
+    def test_no_spec_cache_version(self):
+        # without a spec cache, the NMS version isn't needed
+        self.sm.configure_spec_cache(None)
+        self.addCleanup(setattr, SpecManager, "_spec_cache_configured", False)
+        self._unload()
+        with mock.patch.object(MockClients, "status") as status:
+            self.sm.get_app_specs(self.good_tag)
+            self.sm.get_type_specs()
+            self.sm.reload()
+            status.assert_not_called()
+        self.assertIsNone(self.sm.spec_versions[self.good_tag])
+
+    @mock.patch("biokbase.narrative.jobs.specmanager.clients.get", get_mock_client)
+    def test_spec_cache(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.sm.configure_spec_cache(tmp_dir.name)
+        self.addCleanup(self.sm.configure_spec_cache, None)
+        self._unload()
+        specs = self.sm.get_app_specs(self.good_tag)
+        self.sm.get_type_specs()
+        self.assertIsNone(self.sm._version_thread)
+        cache = SpecCache(tmp_dir.name)
+        cached = cache.load(kbase_env.env, self.good_tag)
+        self.assertEqual(cached[0], "mock_spec_commit")
+        self.assertCountEqual([spec["info"]["id"] for spec in cached[1]], specs.keys())
+        self.assertIsNotNone(cache.load(kbase_env.env, TYPES_KEY))
+
+        # starting up uses the cache, and the NMS still has the same specs
+        self._unload()
+        with mock.patch.object(
+            MockClients, "list_methods_spec"
+        ) as list_methods_spec, mock.patch.object(
+            SpecManager, "_reload_loaded"
+        ) as reload:
+            self.assertEqual(self.sm.get_app_specs(self.good_tag), specs)
+            self.sm._version_thread.join()
+            list_methods_spec.assert_not_called()
+            reload.assert_not_called()
+        self.assertEqual(self.sm._nms_version, "mock_spec_commit")
+
+        # the NMS has something newer
+        self._unload()
+        with mock.patch.object(
+            MockClients, "status", return_value={"git_spec_commit": "new_commit"}
+        ), mock.patch.object(SpecManager, "_reload_loaded") as reload:
+            self.sm.get_app_specs(self.good_tag)
+            self.sm._version_thread.join()
+            reload.assert_called_once_with()
+            # so anything else loaded after that comes from the NMS
+            self.sm.get_app_specs("beta")
+            self.assertEqual(self.sm.spec_versions["beta"], "new_commit")
+
+        # a reload asks the NMS for its version once, for all the specs
+        with mock.patch.object(
+            MockClients, "status", return_value={"git_spec_commit": "mock_spec_commit"}
+        ) as status:
+            self.sm.reload()
+            status.assert_called_once_with()
+        self.assertEqual(self.sm.spec_versions["beta"], "mock_spec_commit")
+
+        # no cache for this environment, so it's loaded from the NMS
+        self._unload()
+        with mock.patch.dict("os.environ", {"KB_ENVIRONMENT": "appdev"}):
+            self.sm.get_app_specs(self.good_tag)
+        self.assertIsNone(self.sm._version_thread)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+import unittest
+from biokbase.narrative.jobs.statecache import JobStateCache
+
+
+def make_state(job_id, status="completed"):
+    return {"state": {"job_id": job_id, "status": status}, "widget_info": {}}
+
+
+def state_size(state):
+    return len(json.dumps(state))
+
+
+class JobStateCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = JobStateCache(max_entries=3)
+
+    def test_get_put(self):
+        state = make_state("a")
+        self.cache.put("a", state)
+        self.assertEqual(self.cache.get("a"), state)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIn("a", self.cache)
+        self.assertNotIn("b", self.cache)
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["entries"], 1)
+        self.assertEqual(stats["bytes"], state_size(state))
+
+    def test_evict_by_count(self):
+        for job_id in ["a", "b", "c"]:
+            self.cache.put(job_id, make_state(job_id))
+        # using "a" makes "b" the least recently used
+        self.cache.get("a")
+        self.cache.put("d", make_state("d"))
+        self.assertIsNone(self.cache.get("b"))
+        for job_id in ["a", "c", "d"]:
+            self.assertEqual(self.cache.get(job_id), make_state(job_id))
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+        self.assertEqual(len(self.cache), 3)
+
+    def test_evict_by_bytes(self):
+        size = state_size(make_state("a"))
+        self.cache.configure(max_entries=10, max_bytes=size * 2)
+        for job_id in ["a", "b", "c"]:
+            self.cache.put(job_id, make_state(job_id))
+        self.assertNotIn("a", self.cache)
+        self.assertEqual(self.cache.stats()["bytes"], size * 2)
+
+    def test_replace_entry(self):
+        self.cache.put("a", make_state("a", status="running"))
+        self.cache.put("a", make_state("a"))
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.stats()["bytes"], state_size(make_state("a")))
+        self.assertEqual(self.cache.get("a"), make_state("a"))
+
+    def test_configure_shrinks(self):
+        for job_id in ["a", "b", "c"]:
+            self.cache.put(job_id, make_state(job_id))
+        self.cache.configure(max_entries=1)
+        self.assertEqual(len(self.cache), 1)
+        self.assertIn("c", self.cache)
+        self.assertEqual(self.cache.stats()["evictions"], 2)
+
+    def test_configure_bad(self):
+        with self.assertRaises(ValueError) as e:
+            self.cache.configure(max_entries=0)
+        self.assertIn("max entries must be at least 1", str(e.exception))
+        with self.assertRaises(ValueError) as e:
+            self.cache.configure(max_bytes=0)
+        self.assertIn("max bytes must be at least 1", str(e.exception))
+
+    def test_spill_to_disk(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            self.cache.configure(max_entries=1, spill_dir=spill_dir)
+            self.cache.put("a", make_state("a"))
+            self.cache.put("b", make_state("b"))
+            self.assertEqual(len(self.cache), 1)
+            self.assertIn("a", self.cache)
+            self.assertEqual(os.listdir(spill_dir), ["a.json"])
+
+            # reading it back brings it into memory, and spills "b" instead
+            self.assertEqual(self.cache.get("a"), make_state("a"))
+            self.assertEqual(os.listdir(spill_dir), ["b.json"])
+            stats = self.cache.stats()
+            self.assertEqual(stats["spill_hits"], 1)
+            self.assertEqual(stats["evictions"], 2)
+
+            self.cache.remove("b")
+            self.assertNotIn("b", self.cache)
+            self.assertEqual(os.listdir(spill_dir), [])
+
+    def test_clear(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            self.cache.configure(max_entries=1, spill_dir=spill_dir)
+            self.cache.put("a", make_state("a"))
+            self.cache.put("b", make_state("b"))
+            self.cache.clear()
+            self.assertEqual(len(self.cache), 0)
+            self.assertEqual(os.listdir(spill_dir), [])
+            self.assertIsNone(self.cache.get("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+from unittest import mock
+from biokbase.narrative.jobs.tokenpool import AgentTokenPool
+from .test_scheduler import FakeClock
+
+DAY = 24 * 3600
+
+
+class AgentTokenPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.pool = AgentTokenPool(
+            max_age=100, min_lifetime=DAY, refresh_ahead=10, clock=self.clock
+        )
+        self.minted = list()
+        get_patcher = mock.patch(
+            "biokbase.narrative.jobs.tokenpool.auth.get_agent_token",
+            side_effect=self._mint,
+        )
+        self.get_agent_token = get_patcher.start()
+        self.addCleanup(get_patcher.stop)
+        revoke_patcher = mock.patch(
+            "biokbase.narrative.jobs.tokenpool.auth.revoke_token"
+        )
+        self.revoke_token = revoke_patcher.start()
+        self.addCleanup(revoke_patcher.stop)
+
+    def _mint(self, login_token, token_name="NarrativeAgent"):
+        idx = len(self.minted)
+        token = {
+            "id": "id{}".format(idx),
+            "token": "agent{}".format(idx),
+            "name": token_name,
+            "expires": (self.clock() + 7 * DAY) * 1000,
+        }
+        self.minted.append(token)
+        return token
+
+    def _wait_for_refresh(self):
+        for thread in list(self.pool._refreshing.values()):
+            thread.join()
+
+    def test_reuse(self):
+        tokens = [self.pool.get("login", "KBApp_foo") for _ in range(500)]
+        self.assertEqual(self.get_agent_token.call_count, 1)
+        self.assertTrue(all(t is tokens[0] for t in tokens))
+        self.get_agent_token.assert_called_once_with("login", token_name="KBApp_foo")
+
+        # other names and other users get their own
+        self.assertEqual(self.pool.get("login", "KBApp_bar")["token"], "agent1")
+        self.assertEqual(self.pool.get("other_login", "KBApp_foo")["token"], "agent2")
+
+    def test_refresh(self):
+        self.pool.get("login", "KBApp_foo")
+        self.clock.advance(95)
+        self.assertEqual(self.pool.get("login", "KBApp_foo")["token"], "agent0")
+        self._wait_for_refresh()
+        self.assertEqual(self.get_agent_token.call_count, 2)
+
+        # the old one ages out, and the replacement is already there
+        self.clock.advance(10)
+        self.assertEqual(self.pool.get("login", "KBApp_foo")["token"], "agent1")
+        self.assertEqual(self.get_agent_token.call_count, 2)
+        self.revoke_token.assert_not_called()
+
+    def test_refresh_error(self):
+        self.pool.get("login", "KBApp_foo")
+        self.clock.advance(95)
+        self.get_agent_token.side_effect = Exception("auth is down")
+        self.pool.get("login", "KBApp_foo")
+        self._wait_for_refresh()
+        self.get_agent_token.side_effect = self._mint
+        self.clock.advance(10)
+        self.assertEqual(self.pool.get("login", "KBApp_foo")["token"], "agent1")
+        self.assertEqual(self.get_agent_token.call_count, 3)
+
+    def test_min_lifetime(self):
+        self.pool.get("login", "KBApp_foo")
+        self.minted[0]["expires"] = (self.clock() + DAY - 1) * 1000
+        self.assertEqual(self.pool.get("login", "KBApp_foo")["token"], "agent1")
+
+    def test_no_reuse(self):
+        self.pool.configure(max_age=0)
+        self.pool.get("login", "KBApp_foo")
+        self.pool.get("login", "KBApp_foo")
+        self.assertEqual(self.get_agent_token.call_count, 2)
+        self.assertEqual(self.pool._refreshing, dict())
+
+    def test_shutdown(self):
+        self.pool.get("login", "KBApp_foo")
+        self.clock.advance(95)
+        self.pool.get("login", "KBApp_foo")
+        self.pool.shutdown()
+        # only the replacement that never got used is revoked
+        self.revoke_token.assert_called_once_with("login", "id1")
+        self.assertEqual(self.pool.get("login", "KBApp_foo")["token"], "agent2")
+
+    def test_configure_bad(self):
+        with self.assertRaises(ValueError) as e:
+            self.pool.configure(refresh_ahead=-1)
+        self.assertIn(
+            "Agent token pool refresh ahead must not be negative", str(e.exception)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
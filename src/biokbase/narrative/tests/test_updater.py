@@ -1,10 +1,12 @@
 import unittest
+import mock
 from biokbase.narrative.contents.updater import (
     update_narrative,
     find_app_info,
     suggest_apps,
 )
 from .util import TestConfig
+from .narrative_mock.mockclients import get_mock_client
 
 
 class TestKeyError(ValueError):
@@ -12,6 +14,7 @@ class TestKeyError(ValueError):
         ValueError.__init__(self, "Key {} not found in {}".format(keyname, source))
 
 
+@mock.patch("biokbase.narrative.jobs.specmanager.clients.get", get_mock_client)
 class UpdaterTestCase(unittest.TestCase):
     @classmethod
     def setUpClass(self):
@@ -3,7 +3,7 @@ from clustergrammer_widget.clustergrammer import Network
 
 import pandas as pd
 
-import biokbase.narrative.clients as clients
+import biokbase.narrative.objectcache as objectcache
 from biokbase.narrative.app_util import system_variable
 
 
@@ -50,10 +50,9 @@ def get_df(ws_ref, col_attributes=(), row_attributes=(), clustergrammer=False):
     :return: A Pandas DataFrame
     """
 
-    ws = clients.get("workspace")
     if "/" not in ws_ref:
         ws_ref = "{}/{}".format(system_variable("workspace"), ws_ref)
-    generic_data = ws.get_objects2({"objects": [{"ref": ws_ref}]})["data"][0]["data"]
+    generic_data = objectcache.get_objects([ws_ref])[0]["data"]
     if not _is_compatible_matrix(generic_data):
         raise ValueError(
             "{} is not a compatible data type for this viewer. Data type must "
@@ -101,10 +100,8 @@ def _get_categories(
     if not attributemapping_ref or whitelist is None:
         return ids
     cat_list = []
-    ws = clients.get("workspace")
-    attribute_data = ws.get_objects2(
-        {"objects": [{"ref": matrix_ref + ";" + attributemapping_ref}]}
-    )["data"][0]["data"]
+    attribute_ref = matrix_ref + ";" + attributemapping_ref
+    attribute_data = objectcache.get_objects([attribute_ref])[0]["data"]
 
     if not mapping:
         mapping = {x: x for x in ids}
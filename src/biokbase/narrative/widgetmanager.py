@@ -6,8 +6,8 @@ from IPython.display import Javascript
 from jinja2 import Template
 from biokbase.narrative.jobs.specmanager import SpecManager
 import biokbase.narrative.clients as clients
+import biokbase.narrative.objectcache as objectcache
 from biokbase.narrative.app_util import (
-    map_outputs_from_state,
     validate_parameters,
     check_tag,
     system_variable,
@@ -23,6 +23,22 @@ KBase JavaScript widgets.
 __author__ = "Bill Riehl <wjriehl@lbl.gov>"
 
 
+class _WidgetInfo(dict):
+    """
+    A dict of tag -> widget info that loads each tag's widget info when it's first
+    looked up.
+    """
+
+    def __init__(self, load_tag):
+        super().__init__()
+        self._load_tag = load_tag
+
+    def __missing__(self, tag):
+        info = self._load_tag(tag)
+        self[tag] = info
+        return info
+
+
 class WidgetManager(object):
     """
     Manages data (and other) visualization widgets for use in the KBase Narrative.
@@ -31,7 +47,8 @@ class WidgetManager(object):
     1. Instantiate the manager:
        wm = WidgetManager()
 
-    This loads the widget info. If things have changed, reload_info can be used to update the known widgets.
+    The widget info for each tag is loaded the first time it's used. If things have changed, reload_info can be
+    used to update the known widgets.
 
     2. wm.widget_info
     This contains a large dictionary of KBase widget info as reported by the Narrative Method Store.
@@ -75,13 +92,11 @@ class WidgetManager(object):
 
     def _load_all_widget_info(self):
         """
-        Loads all widget info and stores it in this object.
-        It does this by calling load_widget_info on all available tags.
+        Returns a dict of tag -> widget info, which calls load_widget_info for each tag
+        the first time it's looked up, so only the specs for tags that get used are
+        walked (or loaded).
         """
-        info = dict()
-        for tag in self._version_tags:
-            info[tag] = self.load_widget_info(tag)
-        return info
+        return _WidgetInfo(self.load_widget_info)
 
     def load_widget_info(self, tag="release", verbose=False):
         """
@@ -104,7 +119,7 @@ class WidgetManager(object):
         """
         check_tag(tag, raise_exception=True)
 
-        methods = list(self._sm.app_specs[tag].values())
+        methods = list(self._sm.get_app_specs(tag).values())
         all_widgets = dict()
         """
         keys = widget names / namespaced require path / etc.
@@ -655,15 +670,12 @@ class WidgetManager(object):
         widget_name = "widgets/function_output/kbaseDefaultObjectView"  # set as default, overridden below
         widget_data = dict()
         upas = dict()
-        info_tuple = clients.get("workspace").get_object_info_new(
-            {"objects": [{"ref": upa}], "includeMetadata": 1}
-        )[0]
+        info_tuple = objectcache.get_object_info([upa], include_metadata=True)[0]
         bare_type = info_tuple[2].split("-")[0]
-        type_module = bare_type.split(".")[0]
 
-        type_spec = self._sm.get_type_spec(bare_type, raise_exception=False)
+        viewer = self._sm.get_viewer(bare_type, tag=tag)
 
-        if type_spec is None:
+        if viewer is None:
             widget_data = {
                 "error": {
                     "msg": f"Unable to find viewer specification for objects of type {bare_type}.",
@@ -672,52 +684,34 @@ class WidgetManager(object):
                 }
             }
             upas["upas"] = [upa]  # doompety-doo
-        else:
-            if not type_spec.get("view_method_ids"):
-                return f"No viewer found for objects of type {bare_type}"
-            app_id = type_spec["view_method_ids"][0]
-            app_spec = None
-            try:
-                app_spec = self._sm.get_spec(app_id, tag=tag)
-            except Exception as e:
-                widget_data = {
-                    "error": {
-                        "msg": f"Unable to find specification for viewer app {app_id}",
-                        "method_name": "WidgetManager.show_data_widget",
-                        "traceback": e.message,
-                    }
+        elif viewer.app_id is None:
+            return f"No viewer found for objects of type {bare_type}"
+        elif viewer.error is not None:
+            widget_data = {
+                "error": {
+                    "msg": f"Unable to find specification for viewer app {viewer.app_id}",
+                    "method_name": "WidgetManager.show_data_widget",
+                    "traceback": viewer.error,
                 }
-            if app_spec is not None:
-                spec_params = self._sm.app_params(app_spec)
-                input_params = {}
-                is_ref_path = ";" in upa
-                is_external = info_tuple[7] != os.environ["KB_WORKSPACE_ID"]
-                # it's not safe to use reference yet (until we switch to them all over the Apps)
-                # But in case we deal with ref-path we have to do it anyway:
-                obj_param_value = upa if (is_ref_path or is_external) else info_tuple[1]
-                upa_params = list()
-                for param in spec_params:
-                    if param.get("allowed_types") is None or any(
-                        (t == bare_type or t == type_module)
-                        for t in param.get("allowed_types", [])
-                    ):
-                        input_params[param["id"]] = obj_param_value
-                        upa_params.append(param["id"])
-
-                (input_params, ws_refs) = validate_parameters(
-                    app_id, tag, spec_params, input_params
-                )
-                (widget_name, widget_data) = map_outputs_from_state(
-                    [], input_params, app_spec
-                )
+            }
+        else:
+            is_ref_path = ";" in upa
+            is_external = info_tuple[7] != os.environ["KB_WORKSPACE_ID"]
+            # it's not safe to use reference yet (until we switch to them all over the Apps)
+            # But in case we deal with ref-path we have to do it anyway:
+            obj_param_value = upa if (is_ref_path or is_external) else info_tuple[1]
+            input_params = dict(
+                (param_id, obj_param_value) for param_id in viewer.object_params
+            )
+
+            (input_params, ws_refs) = validate_parameters(
+                viewer.app_id, tag, viewer.plan.spec_params, input_params
+            )
+            (widget_name, widget_data) = viewer.plan.map_outputs([], input_params)
 
-                # Figure out params for upas.
-                for mapping in app_spec.get("behavior", {}).get("output_mapping", []):
-                    if (
-                        mapping.get("input_parameter", "") in upa_params
-                        and "target_property" in mapping
-                    ):
-                        upas[mapping["target_property"]] = upa
+            # Figure out params for upas.
+            for target_property in viewer.upa_targets:
+                upas[target_property] = upa
 
         return self.show_output_widget(
             widget_name,
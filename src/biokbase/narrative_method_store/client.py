@@ -127,6 +127,9 @@ class _JSONObjectEncoder(_json.JSONEncoder):
 
 
 class NarrativeMethodStore(object):
+    # an optional requests.Session to make calls with, so connections can be reused
+    session = None
+
     def __init__(
         self,
         url=None,
@@ -179,7 +182,7 @@ class NarrativeMethodStore(object):
         }
 
         body = _json.dumps(arg_hash, cls=_JSONObjectEncoder)
-        ret = _requests.post(
+        ret = (self.session or _requests).post(
             self.url,
             data=body,
             headers=self._headers,
@@ -120,6 +120,9 @@ class _JSONObjectEncoder(_json.JSONEncoder):
 
 
 class Client(object):
+    # an optional requests.Session to make calls with, so connections can be reused
+    session = None
+
     def __init__(
         self,
         url=None,
@@ -176,7 +179,7 @@ class Client(object):
             arg_hash["context"] = json_rpc_context
 
         body = _json.dumps(arg_hash, cls=_JSONObjectEncoder)
-        ret = _requests.post(
+        ret = (self.session or _requests).post(
             url,
             data=body,
             headers=self._headers,
@@ -112,6 +112,8 @@ define(['jobCommChannel', 'base/js/namespace', 'common/runtime'], (
             ['request-job-completion', { jobId: 'someJob' }],
             ['request-job-log', { jobId: 'someJob', options: {} }],
             ['request-latest-job-log', { jobId: 'someJob', options: {} }],
+            ['request-job-log-stream', { jobId: 'someJob', options: { first_line: 0 } }],
+            ['request-job-log-stream-stop', { jobId: 'someJob' }],
             ['request-job-info', { jobId: 'someJob', parentJobId: 'someParent' }],
         ];
         busMsgCases.forEach((testCase) => {
@@ -210,6 +212,72 @@ define(['jobCommChannel', 'base/js/namespace', 'common/runtime'], (
             });
         });
 
+        it('Should apply a full job_status_delta, and delete removed jobs', () => {
+            const msg = makeCommMsg('job_status_delta', {
+                protocol: 1,
+                seq: 5,
+                full: true,
+                states: {
+                    id1: { state: { job_id: 'id1' } },
+                },
+                removed: ['deletedJob'],
+            });
+            const comm = new JobCommChannel();
+            comm.jobStates['deletedJob'] = { state: { job_id: 'deletedJob' } };
+            // not looked up by the kernel yet, so it's not in the states
+            comm.jobStates['unseenJob'] = { state: { job_id: 'unseenJob' } };
+            spyOn(testBus, 'send');
+            return comm.initCommChannel().then(() => {
+                spyOn(comm, 'sendCommMessage');
+                comm.handleCommMessages(msg);
+                expect(testBus.send).toHaveBeenCalledTimes(2);
+                expect(Object.keys(comm.jobStates).sort()).toEqual(['id1', 'unseenJob']);
+                expect(comm.lastStatusSeq).toEqual(5);
+                expect(comm.sendCommMessage).not.toHaveBeenCalled();
+            });
+        });
+
+        it('Should apply a job_status_delta in sequence', () => {
+            const msg = makeCommMsg('job_status_delta', {
+                protocol: 1,
+                seq: 6,
+                full: false,
+                states: {
+                    id2: { state: { job_id: 'id2' } },
+                },
+                removed: ['id1'],
+            });
+            const comm = new JobCommChannel();
+            comm.jobStates['id1'] = { state: { job_id: 'id1' } };
+            comm.jobStates['id3'] = { state: { job_id: 'id3' } };
+            comm.lastStatusSeq = 5;
+            spyOn(testBus, 'send');
+            return comm.initCommChannel().then(() => {
+                spyOn(comm, 'sendCommMessage');
+                comm.handleCommMessages(msg);
+                expect(testBus.send).toHaveBeenCalledTimes(2);
+                expect(Object.keys(comm.jobStates).sort()).toEqual(['id2', 'id3']);
+                expect(comm.sendCommMessage).not.toHaveBeenCalled();
+            });
+        });
+
+        it('Should request a resync after a gap in job_status_delta messages', () => {
+            const msg = makeCommMsg('job_status_delta', {
+                protocol: 1,
+                seq: 8,
+                full: false,
+                states: {},
+                removed: [],
+            });
+            const comm = new JobCommChannel();
+            comm.lastStatusSeq = 5;
+            return comm.initCommChannel().then(() => {
+                spyOn(comm, 'sendCommMessage');
+                comm.handleCommMessages(msg);
+                expect(comm.sendCommMessage).toHaveBeenCalledWith('resync_job_status');
+            });
+        });
+
         it('Should send a job-info message to the bus', () => {
             const jobId = 'foo',
                 jobStateMsg = {
@@ -324,6 +392,33 @@ define(['jobCommChannel', 'base/js/namespace', 'common/runtime'], (
             });
         });
 
+        it('Should send job_log_stream to the bus', () => {
+            const jobId = 'foo-log-stream',
+                msg = makeCommMsg('job_log_stream', {
+                    job_id: jobId,
+                    first: 10,
+                    max_lines: 11,
+                    lines: [{}],
+                    finished: false,
+                }),
+                comm = new JobCommChannel();
+            spyOn(testBus, 'send');
+            return comm.initCommChannel().then(() => {
+                comm.handleCommMessages(msg);
+                expect(testBus.send).toHaveBeenCalledWith(
+                    {
+                        jobId: jobId,
+                        logs: msg.content.data.content,
+                        finished: false,
+                    },
+                    {
+                        channel: { jobId: jobId },
+                        key: { type: 'job-log-stream' },
+                    }
+                );
+            });
+        });
+
         const errCases = {
             cancel_job: 'job-cancel-error',
             job_logs: 'job-log-deleted',